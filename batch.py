@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Configuration
+from generator_agent import GeneratorAgent
+from transformator_agent import TRANSFORM_MODES, TransformatorAgent
+from sample_templates import SAMPLE_MODES, load_sample_templates
+
+"""
+Batch mode: runs generate/transform jobs from a JSONL file on concurrent workers that share
+the schema index, the configuration and the model client. One job per line:
+
+    {"id": "vpc", "type": "generate", "instructions": "Create a VPC...", "samples": ["sample.yml"], "sample_mode": "digest", "output": "vpc.yml"}
+    {"id": "tags", "type": "transform", "instructions": "Add tags...", "template": "stack.yml", "output": "stack.yml"}
+"""
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts of up to capacity requests.
+    acquire() blocks until a token is available. Safe to share between threads.
+    """
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def check_job(job: dict, default_id: str) -> dict:
+    """
+    Fills in the id and type of a job and raises ValueError if the job cannot be run.
+    """
+    job.setdefault("id", default_id)
+    job.setdefault("type", "transform" if job.get("template") else "generate")
+    if job["type"] not in ("generate", "transform"):
+        raise ValueError(f"Job {job['id']} has an invalid type: {job['type']}")
+    if not isinstance(job.get("instructions"), str):
+        raise ValueError(f"Job {job['id']} has no instructions")
+    if job["type"] == "transform" and not job.get("template"):
+        raise ValueError(f"Job {job['id']} has no template to transform")
+    if job.get("sample_mode", "full") not in SAMPLE_MODES:
+        raise ValueError(f"Job {job['id']} has an invalid sample mode: {job['sample_mode']}")
+    if job.get("mode", "full") not in TRANSFORM_MODES:
+        raise ValueError(f"Job {job['id']} has an invalid transform mode: {job['mode']}")
+    return job
+
+
+def load_jobs(path: str) -> list[dict]:
+    jobs = []
+    with open(path, "r") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            jobs.append(check_job(json.loads(line), str(number)))
+    return jobs
+
+
+def run_job(job: dict, config: Configuration) -> tuple[str, dict]:
+    """
+    Runs a single job and returns the template with statistics of the agent run.
+    """
+    if job["type"] == "transform":
+        with open(job["template"], "r") as f:
+            source_template = f.read()
+        agent = TransformatorAgent(config)
+        template = agent.transform_template(job["instructions"], source_template, job.get("mode", "full"))
+    else:
+        agent = GeneratorAgent(config)
+        template = agent.create_template(job["instructions"], load_sample_templates(job.get("samples", []), job.get("sample_mode", "full")))
+    if job.get("output"):
+        with open(job["output"], "w") as f:
+            f.write(template)
+    # A transformation that fell back from the diff mode ran two sessions, both count
+    sessions = agent.sessions
+    return template, {
+        "iterations": sum(len(session.budget.history) for session in sessions),
+        "prompt_tokens": [tokens for session in sessions for tokens in session.budget.history],
+        "cached_tokens": [iteration["cached_tokens"] for session in sessions for iteration in session.iterations],
+        "tool_calls": sum(turn["calls"] for turn in agent.tools.turns),
+        "problems": [problems for session in sessions for problems in session.validations],
+        **({"mode": agent.mode, "sent": agent.sent, "fallback": agent.fallback} if job["type"] == "transform" else {}),
+    }
+
+
+def run_with_retries(job: dict, config: Configuration, retries: int, backoff: float) -> dict:
+    start = time.perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        attempt_start = time.perf_counter()
+        try:
+            template, stats = run_job(job, config)
+            return {
+                "id": job["id"],
+                "type": job["type"],
+                "status": "ok",
+                "attempts": attempt,
+                "seconds": round(time.perf_counter() - start, 3),
+                "last_attempt_seconds": round(time.perf_counter() - attempt_start, 3),
+                "output": job.get("output"),
+                "template": None if job.get("output") else template,
+                **stats,
+            }
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            if attempt <= retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return {
+        "id": job["id"],
+        "type": job["type"],
+        "status": "error",
+        "attempts": retries + 1,
+        "seconds": round(time.perf_counter() - start, 3),
+        "error": error,
+    }
+
+
+def run_batch(jobs_path: str, results_path: str, config: Configuration, workers: int = 4, retries: int = 2, backoff: float = 1.0) -> dict:
+    """
+    Runs all jobs on a pool of workers and appends one result per line to results_path as the jobs finish.
+    Returns a summary of the batch.
+    """
+    jobs = load_jobs(jobs_path)
+    start = time.perf_counter()
+    failed = 0
+    with open(results_path, "w") as results, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_with_retries, job, config, retries, backoff) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += result["status"] != "ok"
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+            print(f"[{result['status']}] {result['id']} in {result['seconds']}s")
+    seconds = time.perf_counter() - start
+    return {
+        "jobs": len(jobs),
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "jobs_per_second": round(len(jobs) / seconds, 3) if seconds else None,
+    }
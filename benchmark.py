@@ -0,0 +1,1003 @@
+import argparse
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+
+"""
+Benchmarks for the schema database and lookup paths. Everything runs against a synthetic
+CloudformationSchema.zip so no network access or real db directory is needed.
+
+    python benchmark.py startup --schemas 1400
+    python benchmark.py coldstart --schemas 1400
+    python benchmark.py update --schemas 400
+    python benchmark.py lookup --schemas 1400
+    python benchmark.py payload requests.jsonl
+    python benchmark.py batch --jobs 40 --workers 8
+    python benchmark.py cache --prompts 20
+    python benchmark.py codec --schemas 200
+    python benchmark.py pack --schemas 1400
+    python benchmark.py validate --resources 500
+    python benchmark.py transform --resources 300
+    python benchmark.py samples --samples 3
+    python benchmark.py suite --save benchmark-baseline.json
+    python benchmark.py suite --compare benchmark-baseline.json
+"""
+
+SERVICES = {
+    "S3": ["Bucket", "BucketPolicy", "AccessPoint", "MultiRegionAccessPoint", "StorageLens"],
+    "EC2": ["VPC", "Subnet", "RouteTable", "Route", "NatGateway", "InternetGateway", "SecurityGroup",
+            "LaunchTemplate", "Instance", "Volume", "EIP", "VPCEndpoint", "SubnetRouteTableAssociation",
+            "VPCGatewayAttachment", "NetworkInterface", "TransitGateway", "TransitGatewayAttachment"],
+    "RDS": ["DBInstance", "DBCluster", "DBSubnetGroup", "DBParameterGroup", "DBClusterParameterGroup"],
+    "IAM": ["Role", "Policy", "ManagedPolicy", "InstanceProfile", "User", "Group"],
+    "Lambda": ["Function", "Permission", "EventSourceMapping", "Alias", "Version", "LayerVersion"],
+    "DynamoDB": ["Table", "GlobalTable"],
+    "SNS": ["Topic", "Subscription", "TopicPolicy"],
+    "SQS": ["Queue", "QueuePolicy"],
+    "ECS": ["Cluster", "Service", "TaskDefinition", "CapacityProvider"],
+    "ElasticLoadBalancingV2": ["LoadBalancer", "Listener", "ListenerRule", "TargetGroup"],
+    "CloudFront": ["Distribution", "OriginAccessControl", "CachePolicy", "Function"],
+    "Logs": ["LogGroup", "MetricFilter", "SubscriptionFilter"],
+    "KMS": ["Key", "Alias"],
+    "SecretsManager": ["Secret", "RotationSchedule"],
+    "AutoScaling": ["AutoScalingGroup", "LaunchConfiguration", "ScalingPolicy"],
+    "ApiGateway": ["RestApi", "Resource", "Method", "Deployment", "Stage"],
+    "Route53": ["HostedZone", "RecordSet", "HealthCheck"],
+    "CloudWatch": ["Alarm", "Dashboard"],
+    "Events": ["Rule", "EventBus"],
+    "StepFunctions": ["StateMachine", "Activity"],
+}
+
+WORDS = ["Access", "Analytics", "Application", "Backup", "Capacity", "Configuration", "Connection",
+         "Data", "Delivery", "Deployment", "Domain", "Endpoint", "Environment", "Firewall", "Gateway",
+         "Group", "Identity", "Integration", "Job", "Layer", "Network", "Notification", "Pipeline",
+         "Profile", "Replication", "Repository", "Resolver", "Schedule", "Storage", "Stream", "Task",
+         "Template", "Trigger", "Workflow", "Workspace"]
+
+# The properties of the resources in the template of the stub model
+STUB_PROPERTIES = {
+    "AWS::EC2::VPC": {"CidrBlock": {"type": "string", "description": "The IPv4 network range for the VPC"}},
+    "AWS::EC2::Subnet": {"VpcId": {"type": "string", "description": "The ID of the VPC the subnet is in"},
+                         "CidrBlock": {"type": "string", "description": "The IPv4 CIDR block assigned to the subnet"}},
+}
+
+
+def synthetic_type_names(count: int, seed: int = 0) -> list[str]:
+    """
+    Returns realistic looking type names: the common ones first, then generated combinations.
+    """
+    rng = random.Random(seed)
+    names = [f"AWS::{service}::{resource}" for service, resources in SERVICES.items() for resource in resources]
+    services = list(SERVICES.keys()) + [f"Service{i}" for i in range(60)]
+    seen = set(names)
+    while len(names) < count:
+        name = f"AWS::{rng.choice(services)}::{rng.choice(WORDS)}{rng.choice(WORDS)}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names[:count]
+
+
+def synthetic_schema(type_name: str, rng: random.Random) -> dict:
+    """
+    Builds a schema with the same shape as the ones published by AWS: properties, definitions referenced
+    with $ref, handlers and the lists of read-only and create-only properties.
+    """
+    definitions = {}
+    for i in range(rng.randint(2, 12)):
+        definitions[f"Definition{i}"] = {
+            "type": "object",
+            "description": " ".join(rng.choice(WORDS).lower() for _ in range(rng.randint(8, 40))),
+            "additionalProperties": False,
+            "properties": {
+                f"{rng.choice(WORDS)}{j}": {"type": rng.choice(["string", "integer", "boolean"]),
+                                             "description": " ".join(rng.choice(WORDS).lower() for _ in range(12))}
+                for j in range(rng.randint(2, 8))
+            },
+        }
+    properties = {}
+    for i in range(rng.randint(5, 40)):
+        name = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}"
+        if definitions and rng.random() < 0.4:
+            properties[name] = {"$ref": f"#/definitions/{rng.choice(list(definitions))}"}
+        elif rng.random() < 0.2:
+            properties[name] = {"type": "array", "uniqueItems": False, "items": {"type": "string"}}
+        else:
+            properties[name] = {"type": rng.choice(["string", "integer", "boolean"]),
+                                "description": " ".join(rng.choice(WORDS).lower() for _ in range(rng.randint(5, 60)))}
+    names = list(properties)
+    required = rng.sample(names, k=min(len(names), rng.randint(0, 3)))
+    if type_name in STUB_PROPERTIES:
+        # The template of the stub model has to pass the validation
+        properties.update(STUB_PROPERTIES[type_name])
+        required = []
+    return {
+        "typeName": type_name,
+        "description": f"Resource Type definition for {type_name}",
+        "sourceUrl": "https://github.com/aws-cloudformation/aws-cloudformation-resource-providers",
+        "additionalProperties": False,
+        "properties": properties,
+        "definitions": definitions,
+        "required": required,
+        "createOnlyProperties": [f"/properties/{n}" for n in rng.sample(names, k=min(len(names), 2))],
+        "readOnlyProperties": [f"/properties/{names[0]}"],
+        "primaryIdentifier": [f"/properties/{names[0]}"],
+        "handlers": {action: {"permissions": [f"svc:{action.capitalize()}{w}" for w in WORDS[:10]]}
+                     for action in ["create", "read", "update", "delete", "list"]},
+    }
+
+
+def synthetic_zip(count: int, seed: int = 0) -> bytes:
+    """
+    Returns the bytes of a zip with the same layout as CloudformationSchema.zip.
+    """
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip:
+        for type_name in synthetic_type_names(count, seed):
+            name = type_name.lower().replace("::", "-") + ".json"
+            zip.writestr(name, json.dumps(synthetic_schema(type_name, rng), indent=2))
+    return buffer.getvalue()
+
+
+@contextlib.contextmanager
+def workdir():
+    """
+    Runs the block in a temporary working directory, update_database writes to ./db.
+    """
+    previous = os.getcwd()
+    path = tempfile.mkdtemp(prefix="cfn-bench-")
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def build_db(zip_bytes: bytes):
+    """
+    Converts the zip into ./db the same way update_database does.
+    """
+    from update import last_update, update_schema_file
+    from manifest import write_manifest
+    last_update()
+    entries = []
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip:
+        for file in zip.namelist():
+            entry = update_schema_file(zip, file)
+            if entry:
+                entries.append(entry)
+    write_manifest("db", entries)
+
+
+def timed(function, repeat: int = 1) -> float:
+    """
+    Returns the best wall time of the function in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class SchemaServer(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for schema.cloudformation.<region>.amazonaws.com. It serves the zip
+    set with publish() and answers conditional requests with 304 like S3 does.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SchemaRequestHandler)
+        self.requests = []
+        self.publish(b"")
+
+    def publish(self, content: bytes):
+        self.content = content
+        self.etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        self.last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/CloudformationSchema.zip"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class SchemaRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server: SchemaServer = self.server
+        not_modified = (self.headers.get("If-None-Match") == server.etag or
+                        (self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == server.last_modified))
+        server.requests.append(304 if not_modified else 200)
+        if not_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(server.content)))
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", server.last_modified)
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def modified_zip(zip_bytes: bytes, count: int, seed: int = 1) -> bytes:
+    """
+    Returns a copy of the zip where the descriptions of the first count schemas changed.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as source, zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as target:
+        for i, name in enumerate(source.namelist()):
+            data = source.read(name)
+            if i < count:
+                schema = json.loads(data)
+                schema["description"] += f" (revision {seed})"
+                data = json.dumps(schema, indent=2).encode("utf-8")
+            target.writestr(name, data)
+    return buffer.getvalue()
+
+
+def bench_update(args):
+    from update import update_database
+    zip_bytes = synthetic_zip(args.schemas)
+    with workdir(), SchemaServer() as server, contextlib.redirect_stdout(io.StringIO()):
+        server.publish(zip_bytes)
+        serial = timed(lambda: update_database(force=True, url=server.url, workers=1))
+        shutil.rmtree("db")
+        parallel = timed(lambda: update_database(force=True, url=server.url, workers=args.workers))
+        not_modified = timed(lambda: update_database(force=True, url=server.url, workers=args.workers))
+        server.publish(modified_zip(zip_bytes, args.changed))
+        incremental = timed(lambda: update_database(force=True, url=server.url, workers=args.workers))
+        responses = list(server.requests)
+    print(f"update_database over {args.schemas} synthetic schemas")
+    print(f"  full, 1 process:         {serial * 1000:10.2f} ms")
+    print(f"  full, {args.workers or os.cpu_count()} processes:        {parallel * 1000:10.2f} ms")
+    print(f"  not modified (304):      {not_modified * 1000:10.2f} ms")
+    print(f"  {args.changed} changed schemas:     {incremental * 1000:10.2f} ms")
+    print(f"  HTTP responses:          {responses}")
+
+
+def fuzzy_queries(type_names: list[str], count: int, seed: int = 0) -> list[tuple[str, str]]:
+    """
+    Returns (query, expected key) pairs in the forms the model uses: spaced words ("ec2 launch template"),
+    the name without AWS:: and names with a typo.
+    """
+    from fuzzyindex import type_name_tokens
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        type_name = rng.choice(type_names)
+        _, tokens = type_name_tokens(type_name)
+        words = [tokens[0]] + tokens[2:] if len(tokens) > 2 else tokens
+        form = rng.randrange(4)
+        if form == 0:
+            query = " ".join(words)
+        elif form == 1:
+            query = type_name.replace("AWS::", "")
+        else:
+            query = type_name if form == 2 else " ".join(words)
+            i = rng.randrange(len(query) - 1)
+            while not query[i].isalpha():
+                i = rng.randrange(len(query) - 1)
+            query = query[:i] + query[i + 1:] if rng.random() < 0.5 else query[:i] + query[i + 1] + query[i] + query[i + 2:]
+        queries.append((query, type_name.lower()))
+    return queries
+
+
+def bench_lookup(args):
+    from fuzzyindex import FuzzyIndex
+    from schemaindex import MIN_SCORE
+    from manifest import aliases_for
+    type_names = synthetic_type_names(args.schemas)
+    queries = fuzzy_queries(type_names, args.queries)
+    keys = {alias: name.lower() for name in type_names for alias in aliases_for(name)}
+
+    start = time.perf_counter()
+    index = FuzzyIndex(type_names)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [index.search(query, 1) for query, _ in queries]
+    indexed = (time.perf_counter() - start) / len(queries)
+    indexed_hits = [bool(r) and r[0][1] >= MIN_SCORE and r[0][0] == expected for r, (_, expected) in zip(results, queries)]
+
+    print(f"Fuzzy lookup over {args.schemas} type names, {len(queries)} queries")
+    print(f"  index build:          {build * 1000:10.2f} ms")
+    print(f"  FuzzyIndex:           {indexed * 1e6:10.1f} us/lookup, recall@1 {sum(indexed_hits) / len(queries):.1%}")
+    try:
+        from fuzzywuzzy import process
+    except ImportError:
+        print("  fuzzywuzzy is not installed, skipping the comparison")
+        return
+    sample = queries[:args.compare]
+    start = time.perf_counter()
+    # The same call as the previous SchemaIndex._closest_key, including the aliases
+    matches = [process.extractOne(query.lower(), keys.keys()) for query, _ in sample]
+    extract = (time.perf_counter() - start) / len(sample)
+    extract_hits = [score > 70 and keys[match] == expected for (match, score), (_, expected) in zip(matches, sample)]
+    agree = sum(1 for (match, _), r in zip(matches, results) if r and keys[match] == r[0][0])
+    print(f"  fuzzywuzzy extractOne:{extract * 1e6:10.1f} us/lookup, recall@1 {sum(extract_hits) / len(sample):.1%} (first {len(sample)} queries)")
+    print(f"  speedup:              {extract / indexed:10.1f}x")
+    print(f"  same top match:       {agree / len(sample):10.1%}")
+
+
+def mentioned_types(index, text: str, min_score: int = 95) -> list[str]:
+    """
+    Finds the resource types a prompt asks for: explicit type names and phrases of up to three words
+    that match a type name almost exactly, e.g. "launch template" or "NatGateway".
+    """
+    found = [t.lower() for t in re.findall(r"[A-Za-z0-9]+::[A-Za-z0-9]+::[A-Za-z0-9]+", text) if t.lower() in index.type_name_dict]
+    words = re.findall(r"[A-Za-z][A-Za-z0-9]+", re.sub(r"[A-Za-z0-9]+::[A-Za-z0-9]+::[A-Za-z0-9]+", " ", text))
+    for size in (3, 2, 1):
+        for i in range(len(words) - size + 1):
+            phrase = " ".join(words[i:i + size])
+            matches = index.search(phrase, 1)
+            if matches and matches[0][1] >= min_score:
+                found.append(matches[0][0])
+    return list(dict.fromkeys(found))
+
+
+def resent_tokens(turns: list[int]) -> int:
+    """
+    Input tokens spent on tool results in one generation when the results of every tool turn
+    are resent with each following model call (one call per turn plus the final one).
+    """
+    return sum(tokens * (len(turns) - i) for i, tokens in enumerate(turns))
+
+
+def bench_payload(args):
+    from schemaindex import SchemaIndex
+    from tokencount import count_tokens, is_exact
+    with open(args.prompts, "r") as f:
+        prompts = [json.loads(line) for line in f if line.strip()]
+    with contextlib.ExitStack() as stack:
+        if args.db:
+            index = SchemaIndex(args.db)
+        else:
+            stack.enter_context(workdir())
+            build_db(synthetic_zip(args.schemas))
+            index = SchemaIndex("db")
+
+        print(f"Tool result tokens per generation ({'tiktoken' if is_exact() else 'approximated'}, "
+              f"{'db ' + args.db if args.db else f'{args.schemas} synthetic schemas'})")
+        print(f"  {'prompt':<12} {'types':>5} {'full schema':>12} {'properties':>12} {'full resent':>12} {'prop resent':>12} {'saved':>7}")
+        totals = [0, 0]
+        for i, prompt in enumerate(prompts):
+            text = " ".join(str(prompt.get(key, "")) for key in ("title", "body", "instructions", "prompt"))
+            types = mentioned_types(index, text, args.min_score)
+            # All schemas in one turn compared to a turn of summaries followed by a turn of the required properties
+            full, summaries, properties = [], [], []
+            for type_name in types:
+                full.append(count_tokens(index.get(type_name)))
+                summaries.append(count_tokens(index.get_property(type_name)))
+                fragments = index.fragments(index.type_name_dict[type_name])
+                properties.extend(count_tokens(index.get_property(type_name, name)) for name in fragments.get("required", []))
+            partial = summaries + properties
+            full_resent, partial_resent = resent_tokens([sum(full)]), resent_tokens([sum(summaries), sum(properties)])
+            totals[0] += full_resent
+            totals[1] += partial_resent
+            name = str(prompt.get("request_id", prompt.get("id", i + 1)))
+            saved = f"{1 - partial_resent / full_resent:.0%}" if full_resent else "-"
+            if args.verbose:
+                print(f"  {name}: {', '.join(types)}")
+            print(f"  {name:<12} {len(types):>5} {sum(full):>12} {sum(partial):>12} {full_resent:>12} {partial_resent:>12} {saved:>7}")
+        if totals[0]:
+            print(f"  total resent tokens: {totals[0]} full schema, {totals[1]} properties ({1 - totals[1] / totals[0]:.0%} saved)")
+
+
+def bench_batch(args):
+    from batch import run_batch, TokenBucket
+    from config import create_configuration
+    from schemaindex import load_schemas
+    from stub import StubClient
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        load_schemas()
+        with open("jobs.jsonl", "w") as f:
+            for i in range(args.jobs):
+                f.write(json.dumps({"id": f"job{i}", "instructions": f"Create a VPC with {i % 4 + 1} subnets"}) + "\n")
+        rate_limiter = TokenBucket(args.rate) if args.rate else None
+        config = create_configuration('stub', rate_limiter=rate_limiter)
+        config.client = StubClient(latency=args.latency)
+        summaries = {workers: run_batch("jobs.jsonl", f"results-{workers}.jsonl", config, workers=workers, retries=0)
+                     for workers in sorted({1, args.workers})}
+    print(f"Batch of {args.jobs} generations on the stub model ({args.latency * 1000:.0f} ms per call"
+          + (f", {args.rate} requests/s" if args.rate else "") + ")")
+    for workers, summary in summaries.items():
+        print(f"  {workers:>3} workers: {summary['seconds']:8.2f} s, {summary['jobs_per_second']:8.2f} jobs/s, {summary['failed']} failed")
+
+
+def bench_cache(args):
+    from config import create_configuration
+    from generator_agent import GeneratorAgent
+    from llmcache import CachingClient
+    from schemaindex import load_schemas
+    from stub import StubClient
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        load_schemas()
+        prompts = [f"Create a VPC with {i} subnets" for i in range(args.prompts)]
+        config = create_configuration('stub', cache_dir="responses", cache_size=args.cache_size * 1024)
+        config.client = CachingClient(StubClient(latency=args.latency), config.client.cache)
+        record = timed(lambda: [GeneratorAgent(config).create_template(prompt) for prompt in prompts])
+        recorded = config.client.cache
+        replay_config = create_configuration('stub', cache_dir="responses", replay=True)
+        replay = timed(lambda: [GeneratorAgent(replay_config).create_template(prompt) for prompt in prompts])
+        replayed = replay_config.client.cache
+    print(f"{args.prompts} generations on the stub model ({args.latency * 1000:.0f} ms per call)")
+    print(f"  record: {record:8.2f} s, {recorded.misses} misses, {len(recorded.entries)} responses, {recorded.size / 1024:.0f} KB, {recorded.evictions} evicted")
+    print(f"  replay: {replay:8.2f} s, {replayed.hits} hits")
+
+
+def bench_startup(args):
+    from schemaindex import SchemaIndex
+    with workdir():
+        build_db(synthetic_zip(args.schemas))
+        full = timed(lambda: SchemaIndex("db", use_manifest=False), args.repeat)
+        manifest = timed(lambda: SchemaIndex("db"), args.repeat)
+    print(f"SchemaIndex startup over {args.schemas} schemas (best of {args.repeat})")
+    print(f"  full YAML parse: {full * 1000:10.2f} ms")
+    print(f"  manifest:        {manifest * 1000:10.2f} ms")
+    print(f"  speedup:         {full / manifest:10.1f}x")
+
+
+def bench_coldstart(args):
+    from update import last_update
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        last_update(create=True)
+        help_seconds = timed(lambda: subprocess.run([sys.executable, main, "--help"], capture_output=True, check=True), args.repeat)
+        runs = {}
+        for name, options in (("update check", []), ("--no-update", ["--no-update"])):
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, main, "--api", "stub", "--output", "out.yml", "--report", "run.json", *options],
+                               input="Create a VPC with two subnets.\n", text=True, capture_output=True, check=True)
+                seconds = time.perf_counter() - start
+                with open("run.json") as f:
+                    report = json.load(f)
+                if name not in runs or seconds < runs[name]["seconds"]:
+                    runs[name] = {"seconds": seconds, "report": report}
+    print(f"Cold start of main.py with {args.schemas} schemas on the stub model (best of {args.repeat})")
+    print(f"  --help: {help_seconds * 1000:.0f} ms")
+    print(f"  {'run':<14}{'wall':>9}{'first resp':>12}{'imports':>10}{'update':>9}{'index':>9}{'waited':>9}")
+    for name, run in runs.items():
+        timers = run["report"]["timers"]
+        seconds = {timer: timers[timer]["sum"] if timer in timers else 0 for timer in ("main.imports", "main.update", "schema.load", "main.index_wait")}
+        print(f"  {name:<14}{run['seconds']:>8.2f}s{run['report']['first_response_seconds']:>11.2f}s"
+              + "".join(f"{value:>8.2f}s" for value in seconds.values()))
+    print("  update and index run in the background during the imports, waited is what the agent waited for them")
+
+
+def evict_page_cache(directory: str):
+    """
+    Asks the kernel to drop the cached pages of the files so the next reads go to the disk.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for name in os.listdir(directory):
+        fd = os.open(os.path.join(directory, name), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def bench_pack(args):
+    from packstore import LAYOUTS
+    from schemaindex import SchemaIndex
+    from update import update_database
+    keys = [name.lower() for name in synthetic_type_names(args.schemas)]
+    results = {}
+    with workdir(), SchemaServer() as server, contextlib.redirect_stdout(io.StringIO()):
+        server.publish(synthetic_zip(args.schemas))
+        update_database(force=True, url=server.url, layout="directory")
+        expected = None
+        for layout in LAYOUTS:
+            # The database is up to date, only its layout is converted
+            update_database(layout=layout)
+            files = os.listdir("db")
+
+            def cold():
+                evict_page_cache("db")
+                index = SchemaIndex("db", cache_bytes=0)
+                return [index.get(key) for key in keys]
+
+            contents = cold()
+            expected = expected or contents
+            assert contents == expected, f"{layout} returned other schemas"
+            index = SchemaIndex("db", cache_bytes=0)
+            results[layout] = {
+                "files": len(files),
+                "bytes": sum(os.path.getsize(os.path.join("db", name)) for name in files),
+                "startup": timed(lambda: SchemaIndex("db"), args.repeat),
+                "cold": timed(cold, args.repeat),
+                "warm": timed(lambda: [index.get(key) for key in keys], args.repeat),
+            }
+    print(f"Schema storage layouts over {args.schemas} synthetic schemas, every lookup reads the storage (best of {args.repeat})")
+    print(f"  {'layout':<12}{'files':>7}{'size':>10}{'startup':>12}{'cold get':>14}{'warm get':>14}")
+    for layout, r in results.items():
+        print(f"  {layout:<12}{r['files']:>7}{r['bytes'] / 1024:>7.0f} KB{r['startup'] * 1000:>9.2f} ms"
+              f"{r['cold'] / len(keys) * 1e6:>11.1f} us{r['warm'] / len(keys) * 1e6:>11.1f} us")
+
+
+def sample_value(node: dict, definitions: dict, rng: random.Random):
+    """
+    A value matching a schema node of the synthetic schemas.
+    """
+    if "$ref" in node:
+        node = definitions[node["$ref"].split("/")[-1]]
+    if "properties" in node:
+        return {name: sample_value(child, definitions, rng) for name, child in node["properties"].items() if rng.random() < 0.5}
+    if node.get("type") == "array":
+        return [sample_value(node["items"], definitions, rng) for _ in range(rng.randint(1, 3))]
+    return {"string": "value", "integer": rng.randint(1, 100), "boolean": True}.get(node.get("type"), "value")
+
+
+def synthetic_template(index, count: int, errors: int, seed: int = 0) -> str:
+    """
+    A template of count resources of random types with valid properties, errors of them get a
+    misspelled property, a missing required property, a value of the wrong shape or an unknown type.
+    """
+    from codec import dump_yaml
+    rng = random.Random(seed)
+    type_names = sorted({index.fragments(file)["typeName"] for file in index.type_name_dict.values()})
+    resources = {}
+    for i in range(count):
+        type_name = rng.choice(type_names)
+        fragments = index.fragments(index.type_name_dict[type_name.lower()])
+        properties = sample_value({"properties": fragments["properties"]}, fragments["definitions"], rng)
+        properties.update({name: sample_value(fragments["properties"][name], fragments["definitions"], rng)
+                           for name in fragments["required"]})
+        resource = {"Type": type_name, "Properties": properties}
+        if resources and rng.random() < 0.3:
+            resource["DependsOn"] = rng.choice(list(resources))
+        resources[f"Resource{i}"] = resource
+    for logical_id in rng.sample(list(resources), k=errors):
+        resource = resources[logical_id]
+        properties = resource["Properties"]
+        required = index.fragments(index.type_name_dict[resource["Type"].lower()])["required"]
+        kind = rng.choice(["typo", "required", "shape", "type"])
+        if kind == "typo" and properties:
+            name = rng.choice(list(properties))
+            properties[name[0].lower() + name[1:]] = properties.pop(name)
+        elif kind == "required" and required:
+            properties.pop(required[0])
+        elif kind == "shape" and properties:
+            properties[next(iter(properties))] = [["nested"]]
+        else:
+            resource["Type"] += "s"
+    return dump_yaml({"AWSTemplateFormatVersion": "2010-09-09", "Resources": resources})
+
+
+def bench_validate(args):
+    from schemaindex import SchemaIndex
+    from validator import TemplateValidator
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        index = SchemaIndex("db")
+        text = synthetic_template(index, args.resources, args.errors)
+        warm = TemplateValidator(index)
+        problems = warm.validate(text)
+        # A new validator compiles the property sets of every type again, the index keeps its fragments
+        cold = timed(lambda: TemplateValidator(index).validate(text), args.repeat)
+        warm_seconds = timed(lambda: warm.validate(text), args.repeat)
+    print(f"Validation of a template of {args.resources} resources ({len(text) / 1024:.0f} KB) against {args.schemas} synthetic schemas (best of {args.repeat})")
+    print(f"  new validator     {cold * 1000:>8.1f} ms")
+    print(f"  reused validator  {warm_seconds * 1000:>8.1f} ms")
+    print(f"  problems found    {len(problems):>8} ({args.errors} injected)")
+    for problem in problems[:5]:
+        print(f"    {problem}")
+
+
+def synthetic_sample(index: int, resources: int, seed: int = 0) -> str:
+    """
+    A sample template written in a consistent house style: parameters with descriptions, numbered
+    logical IDs ending with the resource type, Name and Environment tags and short form functions.
+    """
+    rng = random.Random(seed * 1000 + index)
+    types = [f"AWS::{service}::{resource}" for service, names in SERVICES.items() for resource in names]
+    lines = ["AWSTemplateFormatVersion: '2010-09-09'", f"Description: 'Sample stack {index} of the team'", "",
+             "Parameters:",
+             "  EnvironmentName:", "    Type: String", "    Description: 'Name of the environment, used in the resource names'",
+             "    AllowedValues: [dev, staging, prod]", "    Default: dev",
+             "  VpcCidr:", "    Type: String", "    Description: 'CIDR block of the VPC'", "    Default: '10.0.0.0/16'",
+             "", "Resources:"]
+    names = []
+    for i in range(resources):
+        type_name = rng.choice(types[:12])
+        name = f"{rng.choice(WORDS)}{type_name.split('::')[-1]}{i + 1}"
+        lines += [f"  # {rng.choice(WORDS)} {type_name.split('::')[-1].lower()} of the stack", f"  {name}:", f"    Type: {type_name}", "    Properties:"]
+        for j in range(rng.randint(2, 6)):
+            lines.append(f"      {rng.choice(WORDS)}{j}: '{rng.choice(WORDS).lower()}-{rng.randint(1, 99)}'")
+        if names and rng.random() < 0.5:
+            lines.append(f"      {rng.choice(WORDS)}Id: !Ref {rng.choice(names)}")
+        if names and rng.random() < 0.3:
+            lines.append(f"      {rng.choice(WORDS)}Arn: !GetAtt {rng.choice(names)}.Arn")
+        lines += ["      Tags:", "        - Key: Name", f"          Value: !Sub '${{EnvironmentName}}-{name.lower()}'",
+                  "        - Key: Environment", "          Value: !Ref EnvironmentName", ""]
+        names.append(name)
+    lines += ["Outputs:"]
+    for name in names[:3]:
+        lines += [f"  {name}Id:", f"    Value: !Ref {name}", "    Export:", f"      Name: !Sub '${{AWS::StackName}}-{name}Id'"]
+    return "\n".join(lines) + "\n"
+
+
+def bench_samples(args):
+    import schemaindex
+    from config import Configuration
+    from generator_agent import GeneratorAgent
+    from sample_templates import load_sample_templates
+    from stub import StubClient
+    from tokencount import count_tokens
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        schemaindex.load_schemas()
+        files = []
+        for i in range(args.samples):
+            files.append(f"sample{i}.yml")
+            with open(files[-1], "w") as f:
+                f.write(synthetic_sample(i, args.resources))
+        start = time.perf_counter()
+        load_sample_templates(files, "digest")
+        digest_cold = time.perf_counter() - start
+        digest_cached = timed(lambda: load_sample_templates(files, "digest"), 3)
+
+        results = {}
+        for mode in ("full", "digest"):
+            samples = load_sample_templates(files, mode)
+            agent = GeneratorAgent(Configuration(client=StubClient(latency=args.latency), store=None))
+            start = time.perf_counter()
+            agent.create_template("Create a VPC with a subnet.", samples)
+            iterations = agent.session.iterations
+            results[mode] = {
+                "tokens": count_tokens(samples),
+                "requests": len(iterations),
+                "input": sum(iteration["input_tokens"] for iteration in iterations),
+                "uncached": sum(iteration["uncached_tokens"] for iteration in iterations),
+                "seconds": time.perf_counter() - start,
+            }
+    print(f"{args.samples} sample templates of {args.resources} resources in the system prompt of a generation on the stub model")
+    print(f"  digest built in {digest_cold * 1000:.1f} ms, read from the cache in {digest_cached * 1000:.2f} ms")
+    print(f"  {'mode':<8}{'samples tok':>13}{'requests':>10}{'input tok':>12}{'uncached':>10}{'wall':>10}")
+    for mode, r in results.items():
+        print(f"  {mode:<8}{r['tokens']:>13}{r['requests']:>10}{r['input']:>12}{r['uncached']:>10}{r['seconds']:>9.2f}s")
+
+
+def bench_transform(args):
+    import schemaindex
+    from config import Configuration
+    from stub import StubClient
+    from templatepatch import TemplateText
+    from transformator_agent import TransformatorAgent
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        build_db(synthetic_zip(args.schemas))
+        schemaindex.schemas = schemaindex.SchemaIndex("db")
+        text = synthetic_template(schemaindex.schemas, args.resources, 0)
+        # Comments above the resources, the patched template has to keep them
+        text = re.sub(r"^  (Resource\d+):$", r"  # The \1 resource\n  \1:", text, flags=re.MULTILINE)
+        source = TemplateText(text)
+        target = f"Resource{args.resources // 2}"
+        entry = source.entries["Resources"][target]
+        patch = "Resources:\n" + "".join(source.text_of(entry)[:2]) + "    # Changed by the transformation\n" + "".join(source.text_of(entry)[2:])
+        expected = source.apply(TemplateText(patch))
+        instructions = f"Add a comment to {target} explaining what it is for."
+
+        results = {}
+        for mode, final in (("full", expected), ("diff", patch)):
+            agent = TransformatorAgent(Configuration(client=StubClient(final=final, latency=args.latency), store=None))
+            start = time.perf_counter()
+            transformed = agent.transform_template(instructions, text, mode)
+            seconds = time.perf_counter() - start
+            iterations = [iteration for session in agent.sessions for iteration in session.iterations]
+            results[mode] = {
+                "requests": len(iterations),
+                "input": sum(iteration["input_tokens"] for iteration in iterations),
+                "uncached": sum(iteration["uncached_tokens"] for iteration in iterations),
+                "output": sum(iteration["output_tokens"] for iteration in iterations),
+                "seconds": seconds,
+                "identical": transformed == expected,
+                "sent": agent.sent,
+            }
+    sent = results["diff"]["sent"]
+    print(f"Transforming a template of {args.resources} resources ({len(source.lines)} lines) on the stub model, "
+          f"the diff mode sent {sent['resources']} resources ({sent['lines']} lines)")
+    print(f"  {'mode':<6}{'requests':>10}{'input tok':>12}{'uncached':>10}{'output tok':>12}{'wall':>10}{'estimated':>11}  result")
+    for mode, r in results.items():
+        # The stub answers at once, a model needs time for every output token
+        estimated = r["seconds"] + r["output"] / args.tokens_per_second
+        print(f"  {mode:<6}{r['requests']:>10}{r['input']:>12}{r['uncached']:>10}{r['output']:>12}{r['seconds']:>9.2f}s{estimated:>10.1f}s  "
+              f"{'as expected' if r['identical'] else 'DIFFERENT'}")
+    if not all(r["identical"] for r in results.values()):
+        raise SystemExit(1)
+
+
+def bench_codec(args):
+    import yaml
+    from codec import c_extensions, dump_yaml, load_json, load_yaml
+    from update import cleanup_schema, inline_definitions
+    with zipfile.ZipFile(io.BytesIO(synthetic_zip(args.schemas))) as archive:
+        members = [archive.read(name) for name in archive.namelist()]
+
+    def render(loads, dump):
+        return [dump(inline_definitions(cleanup_schema(loads(data)))) for data in members]
+
+    # The previous implementation: json module and the pure Python dumper
+    before_render = timed(lambda: render(lambda data: json.loads(data.decode("utf-8")),
+                                         lambda content: yaml.dump(content, default_flow_style=False, sort_keys=False, width=1000)), args.repeat)
+    after_render = timed(lambda: render(load_json, dump_yaml), args.repeat)
+    before = render(lambda data: json.loads(data.decode("utf-8")), lambda content: yaml.dump(content, default_flow_style=False, sort_keys=False, width=1000))
+    after = render(load_json, dump_yaml)
+    identical = sum(1 for a, b in zip(before, after) if a == b)
+
+    before_load = timed(lambda: [yaml.safe_load(text) for text in before], args.repeat)
+    after_load = timed(lambda: [load_yaml(text) for text in before], args.repeat)
+    before_json = timed(lambda: [json.loads(data.decode("utf-8")) for data in members], args.repeat)
+    after_json = timed(lambda: [load_json(data) for data in members], args.repeat)
+
+    print(f"Codecs over {args.schemas} synthetic schemas (best of {args.repeat}), C extensions: {c_extensions()}")
+    print(f"  {'':<28}{'before':>12}{'after':>12}{'speedup':>10}")
+    for name, b, a in [("parse JSON members", before_json, after_json), ("render db YAML (update)", before_render, after_render),
+                       ("parse db YAML (fallback)", before_load, after_load)]:
+        print(f"  {name:<28}{b * 1000:>9.1f} ms{a * 1000:>9.1f} ms{b / a:>9.1f}x")
+    print(f"  byte-identical db files:  {identical}/{len(before)}")
+    if identical != len(before):
+        raise SystemExit(1)
+
+
+def measure(run, setup=None, ops: int = 1, repeat: int = 3, min_seconds: float = 0.2) -> dict:
+    """
+    Runs run(setup()) at least repeat times, fast stages until they ran for min_seconds, and returns
+    the best throughput. The peak memory is traced in an extra run because tracemalloc slows
+    everything down. setup is not measured.
+    """
+    setup = setup or (lambda: None)
+    best = float("inf")
+    total = 0.0
+    runs = 0
+    while runs < repeat or (total < min_seconds and runs < 100):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops": ops, "seconds": round(best, 6), "ops_per_second": round(ops / best, 2), "peak_kb": round(peak / 1024, 1)}
+
+
+def suite_stages(args) -> dict:
+    """
+    The hot paths of the schema pipeline and the lookups, and a whole agent loop on the stub model.
+    """
+    import schemaindex
+    from config import Configuration
+    from generator_agent import GeneratorAgent
+    from stub import StubClient
+    from update import cleanup_schema, inline_definitions, update_schema_file, decode_member
+
+    zip_bytes = synthetic_zip(args.schemas, args.seed)
+    type_names = synthetic_type_names(args.schemas, args.seed)
+    queries = [query for query, _ in fuzzy_queries(type_names, args.queries, args.seed)]
+    exact = [name.lower() for name in random.Random(args.seed).choices(type_names, k=args.queries)]
+    stages = {}
+    with workdir(), contextlib.redirect_stdout(io.StringIO()):
+        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zip:
+            members = [(name, zip.read(name)) for name in zip.namelist()]
+
+            def write_all(_):
+                os.makedirs("db", exist_ok=True)
+                for name, _ in members:
+                    update_schema_file(zip, name)
+
+            stages["update_schema_file"] = measure(write_all, ops=len(members), repeat=args.repeat)
+        build_db(zip_bytes)
+
+        stages["cleanup_schema"] = measure(lambda schemas: [cleanup_schema(schema) for schema in schemas],
+                                           lambda: [decode_member(name, data) for name, data in members], len(members), args.repeat)
+        cleaned = [cleanup_schema(decode_member(name, data)) for name, data in members]
+        stages["inline_definitions"] = measure(lambda _: [inline_definitions(schema) for schema in cleaned],
+                                               ops=len(cleaned), repeat=args.repeat)
+
+        stages["index_manifest"] = measure(lambda _: schemaindex.SchemaIndex("db"), repeat=args.repeat)
+        stages["index_yaml"] = measure(lambda _: schemaindex.SchemaIndex("db", use_manifest=False), repeat=1)
+
+        index = schemaindex.SchemaIndex("db")
+        index.fuzzy_index
+        stages["closest_key_exact"] = measure(lambda _: [index._closest_key(query) for query in exact], ops=len(exact), repeat=args.repeat)
+        stages["closest_key_fuzzy"] = measure(lambda _: [index._closest_key(query) for query in queries], ops=len(queries), repeat=args.repeat)
+
+        def cold():
+            index.cache.clear()
+            index.queries.clear()
+        stages["get_cold"] = measure(lambda _: [index.get(query) for query in exact], cold, len(exact), args.repeat)
+        stages["get_warm"] = measure(lambda _: [index.get(query) for query in exact], ops=len(exact), repeat=args.repeat)
+
+        schemaindex.schemas = index
+        config = Configuration(client=StubClient(), store=None)
+        prompts = [f"Create a VPC with {i % 4 + 1} subnets" for i in range(args.agent_runs)]
+
+        def agent_loop(_):
+            for prompt in prompts:
+                GeneratorAgent(config).create_template(prompt)
+        stages["agent_loop"] = measure(agent_loop, cold, len(prompts), args.repeat)
+    return stages
+
+
+def compare_results(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """
+    Returns the regressions: stages that are slower, or use more memory, than the baseline by more than tolerance.
+    """
+    regressions = []
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        if stage["ops_per_second"] < before["ops_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {stage['ops_per_second']} ops/s, baseline {before['ops_per_second']} ops/s")
+        if stage["peak_kb"] > before["peak_kb"] * (1 + tolerance) + 64:
+            regressions.append(f"{name}: peak {stage['peak_kb']} KB, baseline {before['peak_kb']} KB")
+    return regressions
+
+
+def bench_suite(args):
+    settings = {"schemas": args.schemas, "seed": args.seed, "queries": args.queries, "agent_runs": args.agent_runs}
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            raise SystemExit(f"The baseline was measured with {baseline['settings']}, run the suite with the same settings.")
+    results = {"settings": settings, "stages": suite_stages(args)}
+
+    print(f"Benchmark suite over {args.schemas} synthetic schemas (best of {args.repeat})")
+    print(f"  {'stage':<20}{'ops/s':>14}{'peak KB':>12}" + (f"{'vs baseline':>14}" if baseline else ""))
+    for name, stage in results["stages"].items():
+        line = f"  {name:<20}{stage['ops_per_second']:>14.2f}{stage['peak_kb']:>12.1f}"
+        before = baseline["stages"].get(name) if baseline else None
+        if before:
+            line += f"{stage['ops_per_second'] / before['ops_per_second'] - 1:>+14.1%}"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Saved the results to {args.save}")
+    if baseline:
+        regressions = compare_results(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks for the schema database and lookups')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    startup = subparsers.add_parser('startup', help='SchemaIndex construction with and without the manifest')
+    startup.add_argument('--schemas', type=int, default=1400, help='Number of synthetic schemas')
+    startup.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    startup.set_defaults(run=bench_startup)
+
+    coldstart = subparsers.add_parser('coldstart', help='main.py --help and a generation on the stub model in new processes')
+    coldstart.add_argument('--schemas', type=int, default=1400, help='Number of synthetic schemas')
+    coldstart.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    coldstart.set_defaults(run=bench_coldstart)
+
+    update = subparsers.add_parser('update', help='Full, parallel, not modified and incremental database updates from a local server')
+    update.add_argument('--schemas', type=int, default=400, help='Number of synthetic schemas')
+    update.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to the number of CPUs')
+    update.add_argument('--changed', type=int, default=10, help='Number of schemas changed for the incremental update')
+    update.set_defaults(run=bench_update)
+
+    lookup = subparsers.add_parser('lookup', help='FuzzyIndex lookups compared to fuzzywuzzy extractOne')
+    lookup.add_argument('--schemas', type=int, default=1400, help='Number of synthetic type names')
+    lookup.add_argument('--queries', type=int, default=2000, help='Number of fuzzy queries')
+    lookup.add_argument('--compare', type=int, default=200, help='Number of queries also run through fuzzywuzzy')
+    lookup.set_defaults(run=bench_lookup)
+
+    payload = subparsers.add_parser('payload', help='Tool result tokens of full schemas compared to property summaries for a JSONL of prompts')
+    payload.add_argument('prompts', help='JSONL file with prompts in title/body/instructions/prompt fields')
+    payload.add_argument('--db', type=str, default=None, help='Use an existing db directory instead of synthetic schemas')
+    payload.add_argument('--schemas', type=int, default=300, help='Number of synthetic schemas')
+    payload.add_argument('--min-score', type=int, default=85, help='Minimum FuzzyIndex score of a phrase to count as a mentioned type')
+    payload.add_argument('--verbose', action='store_true', help='Print the types found in each prompt')
+    payload.set_defaults(run=bench_payload)
+
+    batch = subparsers.add_parser('batch', help='Batch mode throughput against the stub model')
+    batch.add_argument('--jobs', type=int, default=40, help='Number of generate jobs')
+    batch.add_argument('--workers', type=int, default=8, help='Number of concurrent workers, compared with 1')
+    batch.add_argument('--latency', type=float, default=0.2, help='Seconds each stub model call takes')
+    batch.add_argument('--rate', type=float, default=None, help='Token bucket limit of model requests per second')
+    batch.add_argument('--schemas', type=int, default=100, help='Number of synthetic schemas')
+    batch.set_defaults(run=bench_batch)
+
+    cache = subparsers.add_parser('cache', help='Recording agent runs in the response cache and replaying them offline')
+    cache.add_argument('--prompts', type=int, default=20, help='Number of distinct generations')
+    cache.add_argument('--latency', type=float, default=0.2, help='Seconds each stub model call takes')
+    cache.add_argument('--cache-size', type=int, default=10240, help='Cache size in KB')
+    cache.add_argument('--schemas', type=int, default=100, help='Number of synthetic schemas')
+    cache.set_defaults(run=bench_cache)
+
+    pack = subparsers.add_parser('pack', help='Cold and warm lookups from one file per schema compared to the packed stores')
+    pack.add_argument('--schemas', type=int, default=1400, help='Number of synthetic schemas')
+    pack.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    pack.set_defaults(run=bench_pack)
+
+    codec = subparsers.add_parser('codec', help='The YAML and JSON codecs with the C extensions compared to the pure Python ones')
+    codec.add_argument('--schemas', type=int, default=200, help='Number of synthetic schemas')
+    codec.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    codec.set_defaults(run=bench_codec)
+
+    validate = subparsers.add_parser('validate', help='Validation of a large template against the schemas')
+    validate.add_argument('--schemas', type=int, default=400, help='Number of synthetic schemas')
+    validate.add_argument('--resources', type=int, default=500, help='Number of resources of the template')
+    validate.add_argument('--errors', type=int, default=20, help='Number of resources with a problem')
+    validate.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    validate.set_defaults(run=bench_validate)
+
+    samples = subparsers.add_parser('samples', help='Tokens of the sample templates in the full and the digest mode')
+    samples.add_argument('--samples', type=int, default=3, help='Number of sample templates')
+    samples.add_argument('--resources', type=int, default=40, help='Number of resources of every sample')
+    samples.add_argument('--latency', type=float, default=0.0, help='Seconds each stub model call takes')
+    samples.add_argument('--schemas', type=int, default=100, help='Number of synthetic schemas')
+    samples.set_defaults(run=bench_samples)
+
+    transform = subparsers.add_parser('transform', help='Tokens and time of transforming a large template in the full and the diff mode')
+    transform.add_argument('--schemas', type=int, default=400, help='Number of synthetic schemas')
+    transform.add_argument('--resources', type=int, default=300, help='Number of resources of the template')
+    transform.add_argument('--latency', type=float, default=0.0, help='Seconds each stub model call takes')
+    transform.add_argument('--tokens-per-second', type=float, default=60, help='Output speed of the model for the estimated time')
+    transform.set_defaults(run=bench_transform)
+
+    suite = subparsers.add_parser('suite', help='Throughput and peak memory of the pipeline stages and the agent loop, compared to a baseline')
+    suite.add_argument('--schemas', type=int, default=200, help='Number of synthetic schemas')
+    suite.add_argument('--seed', type=int, default=0, help='Seed of the synthetic schemas and queries')
+    suite.add_argument('--queries', type=int, default=1000, help='Number of lookups of the lookup stages')
+    suite.add_argument('--agent-runs', type=int, default=20, help='Number of generations on the stub model')
+    suite.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best is reported')
+    suite.add_argument('--save', type=str, default=None, help='Write the results to this file to use them as the baseline')
+    suite.add_argument('--compare', type=str, default=None, help='Baseline results to compare with, exits with 1 on a regression')
+    suite.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown or memory growth relative to the baseline, shared machines are noisy')
+    suite.set_defaults(run=bench_suite)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,127 @@
+import json
+from typing import List
+import ell
+from ell.types import ContentBlock, ToolResult
+from tokencount import count_tokens
+
+"""
+Keeps the conversation of the agents under a token limit. Every iteration resends the whole
+conversation, so old tool results are condensed (full schema -> property summary) and then
+evicted before a request would exceed the limit.
+"""
+
+# Rough cost of the role and separators of each message and of a tool call besides its arguments
+MESSAGE_OVERHEAD = 4
+TOOL_CALL_OVERHEAD = 10
+
+EVICTED = "[Result removed to keep the conversation short. Call {tool} again if you still need it.]"
+
+
+class TokenBudget:
+    """
+    Tracks the prompt size of each iteration of an agent loop and shrinks old tool results when needed.
+
+    Attributes:
+        limit (int): Maximum number of prompt tokens of a request.
+        keep_recent (int): Number of the most recent tool result messages that are never shrunk.
+        history (list): Prompt tokens of each request that went through fit().
+        condensed (int): Number of tool results replaced with a summary.
+        evicted (int): Number of tool results removed.
+    """
+
+    def __init__(self, limit: int, keep_recent: int = 1):
+        self.limit = limit
+        self.keep_recent = keep_recent
+        self.history = []
+        self.condensed = 0
+        self.evicted = 0
+        self._sizes = {}
+
+
+    def message_tokens(self, message: ell.Message) -> int:
+        cached = self._sizes.get(id(message))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+        tokens = MESSAGE_OVERHEAD
+        for block in message.content:
+            if block.text is not None:
+                tokens += count_tokens(block.text)
+            elif block.tool_call is not None:
+                tokens += TOOL_CALL_OVERHEAD + count_tokens(json.dumps(block.tool_call.params.model_dump()))
+            elif block.tool_result is not None:
+                tokens += count_tokens(block.tool_result.text_only)
+        # Keep the message so its id cannot be reused by another one
+        self._sizes[id(message)] = (message, tokens)
+        return tokens
+
+
+    def measure(self, messages: List[ell.Message]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+
+    def fit(self, messages: List[ell.Message], reserved: int = 0, keep: set | None = None) -> List[ell.Message]:
+        """
+        Returns the messages, with old tool results condensed or evicted if the prompt would exceed the limit.
+
+        Args:
+            messages: The conversation without the system prompt.
+            reserved: Tokens of the parts sent besides the messages, e.g. the system prompt.
+            keep: ids of messages that are never shrunk, e.g. the results the latest message points to.
+        """
+        total = reserved + self.measure(messages)
+        if total > self.limit:
+            calls = {block.tool_call.tool_call_id: block.tool_call
+                     for message in messages for block in message.content if block.tool_call is not None}
+            candidates = [i for i, message in enumerate(messages) if message.tool_results][:-self.keep_recent or None]
+            candidates = [i for i in candidates if id(messages[i]) not in (keep or ())]
+            # First replace full results with condensed versions, evict only if that is not enough
+            for shrink in (self._condense, self._evict):
+                for i in candidates:
+                    if total <= self.limit:
+                        break
+                    shrunk = shrink(messages[i], calls)
+                    if shrunk is not messages[i]:
+                        total += self.message_tokens(shrunk) - self.message_tokens(messages[i])
+                        messages = messages[:i] + [shrunk] + messages[i + 1:]
+        self.history.append(total)
+        return messages
+
+
+    def _condense(self, message: ell.Message, calls: dict) -> ell.Message:
+        """
+        Replaces full schemas with the property summary of the same type.
+        """
+        # The index of the job, in server mode the global one may have been replaced since the schema was loaded
+        import schemaindex
+        index = schemaindex.current()
+        blocks = []
+        changed = False
+        for block in message.content:
+            call = calls.get(block.tool_result.tool_call_id) if block.tool_result is not None else None
+            if call is not None and call.tool.__name__ == "get_cloudformation_schema":
+                summary = index.get_property(call.params.type_name)
+                if count_tokens(summary) < count_tokens(block.tool_result.text_only):
+                    block = _with_text(block, summary)
+                    changed = True
+                    self.condensed += 1
+            blocks.append(block)
+        return ell.Message(role=message.role, content=blocks) if changed else message
+
+
+    def _evict(self, message: ell.Message, calls: dict) -> ell.Message:
+        blocks = []
+        changed = False
+        for block in message.content:
+            if block.tool_result is not None:
+                call = calls.get(block.tool_result.tool_call_id)
+                evicted = EVICTED.format(tool=call.tool.__name__ if call else "the tool")
+                if block.tool_result.text_only != evicted:
+                    block = _with_text(block, evicted)
+                    changed = True
+                    self.evicted += 1
+            blocks.append(block)
+        return ell.Message(role=message.role, content=blocks) if changed else message
+
+
+def _with_text(block: ContentBlock, text: str) -> ContentBlock:
+    return ContentBlock(tool_result=ToolResult(tool_call_id=block.tool_result.tool_call_id, result=[ContentBlock(text=text)]))
@@ -0,0 +1,68 @@
+import http.client
+import json
+import socket
+
+"""
+The client of server.py. It only needs the standard library, so submitting a job does not pay for
+importing the model SDKs, loading the schema index or checking the database for updates.
+
+An address is either host:port for the HTTP server or the path of its Unix socket (unix:/path or /path).
+"""
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    An HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def connect(address: str, timeout: float | None = None) -> http.client.HTTPConnection:
+    if address.startswith("unix:"):
+        return UnixHTTPConnection(address[len("unix:"):], timeout)
+    if address.startswith("/"):
+        return UnixHTTPConnection(address, timeout)
+    host, _, port = address.rpartition(":")
+    return http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=timeout)
+
+
+def request(address: str, method: str, path: str, body: dict | None = None, timeout: float | None = None) -> tuple[int, dict]:
+    """
+    Sends a request to the server and returns the status code and the decoded JSON response.
+    """
+    connection = connect(address, timeout)
+    try:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        connection.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+def submit(address: str, job: dict, timeout: float | None = None) -> dict:
+    """
+    Runs a job (see batch.py for the fields) on the server and waits for its result. File paths in
+    the job are read by the server, so they have to be absolute. Raises RuntimeError if the server
+    rejected the job.
+    """
+    status, result = request(address, "POST", "/jobs", job, timeout)
+    if status != 200:
+        raise RuntimeError(f"The server rejected the job ({status}): {result.get('error')}")
+    return result
+
+
+def health(address: str, timeout: float | None = 5) -> dict:
+    return request(address, "GET", "/health", timeout=timeout)[1]
@@ -0,0 +1,86 @@
+import json
+import yaml
+
+"""
+The YAML and JSON functions used for the schemas. The C implementations are used when they are
+available: the libyaml based loader and dumper of PyYAML and orjson for parsing JSON. Without them
+the pure Python ones are used, the results are the same either way. The dumper only has to emit
+plain dicts, lists and scalars, for those SafeDumper writes the same bytes as the default Dumper.
+"""
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+YAMLError = yaml.YAMLError
+
+
+def load_yaml(stream):
+    """
+    Parses YAML from a string, bytes or a file like yaml.safe_load does.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data) -> str:
+    """
+    Dumps the data in the format of the files in the db directory.
+    """
+    return yaml.dump(data, Dumper=SafeDumper, default_flow_style=False, sort_keys=False, width=1000)
+
+
+class CloudFormationLoader(SafeLoader):
+    """
+    Reads CloudFormation templates. The short forms of the intrinsic functions (!Ref, !GetAtt,
+    !Sub...) become their long forms ({"Ref": ...}, {"Fn::GetAtt": [...]}, {"Fn::Sub": ...}).
+    """
+
+
+def construct_intrinsic(loader, suffix: str, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    if suffix in ("Ref", "Condition"):
+        return {suffix: value}
+    if suffix == "GetAtt" and isinstance(value, str):
+        value = value.split(".", 1)
+    return {f"Fn::{suffix}": value}
+
+
+CloudFormationLoader.add_multi_constructor("!", construct_intrinsic)
+
+
+def load_template(text: str):
+    """
+    Parses a CloudFormation template in YAML or JSON.
+    """
+    return yaml.load(text, Loader=CloudFormationLoader)
+
+
+def load_json(data: bytes | str):
+    """
+    Parses JSON from bytes or a string. orjson rejects a few documents the json module accepts
+    (NaN, integers over 64 bits), those are parsed again by the json module.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def c_extensions() -> dict:
+    """
+    Which of the C implementations are used.
+    """
+    return {"libyaml": SafeLoader.__module__ != "yaml.loader", "orjson": orjson is not None}
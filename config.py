@@ -1,9 +1,68 @@
 import ell
+from models import get_model_id
 
 class Configuration:
-    def __init__(self, commit_model: str = "gpt-4o-mini", agent_model: str = "gpt-4o-mini", client = None):
+    def __init__(self, commit_model: str = "gpt-4o-mini", agent_model: str = "gpt-4o-mini", client = None, token_limit: int = 100000,
+                 store: str | None = "log", rate_limiter = None, validate: bool = True):
         self.commit_model = commit_model
         self.agent_model = agent_model
         self.client = client
-        ell.init(store="log", autocommit=True, autocommit_model=self.commit_model, default_client=self.client)
+        self.token_limit = token_limit
+        # Anything with an acquire() method, called before every model request
+        self.rate_limiter = rate_limiter
+        # Whether the agents check their templates against the schemas and let the model fix the problems
+        self.validate = validate
+        ell.init(store=store, autocommit=store is not None, autocommit_model=self.commit_model, default_client=self.client)
 
+
+def create_configuration(api: str, model: str = 'mini', token_limit: int = 100000, max_connections: int = 10, rate_limiter = None,
+                         cache_dir: str | None = None, cache_size: int = 256 * 1024 * 1024, replay: bool = False, validate: bool = True) -> Configuration:
+    """
+    Creates the configuration and the model client for the given API.
+    The client is shared by everything using the configuration, max_connections sizes its connection pool.
+
+    With cache_dir the responses are recorded in a ResponseCache and identical requests are answered
+    from it. With replay only the recorded responses are used and no client for the API is created.
+    """
+    commit_model = "gpt-4o-mini"
+    agent_model = get_model_id(model)
+    store = "log"
+    if api == 'bedrock':
+        # Fix the model name for the default if we are using Bedrock
+        commit_model = get_model_id('haiku')
+        agent_model = get_model_id('haiku') if model == 'mini' else get_model_id(model)
+    elif api not in ('openai', 'stub'):
+        raise ValueError(f"Invalid API: {api}")
+
+    if replay:
+        client = None
+    elif api == 'bedrock':
+        import boto3
+        from botocore.config import Config
+        client = boto3.client('bedrock-runtime', region_name='us-west-2', config=Config(max_pool_connections=max_connections))
+    elif api == 'openai':
+        import openai, httpx
+        client = openai.OpenAI(http_client=httpx.Client(limits=httpx.Limits(max_connections=max_connections)))
+    else:
+        from stub import StubClient
+        client = StubClient()
+
+    if cache_dir or replay:
+        from llmcache import CachingClient, ResponseCache
+        if not cache_dir:
+            raise ValueError("Replay needs the directory of the recorded responses.")
+        client = CachingClient(client, ResponseCache(cache_dir, cache_size), replay=replay)
+
+    # Without a live model there is no store, ell would otherwise call the commit model to describe new versions of the prompts
+    if api == 'stub' or replay:
+        store = None
+
+    return Configuration(
+        commit_model = commit_model,
+        agent_model = agent_model,
+        client = client,
+        token_limit = token_limit,
+        store = store,
+        rate_limiter = rate_limiter,
+        validate = validate
+    )
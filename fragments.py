@@ -0,0 +1,112 @@
+from codec import dump_yaml
+
+"""
+Property fragments let the agents load a single property of a schema instead of the whole file.
+They are computed by update_database and stored next to each schema as <name>.properties.json.
+"""
+
+
+def property_fragments(schema: dict) -> dict:
+    """
+    Precomputes what get_cloudformation_property returns: a compact summary of the resource
+    and the top level properties with the definitions they reference, so that a single
+    property subtree can be served without loading the whole schema.
+    """
+    return {
+        "typeName": schema.get('typeName'),
+        "summary": property_summary(schema),
+        "required": schema.get('required', []),
+        "properties": schema.get('properties', {}),
+        "definitions": schema.get('definitions', {}),
+    }
+
+
+def property_summary(schema: dict) -> str:
+    """
+    One line per top level property with its type, flags and the first sentence of its description.
+    """
+    definitions = schema.get('definitions', {})
+    required = set(schema.get('required', []))
+    create_only = {path.split("/")[-1] for path in schema.get('createOnlyProperties', []) if path.count("/") == 2}
+    read_only = {path.split("/")[-1] for path in schema.get('readOnlyProperties', []) if path.count("/") == 2}
+
+    lines = [schema.get('typeName', ''), short_description(schema.get('description', ''))]
+    if required:
+        lines.append(f"Required: {', '.join(sorted(required))}")
+    lines.append("Properties (ask for a property path such as Name or Name.SubProperty for details):")
+    for name, prop in schema.get('properties', {}).items():
+        flags = [flag for flag, names in [("required", required), ("create-only", create_only), ("read-only", read_only)] if name in names]
+        flags_text = f" [{', '.join(flags)}]" if flags else ""
+        description = short_description(prop.get('description', '') or definitions.get(ref_name(prop), {}).get('description', ''))
+        lines.append(f"  {name}: {describe_type(prop, definitions)}{flags_text}" + (f" - {description}" if description else ""))
+    return "\n".join(line for line in lines if line)
+
+
+def ref_name(prop: dict) -> str | None:
+    ref = prop.get('$ref')
+    return ref.split('/')[-1] if isinstance(ref, str) else None
+
+
+def describe_type(prop: dict, definitions: dict) -> str:
+    if (ref := ref_name(prop)) is not None:
+        definition = definitions.get(ref, {})
+        if definition.get('properties') is not None:
+            return f"{ref} (object)"
+        return describe_type(definition, {}) if definition else ref
+    prop_type = prop.get('type', 'object' if 'properties' in prop else 'any')
+    if isinstance(prop_type, list):
+        prop_type = " or ".join(prop_type)
+    if prop_type == 'array' and isinstance(prop.get('items'), dict):
+        return f"array of {describe_type(prop['items'], definitions)}"
+    return prop_type
+
+
+def short_description(description: str, limit: int = 120) -> str:
+    sentence = " ".join(str(description).split()).split(". ")[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 3] + "..."
+
+
+def resolve(node, definitions: dict):
+    """
+    Inlines the definition referenced by the node, the same way inline_definitions does in the db files.
+    """
+    if isinstance(node, dict) and (ref := ref_name(node)) is not None and ref in definitions:
+        inlined = {'$ref': ref}
+        inlined.update(definitions[ref])
+        return inlined
+    return node
+
+
+def find_property(fragments: dict, path: str):
+    """
+    Walks a dotted property path such as LaunchTemplateData.BlockDeviceMappings through nested
+    properties, array items and referenced definitions. Returns None if the path does not exist.
+    """
+    definitions = fragments.get('definitions', {})
+    node = {'properties': fragments.get('properties', {})}
+    for segment in path.split("."):
+        node = resolve(node, definitions)
+        if isinstance(node, dict) and 'properties' not in node and isinstance(node.get('items'), dict):
+            node = resolve(node['items'], definitions)
+        children = node.get('properties') if isinstance(node, dict) else None
+        if not isinstance(children, dict):
+            return None
+        # The model does not always keep the case of property names
+        key = segment if segment in children else next((k for k in children if k.lower() == segment.lower()), None)
+        if key is None:
+            return None
+        node = children[key]
+    node = resolve(node, definitions)
+    if isinstance(node, dict):
+        node = {k: resolve(v, definitions) if k != 'properties' else {n: resolve(p, definitions) for n, p in v.items()} for k, v in node.items()}
+    return node
+
+
+def render_property(fragments: dict, path: str) -> str | None:
+    """
+    Returns the YAML of the property subtree at path in the same style as the db files.
+    """
+    node = find_property(fragments, path)
+    if node is None:
+        return None
+    return dump_yaml({path: node})
@@ -0,0 +1,98 @@
+import re
+from collections import Counter, defaultdict
+from typing import Iterable
+
+"""
+An inverted index for fuzzy lookups of CloudFormation type names, e.g. "s3 bucket" or "lauch template".
+Candidates are collected from a trigram index, only those are scored.
+"""
+
+CAMEL_CASE = re.compile(r'[A-Z]+(?=[A-Z][a-z]|\d|$)|[A-Z]?[a-z]+|\d+')
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+# How many candidates with the most shared trigrams are scored
+CANDIDATES = 64
+
+
+def type_name_tokens(type_name: str) -> tuple[str, list[str]]:
+    """
+    Splits a type name such as AWS::EC2::LaunchTemplate into the compact form used for trigrams
+    ("ec2launchtemplate") and tokens: the service ("ec2"), the resource ("launchtemplate")
+    and the words of the resource ("launch", "template"). The words need the original case.
+    """
+    parts = type_name.split("::")
+    if len(parts) < 3:
+        parts = ["AWS"] + parts
+    vendor, service, resource = parts[0].lower(), parts[1].lower(), "".join(parts[2:])
+    words = [word.lower() for word in CAMEL_CASE.findall(resource)]
+    prefix = "" if vendor == "aws" else vendor
+    compact = prefix + service + resource.lower()
+    tokens = [token for token in dict.fromkeys([prefix, service, resource.lower()] + words) if token]
+    return compact, tokens
+
+
+def query_tokens(query: str) -> tuple[str, list[str]]:
+    """
+    Normalizes free text the same way as type names: "S3::Bucket", "s3 bucket" and "AWS::S3::Bucket" all give "s3bucket".
+    """
+    if "::" in query:
+        return type_name_tokens(query.strip())
+    words = [word for word in NON_ALPHANUMERIC.split(query.lower()) if word and word != "aws"]
+    return "".join(words), words
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """
+    Finds the type names closest to a fuzzy query without comparing the query with every name.
+
+    The score (0-100) combines the trigram similarity of the compact forms, how much of the query
+    is covered by the name and how many query tokens are service or resource tokens of the name.
+
+    Attributes:
+        names (list): The indexed type names in lowercase.
+    """
+
+    def __init__(self, type_names: Iterable[str]):
+        self.names = []
+        self.grams = []
+        self.tokens = []
+        self.gram_index = defaultdict(list)
+        for type_name in dict.fromkeys(type_names):
+            name = type_name.lower()
+            compact, tokens = type_name_tokens(type_name)
+            grams = trigrams(compact).union(*(trigrams(token) for token in tokens))
+            i = len(self.names)
+            self.names.append(name)
+            self.grams.append(grams)
+            self.tokens.append(set(tokens))
+            for gram in grams:
+                self.gram_index[gram].append(i)
+
+
+    def search(self, query: str, k: int = 5) -> list[tuple[str, int]]:
+        """
+        Returns up to k (type name, score) pairs with the best match first.
+        """
+        compact, tokens = query_tokens(query)
+        if not compact:
+            return []
+        grams = trigrams(compact).union(*(trigrams(token) for token in tokens))
+
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.gram_index.get(gram, ()))
+
+        scored = []
+        for i, common in shared.most_common(CANDIDATES):
+            dice = 2 * common / (len(grams) + len(self.grams[i]))
+            coverage = common / len(grams)
+            matched = sum(1 for token in tokens if token in self.tokens[i])
+            token_score = matched / len(tokens) if tokens else 0
+            scored.append((self.names[i], round(100 * (0.5 * dice + 0.3 * coverage + 0.2 * token_score))))
+        scored.sort(key=lambda item: (-item[1], len(item[0])))
+        return scored[:k]
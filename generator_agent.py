@@ -1,11 +1,13 @@
-from typing import List
-import ell
-from ell.types import ToolCall
-from schemaindex import get_cloudformation_schema
+from schemaindex import get_cloudformation_schema, get_cloudformation_property
 from config import Configuration
+from session import AgentSession
+from toolexec import ToolExecutor
+from validator import template_validator
+
 SYSTEM_PROMPT_PLAIN = """You are an AI assistant that generates CloudFormation templates based on given instructions.
                 Moreover, you are provided with a tool that you can call in order to ensure what can be done
                 with each resource in CloudFormation. Instead of hallucinating, you can verify that with the tool.
+                To save space, prefer loading the summary of a resource's properties and then only the properties you need.
                 Everything you generate should be a valid YAML document. Use comments to communicate with the user
                 instead of leaving plain text around YAML code. As the last message where you verified everything
                 with the tools RESPOND ONLY WITH THE YAML CODE WITHOUT MARKDOWN OR ANY OTHER TEXT. JUST THE YAML
@@ -15,6 +17,7 @@ SYSTEM_PROMPT_STYLED = """You are an AI assistant that generates CloudFormation
                 User provided you with sample templates so KEEP THE STYLE SIMILAR TO THE PROVIDED SAMPLES.
                 Moreover, you are provided with a tool that you can call in order to ensure what can be done
                 with each resource in CloudFormation. Instead of hallucinating, you can verify that with the tool.
+                To save space, prefer loading the summary of a resource's properties and then only the properties you need.
                 Everything you generate should be a valid YAML document. Use comments to communicate with the user
                 instead of leaving plain text around YAML code. As the last message where you verified everything
                 with the tools RESPOND ONLY WITH THE YAML CODE WITHOUT MARKDOWN OR ANY OTHER TEXT. JUST THE YAML
@@ -29,36 +32,18 @@ class GeneratorAgent:
     """
     
     def __init__(self, config: Configuration):
-        self.model = config.agent_model
-        self.client = config.client
-
-
-    def cfn_template_creator(self, message_history: List[ell.Message], sample_templates: bool = False) -> List[ell.Message]:
-        @ell.complex(model=self.model, tools=[get_cloudformation_schema], temperature=0.4, client=self.client)
-        def _create_template(messages: List[ell.Message]) -> List[ell.Message]:
-            return messages
-
-        return _create_template([
-            ell.system(SYSTEM_PROMPT_STYLED if sample_templates else SYSTEM_PROMPT_PLAIN),
-        ] + message_history)
+        self.config = config
+        self.session = None
+        self.budget = None
+        self.tools = ToolExecutor()
+        # The sessions of the last run, the same list the TransformatorAgent keeps
+        self.sessions = []
 
 
     def create_template(self, initial_prompt: str, sample_templates: str = None):
-        
-        prompt = f"{initial_prompt}\n\n---{sample_templates}" if sample_templates else initial_prompt
-        conversation = [ ell.user(prompt) ]
-
-        response: ell.Message = self.cfn_template_creator(conversation, sample_templates is not None)
-        
-        max_iterations = 30
-        while max_iterations > 0 and (response is ToolCall or response.tool_calls):
-            tool_results = response.call_tools_and_collect_as_message()
-            # Include what the user wanted, what the assistant requsted to run and what the tool returned
-            conversation = conversation + [response, tool_results]
-            response = self.cfn_template_creator(conversation)
-            max_iterations -= 1
-    
-        if max_iterations <= 0:
-            raise Exception("Too many iterations, probably stuck in a loop.")
-        
-        return response.text
+        # The samples are part of the system prompt so they stay in the cached prefix of every request
+        system_prompt = f"{SYSTEM_PROMPT_STYLED}\n\n---{sample_templates}" if sample_templates else SYSTEM_PROMPT_PLAIN
+        self.session = AgentSession(self.config, system_prompt, [get_cloudformation_schema, get_cloudformation_property], self.tools)
+        self.budget = self.session.budget
+        self.sessions = [self.session]
+        return self.session.run(initial_prompt, validator=template_validator(self.config))
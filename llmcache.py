@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ell.configurator import config, register_provider
+from ell.provider import EllCallParams, Metadata, Provider
+from ell.types import Message
+from stub import message_record, record_to_messages
+
+"""
+A content-addressed cache of model responses. The key covers the model, the API parameters
+(temperature...), the system prompt and the normalized message history, so an identical
+conversation with identical tool results is answered from disk. In replay mode nothing is
+sent to the model at all, which lets the whole agent loop run offline from recorded sessions.
+"""
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def normalized_messages(messages: List[Message]) -> list[dict]:
+    """
+    The messages in a provider independent form where tool call ids, which are random for
+    every response, are replaced by their order of appearance.
+    """
+    ids = {}
+    records = []
+    for message in messages:
+        record = message_record(message)
+        for block in record["content"]:
+            for kind in ("tool_call", "tool_result"):
+                if kind in block:
+                    block[kind]["id"] = ids.setdefault(block[kind]["id"], f"call_{len(ids)}")
+        records.append(record)
+    return records
+
+
+def cache_key(ell_call: EllCallParams) -> str:
+    data = {
+        "model": ell_call.model,
+        "api_params": ell_call.api_params,
+        "tools": sorted(tool.__name__ for tool in ell_call.tools),
+        "messages": normalized_messages(ell_call.messages),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Stores one JSON file per response under directory and evicts the least recently used
+    ones once the files take more than max_bytes. A hit refreshes the file's mtime, which
+    is what the LRU order is based on, so it survives restarts.
+
+    Attributes:
+        hits (int): Number of requests answered from the cache.
+        misses (int): Number of requests not found in the cache.
+        evictions (int): Number of responses removed to stay within max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # key -> (size, last use), rebuilt from the files on start
+        self.entries = {}
+        os.makedirs(directory, exist_ok=True)
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    self.entries[name[:-5]] = (stat.st_size, stat.st_mtime)
+        self.size = sum(size for size, _ in self.entries.values())
+
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with open(self.path(key), "r") as f:
+                value = json.load(f)
+        except (IOError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(self.path(key), (now, now))
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+            if key in self.entries:
+                self.entries[key] = (self.entries[key][0], now)
+        return value
+
+
+    def put(self, key: str, value: dict):
+        data = json.dumps(value).encode("utf-8")
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            previous = self.entries.get(key)
+            self.size += len(data) - (previous[0] if previous else 0)
+            self.entries[key] = (len(data), time.time())
+            self._evict()
+
+
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            self.size -= size
+            self.evictions += 1
+
+
+class CachingClient:
+    """
+    Wraps a model client (OpenAI, Bedrock or the stub) and answers from the ResponseCache first.
+
+    Attributes:
+        client: The wrapped client, can be None in replay mode.
+        cache (ResponseCache): Where the responses are recorded.
+        replay (bool): Only serve recorded responses and raise CacheMiss for anything else.
+    """
+
+    def __init__(self, client, cache: ResponseCache, replay: bool = False):
+        if client is None and not replay:
+            raise ValueError("A client is required unless the cache is only replayed.")
+        self.client = client
+        self.cache = cache
+        self.replay = replay
+
+
+class CachingProvider(Provider):
+    dangerous_disable_validation = True
+
+    def call(self, ell_call: EllCallParams, origin_id: Optional[str] = None, logger: Optional[Any] = None) -> Tuple[List[Message], Dict[str, Any], Metadata]:
+        caching_client: CachingClient = ell_call.client
+        key = cache_key(ell_call)
+        cached = caching_client.cache.get(key)
+        if cached is not None:
+            messages = record_to_messages(cached["message"], ell_call, origin_id)
+            if logger:
+                logger(messages[0].text)
+            return messages, {"model": ell_call.model, "cache_key": key}, {"usage": cached.get("usage", {}), "cached": True}
+        if caching_client.replay:
+            raise CacheMiss(f"No recorded response for this conversation (key {key}).")
+
+        inner_call = ell_call.model_copy(update={"client": caching_client.client})
+        messages, final_api_params, metadata = self.wrapped(caching_client).call(inner_call, origin_id, logger)
+        if len(messages) == 1:
+            caching_client.cache.put(key, {"message": message_record(messages[0]), "usage": metadata.get("usage", {})})
+        return messages, final_api_params, metadata
+
+
+    def wrapped(self, caching_client: CachingClient) -> Provider:
+        """
+        The provider of the wrapped client, which the requests that are not in the cache go to.
+        """
+        if caching_client.client is None:
+            raise CacheMiss("The cache is only replayed, there is no client to send the request to.")
+        provider = config.get_provider_for(caching_client.client)
+        assert provider is not None, f"No provider found for client {caching_client.client}."
+        return provider
+
+
+    # The rest of the Provider interface is that of the wrapped client's provider
+    def provider_call_function(self, client: CachingClient, api_call_params: Optional[Dict[str, Any]] = None) -> Callable[..., Any]:
+        return self.wrapped(client).provider_call_function(client.client, api_call_params)
+
+
+    def translate_to_provider(self, ell_call: EllCallParams) -> Dict[str, Any]:
+        inner_call = ell_call.model_copy(update={"client": ell_call.client.client})
+        return self.wrapped(ell_call.client).translate_to_provider(inner_call)
+
+
+    def translate_from_provider(self, provider_response: Any, ell_call: EllCallParams, provider_call_params: Dict[str, Any],
+                                origin_id: Optional[str] = None, logger: Optional[Callable[..., None]] = None) -> Tuple[List[Message], Metadata]:
+        inner_call = ell_call.model_copy(update={"client": ell_call.client.client})
+        return self.wrapped(ell_call.client).translate_from_provider(provider_response, inner_call, provider_call_params, origin_id, logger)
+
+
+register_provider(CachingProvider(), CachingClient)
@@ -0,0 +1,81 @@
+import sys
+import threading
+from collections import OrderedDict
+
+"""
+A small in-memory LRU cache for the schema lookups. It is bounded by the number of entries,
+the total size of the values or both, and counts its hits, misses and evictions.
+"""
+
+
+class LRUCache:
+    """
+    A thread safe least recently used cache.
+
+    Attributes:
+        max_bytes (int): Maximum total size of the values, None for no limit. A value larger than
+            max_bytes is not stored at all.
+        max_entries (int): Maximum number of entries, None for no limit.
+        size (int): Total size of the values in bytes as measured by sizeof.
+        hits (int): Number of get() calls that found the key.
+        misses (int): Number of get() calls that did not find the key.
+        evictions (int): Number of entries removed to stay within the limits.
+    """
+
+    def __init__(self, max_bytes: int | None = None, max_entries: int | None = None, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while ((self.max_bytes is not None and self.size > self.max_bytes)
+                   or (self.max_entries is not None and len(self.entries) > self.max_entries)):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
@@ -1,68 +1,166 @@
-from schemaindex import load_schemas
-from update import update_database
-from sample_templates import load_sample_templates
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import boto3
 import argparse
 import sys
-from generator_agent import GeneratorAgent
-from transformator_agent import TransformatorAgent
-from config import Configuration
-from models import get_model_id, get_choices
+from models import get_choices
+from metrics import metrics, run_report, write_report, write_prometheus
+import client
+import os
+import time
+
+# The agents, the model clients and ell (with the SDKs of all its providers) take seconds to import,
+# they are imported after the arguments are parsed and only when the job runs in this process
 
 def write_template(template, filename: str = None):
     _filename = filename if filename else f"generated_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.yml"
     with open(_filename, "w") as f:
         f.write(template)
 
+def load_index(update: bool, max_age: float, layout: str | None, cache_bytes: int) -> list[str]:
+    """
+    Updates the schema database when it is older than max_age seconds (or there is none) and loads
+    the index. Runs in the background while the agents are imported and the instructions are read,
+    so the messages of the update are returned to be printed afterwards instead of running into the prompt.
+    """
+    from update import last_update, update_database
+    import schemaindex
+    messages = []
+    if update or not last_update():
+        with metrics.timer("main.update"):
+            update_database(layout=layout, max_age=max_age, log=messages.append)
+    schemaindex.load_schemas(cache_bytes=cache_bytes)
+    return messages
+
+def read_instructions() -> str:
+    with metrics.timer("main.input"):
+        return input() if not sys.stdin.isatty() else input("Enter the template instructions: ")
+
 if __name__ == "__main__":
-    # Update the CloudFormation schema index
-    update_database()
-    load_schemas()
-    
+    start = time.perf_counter()
+    started = datetime.now().isoformat(timespec='seconds')
+
     # Parse CLI arguments
     parser = argparse.ArgumentParser(description='Process or generate CloudFormation templates using LLMs', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('--api', type=str, choices=['bedrock', 'openai'], help='Which API to use for LLM inference (bedrock or openai)', default='openai')
+    parser.add_argument('--api', type=str, choices=['bedrock', 'openai', 'stub'], help='Which API to use for LLM inference (bedrock or openai, stub replays fixed responses offline)', default='openai')
     parser.add_argument('--model', type=str, help=f"Which model to use for creating the template. Available models:\n" + "\n".join(get_choices()), default='mini')
     parser.add_argument('--sample', action='append', help='Sample YAML files to load to base the style on (creation only).\nBe careful with the token limit!', default=[])
+    parser.add_argument('--sample-mode', type=str, choices=['full', 'digest'], help='full puts the samples into the prompt as they are.\ndigest puts only their conventions (naming, parameters, tags, intrinsic functions)\nand one resource of every type, cached in .digests.', default='full')
     parser.add_argument('--output', type=str, help='Output file name for the generated template.', default=None)
     parser.add_argument('--transform', type=str, help='Transformation instructions for the generated template.', default=None)
+    parser.add_argument('--transform-mode', type=str, choices=['full', 'diff'], help='full sends the whole template to the model and gets it back.\ndiff sends only the resources the instructions are about and what they reference\nand applies the changes the model returns, keeping the rest of the file as it is.', default='full')
+    parser.add_argument('--token-limit', type=int, help='Maximum prompt tokens of a request. Older schemas are condensed or removed from the conversation to stay below it.', default=100000)
+    parser.add_argument('--batch', type=str, help='JSONL file with generate/transform jobs to run instead of reading instructions.', default=None)
+    parser.add_argument('--results', type=str, help='JSONL file for the results of the batch jobs.', default='results.jsonl')
+    parser.add_argument('--workers', type=int, help='Number of jobs of the batch running concurrently.', default=4)
+    parser.add_argument('--rate', type=float, help='Maximum model requests per second in batch mode.', default=None)
+    parser.add_argument('--retries', type=int, help='How many times a failed batch job is retried.', default=2)
+    parser.add_argument('--cache', type=str, help='Directory where model responses are recorded. Identical requests are answered from it.', default=None)
+    parser.add_argument('--cache-size', type=int, help='Maximum size of the response cache in MB, least recently used responses are removed.', default=256)
+    parser.add_argument('--replay', type=str, help='Directory of recorded responses to replay offline, nothing is sent to the model.', default=None)
+    parser.add_argument('--layout', type=str, choices=['directory', 'pack', 'compressed'], help='How the schemas are stored: one file per schema, a single pack file or a pack of compressed schemas.\nDefaults to the layout of the current database, a new one is a directory.', default=None)
+    parser.add_argument('--no-update', action='store_true', help='Use the schema database as it is, it is only downloaded when there is none.')
+    parser.add_argument('--max-age', type=float, help='Hours after the last update before the schemas are checked for changes again.', default=24)
+    parser.add_argument('--schema-cache-size', type=int, help='Memory for the schemas loaded by the agents in MB, least recently used schemas are dropped.', default=64)
+    parser.add_argument('--no-validate', action='store_true', help='Do not check the templates against the schemas and send the problems back to the model.')
+    parser.add_argument('--report', type=str, help='JSON file for the run report: model requests, tokens, tool and schema lookup timings.', default=None)
+    parser.add_argument('--prometheus', type=str, help='Also write the metrics of the run in the Prometheus text format to this file.', default=None)
+    parser.add_argument('--server', type=str, help='Run the job on a running server.py (host:port or the path of its Unix socket)\ninstead of loading the schemas and the model client in this process.', default=None)
     args = parser.parse_args()
+
+    if args.server:
+        instructions = read_instructions()
+        if args.transform:
+            job = {"type": "transform", "instructions": instructions, "template": os.path.abspath(args.transform), "mode": args.transform_mode}
+        else:
+            job = {"type": "generate", "instructions": instructions, "samples": [os.path.abspath(sample) for sample in args.sample], "sample_mode": args.sample_mode}
+        result = client.submit(args.server, job)
+        if result["status"] != "ok":
+            print(f"The job failed after {result['attempts']} attempts: {result['error']}")
+            sys.exit(1)
+        write_template(result["template"], args.output)
+        print(f"{result['iterations']} iterations, {result['tool_calls']} tool calls, {sum(result['prompt_tokens'])} prompt tokens in {result['seconds']}s on {args.server}")
+        sys.exit(0)
+
+    # Update the CloudFormation schema database and load the index in the background
+    background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+    index = background.submit(load_index, not args.no_update, args.max_age * 60 * 60, args.layout, args.schema_cache_size * 1024 * 1024)
+
+    def wait_for_index():
+        with metrics.timer("main.index_wait"):
+            messages = index.result()
+        for message in messages:
+            print(message)
+
+    with metrics.timer("main.imports"):
+        import schemaindex
+        from sample_templates import load_sample_templates
+        from generator_agent import GeneratorAgent
+        from transformator_agent import TransformatorAgent
+        from config import create_configuration
+        from batch import TokenBucket, run_batch
+        from tokencount import count_tokens
+
+    def report(mode: str, agent = None, **extra):
+        if not (args.report or args.prometheus):
+            return
+        requests = agent.sessions[0].client.requests if agent else []
+        info = {"started": started, "api": args.api, "model": config.agent_model, "mode": mode,
+                "seconds": round(time.perf_counter() - start, 3),
+                "first_response_seconds": round(requests[0]["finished"] - start, 3) if requests else None,
+                "schema_cache": schemaindex.schemas.cache.stats(), "query_cache": schemaindex.schemas.queries.stats(), **extra}
+        run = run_report(info, agent.sessions if agent else None)
+        if args.report:
+            write_report(args.report, run)
+        if args.prometheus:
+            write_prometheus(args.prometheus, run, {"model": config.agent_model, "api": args.api, "mode": mode})
     
     # Configure either for Amazon Bedrock or OpenAI
-    if args.api == 'bedrock':
-        bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
-        # Fix the model name for the default if we are using Bedrock
-        config = Configuration(
-            commit_model = get_model_id('haiku'),
-            agent_model = get_model_id('haiku') if args.model == 'mini' else get_model_id(args.model),
-            client = bedrock
-        )
-    elif args.api == 'openai':
-        config = Configuration(
-            agent_model = get_model_id(args.model)
-        )
-    else:
-        raise ValueError(f"Invalid API: {args.api}")
+    rate_limiter = TokenBucket(args.rate) if args.batch and args.rate else None
+    config = create_configuration(args.api, args.model, args.token_limit, max_connections=max(10, args.workers), rate_limiter=rate_limiter,
+                                  cache_dir=args.replay or args.cache, cache_size=args.cache_size * 1024 * 1024, replay=args.replay is not None,
+                                  validate=not args.no_validate)
+
+    if args.batch:
+        wait_for_index()
+        summary = run_batch(args.batch, args.results, config, workers=args.workers, retries=args.retries)
+        print(f"{summary['jobs']} jobs ({summary['failed']} failed) in {summary['seconds']}s, {summary['jobs_per_second']} jobs/s")
+        report("batch", batch=summary)
+        sys.exit(1 if summary['failed'] else 0)
     
     # Load sample templates provided
     sample_values = args.sample if args.sample else []
-    sample_templates = load_sample_templates(sample_values)
+    sample_templates = load_sample_templates(sample_values, args.sample_mode)
 
     # Read the template that is supposed to be transformed
     if args.transform:
         with open(args.transform, "r") as f:
             source_template = f.read()
 
-    instructions = input() if not sys.stdin.isatty() else input("Enter the template instructions: ")
+    instructions = read_instructions()
+    wait_for_index()
 
     # Run the agent
     if args.transform:
         transformator = TransformatorAgent(config)
-        transformed_template = transformator.transform_template(instructions, source_template)
+        with metrics.timer("main.agent"):
+            transformed_template = transformator.transform_template(instructions, source_template, args.transform_mode)
         write_template(transformed_template, args.output)
+        if transformator.mode == "diff":
+            sent = transformator.sent
+            print(f"Sent {sent['resources']} of {sent['total_resources']} resources ({sent['lines']} of {sent['total_lines']} lines) to the model")
+        print(transformator.tools.summary())
+        for session in transformator.sessions:
+            print(session.summary())
+        report("transform", transformator, transform_mode=transformator.mode, sent=transformator.sent, fallback=transformator.fallback)
     else:
         generator = GeneratorAgent(config)
-        created_template = generator.create_template(instructions, sample_templates)
+        with metrics.timer("main.agent"):
+            created_template = generator.create_template(instructions, sample_templates)
         write_template(created_template, args.output)
+        samples = {"mode": args.sample_mode, "tokens": count_tokens(sample_templates)} if sample_templates else None
+        if samples:
+            print(f"The samples took {samples['tokens']} tokens of the system prompt ({args.sample_mode} mode)")
+        print(generator.tools.summary())
+        print(generator.session.summary())
+        report("generate", generator, samples=samples)
     
\ No newline at end of file
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from tokencount import count_tokens
+from codec import load_json
+
+"""
+The manifest is a compact index of the db directory written by update_database.
+It lets SchemaIndex start without parsing every schema file just to read its typeName.
+"""
+
+MANIFEST_FILE = ".manifest.json"
+MANIFEST_VERSION = 1
+
+# Suffix of the precomputed property fragments stored next to each schema file
+FRAGMENTS_SUFFIX = ".properties.json"
+
+
+def is_schema_file(name: str) -> bool:
+    return name.endswith('.yaml') or name.endswith('.yml')
+
+
+def fragments_file(file: str) -> str:
+    """
+    Returns the name of the property fragments file of a schema file, e.g. aws-s3-bucket.properties.json.
+    """
+    return os.path.splitext(file)[0] + FRAGMENTS_SUFFIX
+
+
+def aliases_for(type_name: str) -> list[str]:
+    """
+    Returns the lookup keys for a type name: the lowercase name and the name without the AWS:: prefix.
+    """
+    key = type_name.lower()
+    return [key, key.replace("aws::", "")]
+
+
+def manifest_entry(directory: str, file: str, type_name: str, content: bytes, tokens: int | None = None) -> dict:
+    """
+    Describes a single schema file. Size and mtime are used for the staleness check, the hash
+    identifies the content for tools that want to compare files between runs and the token
+    count is used by the agents to budget the conversation. The count is computed from the
+    content unless the caller already has it.
+    """
+    stat = os.stat(os.path.join(directory, file))
+    return {
+        "typeName": type_name,
+        "aliases": aliases_for(type_name),
+        "file": file,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "tokens": tokens if tokens is not None else count_tokens(content.decode("utf-8")),
+    }
+
+
+def write_manifest(directory: str, entries: list[dict], source: dict | None = None, pack: dict | None = None):
+    """
+    Args:
+        source: Where the schemas were downloaded from and the HTTP validators (ETag, Last-Modified) of the download.
+        pack: The pack holding the files of the entries, see packstore.pack_directory.
+    """
+    data = {
+        "version": MANIFEST_VERSION,
+        "entries": sorted(entries, key=lambda e: e["file"]),
+    }
+    if source:
+        data["source"] = source
+    if pack:
+        data["pack"] = pack
+    path = os.path.join(directory, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_manifest(directory: str) -> dict | None:
+    """
+    Returns the manifest of the directory or None if it is missing, unreadable or of another version.
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(path, "rb") as f:
+            data = load_json(f.read())
+    except (IOError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return None
+    return data
+
+
+def is_stale(directory: str, manifest: dict) -> bool:
+    """
+    A manifest is stale when the set of schema files differs from the recorded one
+    or when any file changed its size or modification time. Only stat() is used so
+    this stays cheap even for thousands of files. When the schemas are packed only the pack is checked.
+    """
+    if manifest.get("pack"):
+        try:
+            stat = os.stat(os.path.join(directory, manifest["pack"]["file"]))
+        except OSError:
+            return True
+        return stat.st_size != manifest["pack"]["size"] or stat.st_mtime_ns != manifest["pack"]["mtime"]
+    recorded = {entry["file"]: entry for entry in manifest.get("entries", [])}
+    seen = 0
+    with os.scandir(directory) as it:
+        for dir_entry in it:
+            if not is_schema_file(dir_entry.name):
+                continue
+            entry = recorded.get(dir_entry.name)
+            if entry is None:
+                return True
+            stat = dir_entry.stat()
+            if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime"]:
+                return True
+            seen += 1
+    return seen != len(recorded)
@@ -0,0 +1,166 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+"""
+Counters and timers of a run: model requests and their tokens, tool calls, schema lookups and the
+phases of the database update. Everything records into the module level metrics registry, which
+main writes out as a JSON run report and optionally as a Prometheus textfile (for the textfile
+collector of node_exporter) labelled with the model, so runs of different models can be compared.
+"""
+
+PROMETHEUS_PREFIX = "cfn_agent"
+QUANTILES = (0.5, 0.95)
+# The quantiles are computed from the most recent observations so long runs use constant memory
+MAX_SAMPLES = 4096
+
+
+class Metrics:
+    """
+    A thread safe registry of counters and timers.
+
+    Attributes:
+        counters (dict): Name -> accumulated value.
+        timers (dict): Name -> number, sum and maximum of the observed durations in seconds
+            and the last MAX_SAMPLES durations.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {"count": 0, "sum": 0.0, "max": 0.0, "samples": deque(maxlen=MAX_SAMPLES)}
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+            timer["samples"].append(seconds)
+
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+
+
+    def snapshot(self) -> dict:
+        """
+        The counters and, for every timer, the number of observations, their sum, mean, quantiles and maximum.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {name: {**timer, "samples": sorted(timer["samples"])} for name, timer in self.timers.items()}
+        summaries = {}
+        for name, timer in sorted(timers.items()):
+            values = timer["samples"]
+            summary = {"count": timer["count"], "sum": round(timer["sum"], 6), "mean": round(timer["sum"] / timer["count"], 6)}
+            for q in QUANTILES:
+                summary[f"p{int(q * 100)}"] = round(values[min(len(values) - 1, int(q * len(values)))], 6)
+            summary["max"] = round(timer["max"], 6)
+            summaries[name] = summary
+        return {"counters": dict(sorted(counters.items())), "timers": summaries}
+
+
+metrics = Metrics()
+
+
+def hit_rate(counters: dict, hits: str, misses: str) -> float | None:
+    total = counters.get(hits, 0) + counters.get(misses, 0)
+    return round(counters.get(hits, 0) / total, 4) if total else None
+
+
+def run_report(info: dict, sessions: list | None = None) -> dict:
+    """
+    The JSON run report: info about the run (model, api, mode...), the per-iteration statistics of the
+    agent sessions and a snapshot of the metrics with the derived hit rates.
+    """
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    return {
+        **info,
+        "iterations": [
+            {"iterations": session.iterations, "tool_turns": session.tools.turns}
+            for session in sessions or [] if session is not None
+        ],
+        "rates": {
+            "schema_cache_hit_rate": hit_rate(counters, "schema.cache_hits", "schema.cache_misses"),
+            "fragment_cache_hit_rate": hit_rate(counters, "schema.fragment_cache_hits", "schema.fragment_cache_misses"),
+            "fuzzy_hit_rate": hit_rate(counters, "schema.fuzzy_hits", "schema.fuzzy_misses"),
+            "prompt_cache_hit_rate": round(counters["llm.cached_tokens"] / counters["llm.input_tokens"], 4)
+                if counters.get("llm.input_tokens") else None,
+        },
+        **snapshot,
+    }
+
+
+def write_report(path: str, report: dict):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def prometheus_name(name: str) -> str:
+    return f"{PROMETHEUS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def prometheus_labels(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in items.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(items, escaped)) + "}"
+
+
+def prometheus_text(report: dict, labels: dict) -> str:
+    """
+    The counters and timers of a run report in the Prometheus text format.
+    """
+    lines = []
+    for name, value in report["counters"].items():
+        metric = prometheus_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric}{prometheus_labels(labels)} {value}"]
+    for name, summary in report["timers"].items():
+        metric = prometheus_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for q in QUANTILES:
+            lines.append(f"{metric}{prometheus_labels(labels, quantile=q)} {summary[f'p{int(q * 100)}']}")
+        lines.append(f"{metric}_sum{prometheus_labels(labels)} {summary['sum']}")
+        lines.append(f"{metric}_count{prometheus_labels(labels)} {summary['count']}")
+    if "seconds" in report:
+        metric = prometheus_name("run_seconds")
+        lines += [f"# TYPE {metric} gauge", f"{metric}{prometheus_labels(labels)} {report['seconds']}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, report: dict, labels: dict):
+    """
+    Writes prometheus_text of the report. The file is replaced atomically so that the textfile
+    collector never reads a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text(report, labels))
+    os.replace(tmp_path, path)
@@ -1,6 +1,4 @@
 import sys
-if sys.platform != "win32":
-    from colorama import Fore, Style
 
 # A list of models that can be used in either AWS Bedrock or OpenAI
 
@@ -13,6 +11,11 @@ MODEL_LIST = {
     "anthropic.claude-3-haiku-20240307-v1:0": ["haiku", "haiku3", "haiku-3", "anthropic.claude-3-haiku-20240307-v1:0"],
 }
 
+# Models that accept prompt cache points on Bedrock, the OpenAI models cache long prompts automatically
+PROMPT_CACHING_MODELS = {
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+}
+
 def get_model_id(model_name: str) -> str:
     for model_id, aliases in MODEL_LIST.items():
         if model_name in aliases:
@@ -24,4 +27,6 @@ def get_choices() -> list[str]:
     if sys.platform == "win32":
         return [f"{v[0]} - {k}" for k, v in MODEL_LIST.items()]
     else:
+        # Only needed for the --help text
+        from colorama import Fore, Style
         return [f"{Fore.LIGHTBLUE_EX}{Style.BRIGHT}{v[0]}{Fore.RESET}{Style.NORMAL} - {k}" for k, v in MODEL_LIST.items()]
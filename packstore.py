@@ -0,0 +1,128 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from codec import load_json
+
+"""
+A single file store for the schema files. The file starts with a fixed header pointing to a JSON
+index at its end, the payloads of the files lie between them, each one optionally compressed with
+zlib. PackStore maps the file into memory and decodes a payload straight from the mapping, so a
+lookup costs neither an open() nor a copy of anything but the requested file.
+
+    MAGIC | index offset (u64) | index length (u64) | payload ... payload | index
+"""
+
+PACK_FILE = "schemas.pack"
+MAGIC = b"CFNPACK1"
+HEADER = struct.Struct("<8sQQ")
+
+# How update_database stores the schemas: loose files or a pack with plain or compressed payloads
+LAYOUTS = ("directory", "pack", "compressed")
+
+
+def write_pack(path: str, files, compress: bool = False):
+    """
+    Writes the (name, content bytes) pairs of files into a pack at path. A compressed payload is
+    only used when it is smaller than the content.
+    """
+    index = {}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for name, content in files:
+            payload = content
+            compressed = False
+            if compress:
+                deflated = zlib.compress(content, 6)
+                if len(deflated) < len(content):
+                    payload, compressed = deflated, True
+            index[name] = [f.tell(), len(payload), len(content), compressed]
+            f.write(payload)
+        index_offset = f.tell()
+        index_data = json.dumps({"compressed": compress, "entries": index}, separators=(",", ":")).encode("utf-8")
+        f.write(index_data)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, index_offset, len(index_data)))
+    os.replace(tmp_path, path)
+
+
+class PackStore:
+    """
+    Read access to a pack written by write_pack. Safe to share between threads.
+
+    Attributes:
+        path (str): The pack file.
+        entries (dict): Name -> [offset, payload length, content length, compressed].
+        compressed (bool): Whether the pack was written with compression.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a schema pack")
+        index = load_json(self._map[index_offset:index_offset + index_length])
+        self.entries = index["entries"]
+        self.compressed = index["compressed"]
+
+
+    def read_bytes(self, name: str) -> bytes:
+        entry = self.entries.get(name)
+        if entry is None:
+            raise FileNotFoundError(f"{name} is not in {self.path}")
+        offset, length, _, compressed = entry
+        with memoryview(self._map)[offset:offset + length] as payload:
+            return zlib.decompress(payload) if compressed else bytes(payload)
+
+
+    def read(self, name: str) -> str:
+        """
+        Returns the content of a file as text, an uncompressed payload is decoded without copying it first.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            raise FileNotFoundError(f"{name} is not in {self.path}")
+        offset, length, _, compressed = entry
+        with memoryview(self._map)[offset:offset + length] as payload:
+            return str(zlib.decompress(payload) if compressed else payload, "utf-8")
+
+
+    def names(self) -> list[str]:
+        return list(self.entries)
+
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+
+    def close(self):
+        self._map.close()
+
+
+def pack_directory(directory: str, names: list[str], compress: bool = False) -> dict:
+    """
+    Moves the files of the directory into a pack. Returns the description of the pack stored in the manifest.
+    """
+    def contents():
+        for name in names:
+            with open(os.path.join(directory, name), "rb") as f:
+                yield name, f.read()
+
+    path = os.path.join(directory, PACK_FILE)
+    write_pack(path, contents(), compress)
+    for name in names:
+        os.remove(os.path.join(directory, name))
+    stat = os.stat(path)
+    return {"file": PACK_FILE, "size": stat.st_size, "mtime": stat.st_mtime_ns, "compressed": compress}
+
+
+def layout_of(manifest: dict | None) -> str:
+    pack = (manifest or {}).get("pack")
+    if not pack:
+        return "directory"
+    return "compressed" if pack.get("compressed") else "pack"
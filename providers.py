@@ -0,0 +1,122 @@
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ell.configurator import config, register_provider
+from ell.provider import EllCallParams, Metadata, Provider
+from ell.types import Message
+from models import PROMPT_CACHING_MODELS
+
+"""
+Provider wrappers used by the agent sessions. MeteredClient records the usage and latency of every
+model request, including the input tokens that were read from the provider's prompt cache. On Bedrock
+the requests of models that support prompt caching get cache points after the system prompt and after
+the last message, so the next request of the conversation can reuse everything before it.
+"""
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+def input_tokens(usage: dict) -> tuple[int, int]:
+    """
+    Returns the input tokens of a request and how many of them were read from the prompt cache.
+    Bedrock reports the cached tokens as cache_read_input_tokens (see BedrockCachingProvider),
+    OpenAI as prompt_tokens_details.cached_tokens.
+    """
+    total = usage.get("prompt_tokens") or 0
+    cached = usage.get("cache_read_input_tokens") or (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return total, cached
+
+
+class MeteredClient:
+    """
+    Wraps a model client and keeps the usage of every request made through it.
+
+    Attributes:
+        client: The wrapped client, any client with a registered provider.
+        requests (list): For every request the latency in seconds, when it finished (time.perf_counter())
+            and the usage reported by the provider.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+
+
+class MeteredProvider(Provider):
+    dangerous_disable_validation = True
+
+    def call(self, ell_call: EllCallParams, origin_id: Optional[str] = None, logger: Optional[Any] = None) -> Tuple[List[Message], Dict[str, Any], Metadata]:
+        metered_client: MeteredClient = ell_call.client
+        inner_call = ell_call.model_copy(update={"client": metered_client.client})
+        start = time.perf_counter()
+        messages, final_api_params, metadata = self.wrapped(metered_client).call(inner_call, origin_id, logger)
+        finished = time.perf_counter()
+        metered_client.requests.append({
+            "seconds": finished - start,
+            "finished": finished,
+            "usage": metadata.get("usage") or {},
+            # Answered by the ResponseCache without a model request
+            "replayed": bool(metadata.get("cached")),
+        })
+        return messages, final_api_params, metadata
+
+
+    def wrapped(self, metered_client: MeteredClient) -> Provider:
+        provider = config.get_provider_for(metered_client.client)
+        assert provider is not None, f"No provider found for client {metered_client.client}."
+        return provider
+
+
+    # The rest of the Provider interface is that of the wrapped client's provider
+    def provider_call_function(self, client: MeteredClient, api_call_params: Optional[Dict[str, Any]] = None) -> Callable[..., Any]:
+        return self.wrapped(client).provider_call_function(client.client, api_call_params)
+
+
+    def translate_to_provider(self, ell_call: EllCallParams) -> Dict[str, Any]:
+        inner_call = ell_call.model_copy(update={"client": ell_call.client.client})
+        return self.wrapped(ell_call.client).translate_to_provider(inner_call)
+
+
+    def translate_from_provider(self, provider_response: Any, ell_call: EllCallParams, provider_call_params: Dict[str, Any],
+                                origin_id: Optional[str] = None, logger: Optional[Callable[..., None]] = None) -> Tuple[List[Message], Metadata]:
+        inner_call = ell_call.model_copy(update={"client": ell_call.client.client})
+        return self.wrapped(ell_call.client).translate_from_provider(provider_response, inner_call, provider_call_params, origin_id, logger)
+
+
+register_provider(MeteredProvider(), MeteredClient)
+
+
+try:
+    from botocore.client import BaseClient
+    from ell.providers.bedrock import BedrockProvider
+
+    class BedrockCachingProvider(BedrockProvider):
+        """
+        The Bedrock provider of ell with cache points for the models in PROMPT_CACHING_MODELS.
+        The prompt tokens it reports include the tokens read from and written to the cache,
+        like they do for OpenAI, and the cached part is in cache_read_input_tokens.
+        """
+
+        def translate_to_provider(self, ell_call: EllCallParams):
+            final_call_params = super().translate_to_provider(ell_call)
+            if ell_call.model in PROMPT_CACHING_MODELS:
+                if final_call_params.get("system"):
+                    final_call_params["system"].append(CACHE_POINT)
+                if final_call_params["messages"]:
+                    final_call_params["messages"][-1]["content"].append(CACHE_POINT)
+            return final_call_params
+
+        def translate_from_provider(self, provider_response: Any, ell_call: EllCallParams, provider_call_params: Dict[str, Any],
+                                    origin_id: Optional[str] = None, logger: Optional[Callable[..., None]] = None) -> Tuple[List[Message], Metadata]:
+            messages, metadata = super().translate_from_provider(provider_response, ell_call, provider_call_params, origin_id, logger)
+            raw_usage = provider_response.get("usage") if isinstance(provider_response, dict) else None
+            if raw_usage:
+                usage = metadata["usage"]
+                usage["cache_read_input_tokens"] = raw_usage.get("cacheReadInputTokens", 0)
+                usage["cache_creation_input_tokens"] = raw_usage.get("cacheWriteInputTokens", 0)
+                usage["prompt_tokens"] += usage["cache_read_input_tokens"] + usage["cache_creation_input_tokens"]
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            return messages, metadata
+
+    register_provider(BedrockCachingProvider(), BaseClient)
+except ImportError:
+    pass
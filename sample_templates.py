@@ -1,6 +1,19 @@
 from typing import List
+from codec import YAMLError
+from styledigest import sample_digest
 
-def load_sample_templates(sample_files: List[str]) -> str | None:
+# full puts the text of the samples into the prompt, digest only their conventions and a resource of every type
+SAMPLE_MODES = ("full", "digest")
+
+def load_sample_templates(sample_files: List[str], mode: str = "full") -> str | None:
     if not sample_files:
         return None
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"Invalid sample mode: {mode}")
+    if mode == "digest":
+        try:
+            return sample_digest(sample_files)
+        except YAMLError as e:
+            # The model can still follow samples the digest cannot read
+            print(f"Cannot digest the samples ({' '.join(str(e).split())}), using their full text")
     return "\n---\n".join([ open(sample_file, 'r').read() for sample_file in sample_files ])
@@ -1,11 +1,50 @@
-import yaml
+import contextvars
 import os
-from fuzzywuzzy import process
+import sys
+import threading
+from fuzzyindex import FuzzyIndex
 import ell
+from ell.types import ContentBlock
 from pydantic import Field
+from manifest import load_manifest, is_stale, is_schema_file, manifest_entry, write_manifest, fragments_file
+from fragments import property_fragments, render_property
+from tokencount import remember
+from codec import load_json, load_yaml, YAMLError
+from lru import LRUCache
+from packstore import PackStore, PACK_FILE
+from metrics import metrics
 
 schemas = None
-cache = {}
+# The index of the job running in this context, it takes precedence over schemas (see current())
+active = contextvars.ContextVar("schema_index", default=None)
+
+# Minimum FuzzyIndex score for a fuzzy match to be used
+MIN_SCORE = 60
+
+# Memory for the contents and the property fragments of the schema files and the number of remembered query -> file resolutions
+CACHE_BYTES = 64 * 1024 * 1024
+QUERY_CACHE_ENTRIES = 4096
+
+
+class Fragments:
+    """
+    The parsed property fragments of a schema file and the size they are counted with in the cache.
+    """
+
+    def __init__(self, fragments: dict, size: int):
+        self.fragments = fragments
+        self.size = size
+
+
+def cached_size(value) -> int:
+    """
+    The size of a value of SchemaIndex.cache. Parsed fragments are stored with the byte length of
+    their file, measuring the nested dicts themselves would cost more than the lookup they save.
+    """
+    if isinstance(value, Fragments):
+        return value.size
+    return sys.getsizeof(value)
+
 
 class SchemaIndex:
     """
@@ -16,31 +55,153 @@ class SchemaIndex:
     to find the closest matching type name based on a given input and to
     retrieve the content of the corresponding YAML file.
 
+    The type names are read from the manifest written by update_database. Only when the manifest
+    is missing or stale all the YAML files are parsed and the manifest is written again.
+    When update_database packed the schemas into a single file they are read from the pack.
+
     Attributes:
+        directory (str): The directory with the schema files.
         type_name_dict (dict): A dictionary mapping lowercase type names to their corresponding YAML file names.
+        type_names (list): The type names in their original case.
+        token_counts (dict): Precomputed token counts of the YAML files.
+        store (PackStore): The pack with the schema files, None when they are separate files.
+        cache (LRUCache): Contents of the schema files and their parsed property fragments keyed by
+            the file, limited together to cache_bytes.
+        queries (LRUCache): The file each type name passed to get() resolved to, so that "s3 bucket"
+            and "AWS::S3::Bucket" share one cached schema and the fuzzy search runs once per query.
+        validator (TemplateValidator): Checks the templates against these schemas, shared by all agents.
     """
 
-    def __init__(self, directory='db'):
+    def __init__(self, directory='db', use_manifest=True, cache_bytes=CACHE_BYTES):
+        self.directory = directory
         self.type_name_dict = {}
-        self.load_yaml_files(directory)
+        self.type_names = []
+        self.token_counts = {}
+        self.store = None
+        self.cache = LRUCache(max_bytes=cache_bytes, sizeof=cached_size)
+        self.queries = LRUCache(max_entries=QUERY_CACHE_ENTRIES)
+        self._fuzzy_index = None
+        self._validator = None
+        self._lock = threading.Lock()
+        if not (use_manifest and self.load_manifest(directory)):
+            self.load_yaml_files(directory)
 
 
-    def load_yaml_files(self, directory):
+    def close(self):
+        """
+        Releases the pack, schemas that are not cached cannot be read afterwards.
+        """
+        if self.store is not None:
+            self.store.close()
+
+
+    def load_manifest(self, directory) -> bool:
+        """
+        Fills the type_name_dict from the manifest. Returns False if the manifest cannot be used.
+        """
+        if not os.path.exists(directory):
+            return False
+        manifest = load_manifest(directory)
+        if manifest is None or is_stale(directory, manifest):
+            return False
+        if manifest.get("pack"):
+            try:
+                self.store = PackStore(os.path.join(directory, manifest["pack"]["file"]))
+            except (OSError, ValueError):
+                return False
+        for entry in manifest["entries"]:
+            self.type_names.append(entry["typeName"])
+            if "tokens" in entry:
+                self.token_counts[entry["file"]] = entry["tokens"]
+            for alias in entry["aliases"]:
+                self.type_name_dict[alias] = entry["file"]
+        return True
+
+
+    def load_yaml_files(self, directory, write=True):
         if os.path.exists(directory):
-            yaml_files = [file for file in os.listdir(directory) if file.endswith('.yaml') or file.endswith('.yml')]
+            entries = []
+            # The download validators and the zip members of the stale manifest let the next update
+            # skip the download and reuse the files whose content did not change
+            previous = load_manifest(directory) or {}
+            sources = {entry["file"]: entry for entry in previous.get("entries", []) if "source" in entry}
+            yaml_files = [file for file in os.listdir(directory) if is_schema_file(file)]
+            if not yaml_files and os.path.exists(os.path.join(directory, PACK_FILE)):
+                # A packed database, its manifest can only be written by update_database
+                self.store = PackStore(os.path.join(directory, PACK_FILE))
+                yaml_files = [file for file in self.store.names() if is_schema_file(file)]
+                write = False
             for yaml_file in yaml_files:
-                with open(os.path.join(directory, yaml_file), 'r') as file:
-                    try:
-                        yaml_content = yaml.safe_load(file)
-                        type_name = yaml_content.get('typeName')
-                        if type_name:
-                            self.type_name_dict[type_name.lower()] = yaml_file
-                            # Also add the type name without the AWS:: prefix
-                            self.type_name_dict[type_name.lower().replace("aws::", "")] = yaml_file
-                        else:
-                            print(f"No typeName found in {yaml_file}")
-                    except yaml.YAMLError as e:
-                        print(f"Error parsing {yaml_file}: {e}")
+                content = self.read_bytes(yaml_file)
+                try:
+                    yaml_content = load_yaml(content)
+                    type_name = yaml_content.get('typeName')
+                    if type_name:
+                        self.type_names.append(type_name)
+                        self.type_name_dict[type_name.lower()] = yaml_file
+                        # Also add the type name without the AWS:: prefix
+                        self.type_name_dict[type_name.lower().replace("aws::", "")] = yaml_file
+                        if write:
+                            entry = manifest_entry(directory, yaml_file, type_name, content)
+                            if yaml_file in sources and sources[yaml_file].get("sha256") == entry["sha256"]:
+                                entry["source"] = sources[yaml_file]["source"]
+                            self.token_counts[yaml_file] = entry["tokens"]
+                            entries.append(entry)
+                    else:
+                        print(f"No typeName found in {yaml_file}")
+                except YAMLError as e:
+                    print(f"Error parsing {yaml_file}: {e}")
+            if write:
+                try:
+                    write_manifest(directory, entries, previous.get("source"))
+                except IOError as e:
+                    print(f"Could not write the schema manifest: {e}")
+
+
+    def read(self, file) -> str:
+        """
+        Returns the content of a file of the database from the pack or the directory.
+        """
+        if self.store is not None:
+            return self.store.read(file)
+        with open(os.path.join(self.directory, file), 'r') as f:
+            return f.read()
+
+
+    def read_bytes(self, file) -> bytes:
+        if self.store is not None:
+            return self.store.read_bytes(file)
+        with open(os.path.join(self.directory, file), 'rb') as f:
+            return f.read()
+
+
+    @property
+    def fuzzy_index(self) -> FuzzyIndex:
+        """
+        The index is built on the first fuzzy lookup so that exact lookups do not pay for it.
+        """
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyIndex(self.type_names)
+        return self._fuzzy_index
+
+
+    @property
+    def validator(self):
+        """
+        Created on first use, the validator keeps the property sets it built for the next templates.
+        """
+        with self._lock:
+            if self._validator is None:
+                from validator import TemplateValidator
+                self._validator = TemplateValidator(self)
+            return self._validator
+
+
+    def search(self, type_name, k=5) -> list[tuple[str, int]]:
+        """
+        Returns up to k closest keys of the type_name_dict with their scores (0-100).
+        """
+        return self.fuzzy_index.search(type_name, k)
 
 
     def _closest_key(self, type_name) -> str | None:
@@ -48,15 +209,33 @@ class SchemaIndex:
         Find the closest matching key in the type_name_dict.
         """
         if type_name.lower() in self.type_name_dict:
+            metrics.count("schema.exact_hits")
             return type_name.lower()
         else:
-            closest_match, score = process.extractOne(type_name.lower(), self.type_name_dict.keys())
-            if score > 70:
-                return closest_match
+            with metrics.timer("schema.fuzzy_search"):
+                matches = self.search(type_name, 1)
+            if matches and matches[0][1] >= MIN_SCORE:
+                metrics.count("schema.fuzzy_hits")
+                return matches[0][0]
             else:
+                metrics.count("schema.fuzzy_misses")
                 return None
 
 
+    def resolve(self, type_name) -> str | None:
+        """
+        Returns the schema file of a type name, or None if nothing matches well enough.
+        """
+        yaml_file = self.queries.get(type_name)
+        if yaml_file is None:
+            closest_key = self._closest_key(type_name)
+            if closest_key is None:
+                return None
+            yaml_file = self.type_name_dict[closest_key]
+            self.queries.put(type_name, yaml_file)
+        return yaml_file
+
+
     def get(self, type_name) -> str:
         """
         Look up a type name in the type_name_dict and load the corresponding YAML file.
@@ -67,33 +246,118 @@ class SchemaIndex:
         Returns:
         str: The file content as string.
         """
-        closest_key = self._closest_key(type_name)
-        if closest_key:
-            yaml_file = self.type_name_dict[closest_key]
-            if type_name in cache:
-                return cache[type_name]
+        with metrics.timer("schema.get"):
+            yaml_file = self.resolve(type_name)
+            if yaml_file is None:
+                return self._not_found(type_name)
+            content = self.cache.get(yaml_file)
+            if content is not None:
+                metrics.count("schema.cache_hits")
+                return content
+            metrics.count("schema.cache_misses")
             try:
-                with open(os.path.join('db', yaml_file), 'r') as file:
-                    cache[type_name] = file.read()
-                    return cache[type_name]
+                content = self.read(yaml_file)
             except IOError as e:
                 return f"Error opening {yaml_file}: {e}. Failed to get definition of {type_name}"
-        else:
-            return f"No schema file found for {type_name}"
+            if yaml_file in self.token_counts:
+                remember(content, self.token_counts[yaml_file])
+            self.cache.put(yaml_file, content)
+            return content
+
+
+    def _not_found(self, type_name) -> str:
+        candidates = [name for name, _ in self.search(type_name, 3)]
+        hint = f". Closest types: {', '.join(candidates)}" if candidates else ""
+        return f"No schema file found for {type_name}{hint}"
+
+
+    def fragments(self, yaml_file) -> dict:
+        """
+        Loads the precomputed property fragments of a schema file. Databases updated before
+        the fragments existed fall back to computing them from the schema file.
+        """
+        key = fragments_file(yaml_file)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.count("schema.fragment_cache_hits")
+            return cached.fragments
+        metrics.count("schema.fragment_cache_misses")
+        try:
+            data = self.read_bytes(key)
+            fragments = load_json(data)
+        except (IOError, ValueError):
+            data = self.read_bytes(yaml_file)
+            fragments = property_fragments(load_yaml(data))
+        self.cache.put(key, Fragments(fragments, len(data)))
+        return fragments
+
 
-def load_schemas():
+    def get_property(self, type_name, property_path="") -> str:
+        """
+        Look up a type name and return only a part of its schema.
+
+        Args:
+        type_name (str): The type name to look up (case-insensitive).
+        property_path (str): Dotted path of the property such as LaunchTemplateData.BlockDeviceMappings.
+            Without a path a compact summary of all top level properties is returned.
+
+        Returns:
+        str: The summary or the YAML of the property subtree.
+        """
+        yaml_file = self.resolve(type_name)
+        if yaml_file is None:
+            return self._not_found(type_name)
+        try:
+            fragments = self.fragments(yaml_file)
+        except IOError as e:
+            return f"Error opening {yaml_file}: {e}. Failed to get definition of {type_name}"
+        if not property_path.strip():
+            return fragments["summary"]
+        rendered = render_property(fragments, property_path.strip())
+        if rendered is None:
+            return f"Property {property_path} not found in {fragments['typeName']}. Available properties: {', '.join(fragments['properties'])}"
+        return rendered
+
+def load_schemas(cache_bytes=CACHE_BYTES, directory='db') -> SchemaIndex:
     global schemas
-    schemas = SchemaIndex()
+    with metrics.timer("schema.load"):
+        schemas = SchemaIndex(directory=directory, cache_bytes=cache_bytes)
+    return schemas
+
+
+def current() -> SchemaIndex:
+    """
+    The index the lookups use: the one set in active, which server mode sets to the index a job
+    started with, otherwise the loaded one, loading it on first use.
+    """
+    index = active.get() or schemas
+    if index is None:
+        index = load_schemas()
+    return index
+
 
 @ell.tool()
 def get_cloudformation_schema(
     type_name: str = Field(description="The type name to get the schema for, e.g. AWS::S3::Bucket but can also be fuzzy such as 's3 bucket'")
-) -> str:
+) -> list[ContentBlock]:
     """
     Get the CloudFormation schema for a given type name.
     The resulting schema is a YAML document.
     It contains all the properties and descriptions for a given CloudFormation resource type.
     """
-    if schemas is None:
-        load_schemas()
-    return schemas.get(type_name)
+    # A content block is sent as is, a plain string would be JSON encoded by ell
+    return [ContentBlock(text=current().get(type_name))]
+
+
+@ell.tool()
+def get_cloudformation_property(
+    type_name: str = Field(description="The type name to get the property for, e.g. AWS::EC2::LaunchTemplate but can also be fuzzy such as 'launch template'"),
+    property_path: str = Field(default="", description="Dotted path of the property, e.g. LaunchTemplateData.BlockDeviceMappings. Leave empty to get a summary of all properties.")
+) -> list[ContentBlock]:
+    """
+    Get a part of the CloudFormation schema for a given type name.
+    Without a property path it returns a compact summary of all properties with their types and whether they are required.
+    With a property path it returns the YAML schema of only that property including its nested properties.
+    Prefer this tool over get_cloudformation_schema for large resources.
+    """
+    return [ContentBlock(text=current().get_property(type_name, property_path))]
@@ -0,0 +1,358 @@
+import argparse
+import ipaddress
+import itertools
+import json
+import os
+import shutil
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from client import DEFAULT_ADDRESS
+from manifest import MANIFEST_FILE
+from metrics import metrics, prometheus_text
+from models import get_choices
+from update import snapshot_database, update_database
+
+# The schema index, the agents and ell with the model SDKs are imported where they are used: the
+# workers of update_database start with forkserver or spawn and import this module again as __mp_main__
+
+"""
+Server mode: one process keeps the schema index, its caches, the model client and ell initialized
+and runs the generate/transform jobs submitted over a local HTTP or Unix socket API. The jobs run
+on a bounded pool of workers, the database is checked for updates in the background and a new
+index replaces the old one once it is loaded, jobs in progress finish with the index they started with.
+Every index reads from its own snapshot of db under VERSIONS_DIR, removed once no job uses the index.
+
+    POST /jobs      a job as in batch mode, answers with its result once it finished
+    GET  /health    workers, queue and the age of the schema database
+    GET  /metrics   the metrics of the server in the Prometheus text format
+
+    python server.py --api openai --workers 8
+    echo "Create a VPC" | python main.py --server 127.0.0.1:8765
+"""
+
+# How often the background thread checks the schema database, update_database itself skips the download for a day
+REFRESH_SECONDS = 60 * 60
+# Connections waiting to be accepted, the default of 5 resets clients when many submit at once
+LISTEN_BACKLOG = 128
+# Hard linked snapshots of db, one per loaded index, in a directory per server process
+VERSIONS_DIR = ".db-versions"
+
+
+class JobServer:
+    """
+    Runs the submitted jobs and keeps the schema index fresh.
+
+    Attributes:
+        config (Configuration): Shared by all jobs, with the model client and its connection pool.
+        workers (int): Number of jobs running at the same time.
+        max_pending (int): Jobs running or waiting, more are rejected instead of queueing without limit.
+        retries (int): How many times a failed job is retried.
+        pending (int): Jobs running or waiting at the moment.
+        refreshed (float): When the schema index was loaded last.
+        index (SchemaIndex): The index new jobs start with.
+        users (dict): Index -> number of running jobs that started with it.
+        retired (list): Replaced indexes still used by running jobs.
+    """
+
+    def __init__(self, config, workers: int = 4, max_pending: int | None = None, retries: int = 0,
+                 cache_bytes: int | None = None, layout: str | None = None):
+        import schemaindex
+        self.config = config
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.retries = retries
+        self.cache_bytes = cache_bytes or schemaindex.CACHE_BYTES
+        self.layout = layout
+        self.pending = 0
+        self.refreshed = None
+        self.index = None
+        self.users = {}
+        self.retired = []
+        self.snapshots = os.path.join(VERSIONS_DIR, str(os.getpid()))
+        self.started = time.time()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.stopped = threading.Event()
+
+
+    def submit(self, job: dict):
+        """
+        Queues the job and returns its future, None if there are already max_pending jobs.
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                metrics.count("server.rejected")
+                return None
+            self.pending += 1
+        metrics.count("server.jobs")
+        return self.executor.submit(self.run, job)
+
+
+    def run(self, job: dict) -> dict:
+        import schemaindex
+        from batch import run_with_retries
+        with self.lock:
+            index = self.index
+            self.users[index] = self.users.get(index, 0) + 1
+        # The tools and the validator of the job use this index even after a refresh replaced it
+        token = schemaindex.active.set(index)
+        try:
+            with metrics.timer("server.job"):
+                result = run_with_retries(job, self.config, self.retries, backoff=1.0)
+            metrics.count(f"server.jobs_{result['status']}")
+            return result
+        finally:
+            schemaindex.active.reset(token)
+            with self.lock:
+                self.pending -= 1
+                self.users[index] -= 1
+            self.collect()
+
+
+    def manifest_mtime(self) -> int | None:
+        try:
+            return os.stat(os.path.join("db", MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+
+    def refresh(self, force_load: bool = False) -> bool:
+        """
+        Updates the database when it is due and loads a new index if the database changed.
+        Returns whether a new index was loaded.
+        """
+        import schemaindex
+        before = self.manifest_mtime()
+        with metrics.timer("server.refresh"):
+            update_database(layout=self.layout)
+        if not force_load and before is not None and before == self.manifest_mtime():
+            return False
+        # The next update swaps db while jobs may still read the schemas of this one
+        snapshot = snapshot_database(os.path.join(os.getcwd(), "db"), self.snapshots)
+        try:
+            index = schemaindex.load_schemas(cache_bytes=self.cache_bytes, directory=snapshot)
+        except BaseException:
+            shutil.rmtree(snapshot, ignore_errors=True)
+            raise
+        with self.lock:
+            if self.index is not None:
+                self.retired.append(self.index)
+            self.index = index
+        self.collect()
+        self.refreshed = time.time()
+        metrics.count("server.index_loads")
+        return True
+
+
+    def collect(self):
+        """
+        Closes the retired indexes no running job uses anymore and removes their snapshots.
+        """
+        with self.lock:
+            unused = [index for index in self.retired if not self.users.get(index)]
+            self.retired = [index for index in self.retired if self.users.get(index)]
+            for index in unused:
+                self.users.pop(index, None)
+        for index in unused:
+            index.close()
+            shutil.rmtree(index.directory, ignore_errors=True)
+
+
+    def refresh_loop(self, interval: float):
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.count("server.refresh_errors")
+                print(f"Refreshing the schema database failed: {e.__class__.__name__}: {e}")
+
+
+    def health(self) -> dict:
+        import schemaindex
+        index = schemaindex.schemas
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "index_age_seconds": round(time.time() - self.refreshed, 1) if self.refreshed else None,
+            "schema_types": len(index.type_names) if index else 0,
+            "schema_cache": index.cache.stats() if index else None,
+            "retired_indexes": len(self.retired),
+        }
+
+
+    def close(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.snapshots, ignore_errors=True)
+
+
+def remove_stale_snapshots():
+    """
+    Removes the snapshots left behind by server processes that are no longer running.
+    """
+    if not os.path.isdir(VERSIONS_DIR):
+        return
+    for name in os.listdir(VERSIONS_DIR):
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        try:
+            os.kill(int(name), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(VERSIONS_DIR, name), ignore_errors=True)
+        except PermissionError:
+            pass
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of a JobServer, which the server object passes as job_server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        jobs = self.server.job_server
+        if self.path == "/health":
+            self.send_json(200, jobs.health())
+        elif self.path == "/metrics":
+            data = prometheus_text(metrics.snapshot(), {"model": jobs.config.agent_model}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+
+    def do_POST(self):
+        from batch import check_job
+        if self.path != "/jobs":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = check_job(json.loads(self.rfile.read(length)), f"job-{next(self.server.job_server.ids)}")
+        except (ValueError, AttributeError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        # The client writes the template, relative paths would be resolved against the directory of the server
+        job.pop("output", None)
+        future = self.server.job_server.submit(job)
+        if future is None:
+            self.send_json(503, {"error": "Too many jobs, try again later"})
+            return
+        self.send_json(200, future.result())
+
+
+    def address_string(self) -> str:
+        # A Unix socket has no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+
+class HTTPJobServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, address: tuple, job_server: JobServer):
+        super().__init__(address, JobHandler)
+        self.job_server = job_server
+
+
+class UnixJobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, path: str, job_server: JobServer):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, JobHandler)
+        self.job_server = job_server
+
+
+def is_loopback(address: str) -> bool:
+    """
+    Whether the address only accepts connections from this machine: a Unix socket or a loopback host.
+    """
+    if address.startswith("unix:") or address.startswith("/"):
+        return True
+    host = address.rpartition(":")[0].strip("[]")
+    if host in ("", "localhost"):
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(job_server: JobServer, address: str = DEFAULT_ADDRESS, refresh: float = REFRESH_SECONDS):
+    """
+    Loads the index and answers requests on address (host:port or the path of a Unix socket) until interrupted.
+    """
+    remove_stale_snapshots()
+    job_server.refresh(force_load=True)
+    socket_path = address[len("unix:"):] if address.startswith("unix:") else address if address.startswith("/") else None
+    if socket_path:
+        http_server = UnixJobServer(socket_path, job_server)
+    else:
+        host, _, port = address.rpartition(":")
+        http_server = HTTPJobServer((host or "127.0.0.1", int(port)), job_server)
+    threading.Thread(target=job_server.refresh_loop, args=(refresh,), name="refresh", daemon=True).start()
+    print(f"Serving {job_server.config.agent_model} on {address} with {job_server.workers} workers", flush=True)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        job_server.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve template generation and transformation jobs from a warm process', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--address', type=str, help='host:port to listen on or the path of a Unix socket (unix:/path or /path).', default=DEFAULT_ADDRESS)
+    parser.add_argument('--api', type=str, choices=['bedrock', 'openai', 'stub'], help='Which API to use for LLM inference.', default='openai')
+    parser.add_argument('--model', type=str, help="Which model to use. Available models:\n" + "\n".join(get_choices()), default='mini')
+    parser.add_argument('--workers', type=int, help='Number of jobs running at the same time.', default=4)
+    parser.add_argument('--queue', type=int, help='Maximum number of jobs running or waiting, more are rejected. Defaults to 4 per worker.', default=None)
+    parser.add_argument('--retries', type=int, help='How many times a failed job is retried.', default=0)
+    parser.add_argument('--rate', type=float, help='Maximum model requests per second.', default=None)
+    parser.add_argument('--token-limit', type=int, help='Maximum prompt tokens of a request.', default=100000)
+    parser.add_argument('--cache', type=str, help='Directory where model responses are recorded. Identical requests are answered from it.', default=None)
+    parser.add_argument('--cache-size', type=int, help='Maximum size of the response cache in MB.', default=256)
+    parser.add_argument('--layout', type=str, choices=['directory', 'pack', 'compressed'], help='How the schemas are stored, defaults to the layout of the current database.', default=None)
+    parser.add_argument('--schema-cache-size', type=int, help='Memory for the schemas loaded by the agents in MB.', default=64)
+    parser.add_argument('--refresh', type=float, help='Seconds between the checks for a schema database update.', default=REFRESH_SECONDS)
+    parser.add_argument('--no-validate', action='store_true', help='Do not check the templates against the schemas.')
+    parser.add_argument('--allow-remote', action='store_true', help='Listen on an address other machines can reach. Jobs name files the server reads,\nso any client can read every file the server process can.')
+    args = parser.parse_args()
+    if not args.allow_remote and not is_loopback(args.address):
+        parser.error(f"{args.address} is reachable from other machines and the jobs can read any file of the server, pass --allow-remote to listen on it anyway")
+
+    from batch import TokenBucket
+    from config import create_configuration
+
+    config = create_configuration(args.api, args.model, args.token_limit, max_connections=max(10, args.workers),
+                                  rate_limiter=TokenBucket(args.rate) if args.rate else None,
+                                  cache_dir=args.cache, cache_size=args.cache_size * 1024 * 1024, validate=not args.no_validate)
+    job_server = JobServer(config, workers=args.workers, max_pending=args.queue, retries=args.retries,
+                           cache_bytes=args.schema_cache_size * 1024 * 1024, layout=args.layout)
+    serve(job_server, args.address, args.refresh)
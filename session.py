@@ -0,0 +1,167 @@
+from typing import Callable, List
+import ell
+from ell.types import ContentBlock, ToolCall, ToolResult
+from budget import EVICTED, TokenBudget
+from config import Configuration
+from metrics import metrics
+from providers import MeteredClient, input_tokens
+from tokencount import count_tokens
+from toolexec import ToolExecutor, call_key, repeated_call_id
+from validator import TemplateValidator, feedback
+
+"""
+A conversation of an agent with the model. The requests of an agent loop only ever grow at the end:
+the system prompt (with the sample templates), the user's message and then the tool calls and
+their results in the order they were made. Keeping that prefix identical from one request to the
+next is what lets the providers serve it from their prompt cache instead of processing it again.
+"""
+
+MAX_ITERATIONS = 30
+# How many times an invalid template is sent back to the model with the problems found
+MAX_FIXES = 2
+
+
+class AgentSession:
+    """
+    Builds the model callable once and appends the responses and tool results to the conversation in place.
+    A tool call repeating one whose result is still in the conversation is answered with a pointer to it.
+
+    Attributes:
+        system_prompt (str): The first part of every request, never changes during the session.
+        messages (list): The conversation without the system prompt.
+        budget (TokenBudget): Shrinks old tool results when a request would exceed the token limit.
+        tools (ToolExecutor): Runs the tool calls of every turn.
+        iterations (list): For every request its latency and input tokens, total and read from the prompt cache.
+        validations (list): Number of problems found in every answer that was validated.
+    """
+
+    def __init__(self, config: Configuration, system_prompt: str, tools: List[Callable], executor: ToolExecutor | None = None):
+        self.system_prompt = system_prompt
+        self.messages = []
+        self.budget = TokenBudget(config.token_limit)
+        self.tools = executor or ToolExecutor()
+        self.iterations = []
+        self.validations = []
+        self.rate_limiter = config.rate_limiter
+        self.client = MeteredClient(config.client)
+        self._system = ell.system(system_prompt)
+        self._reserved = count_tokens(system_prompt)
+        # call_key -> (tool_call_id, tool result message) of the results in the conversation
+        self._answered = {}
+
+        @ell.complex(model=config.agent_model, tools=tools, temperature=0.4, client=self.client)
+        def agent_turn(messages: List[ell.Message]) -> List[ell.Message]:
+            return messages
+
+        self._turn = agent_turn
+
+
+    def send(self, message: ell.Message) -> ell.Message:
+        """
+        Appends the message to the conversation, sends it and appends the response.
+        """
+        self.messages.append(message)
+        # The results the new message points to have to stay intact for the model to read them
+        holders = {call_id: holder for call_id, holder in self._answered.values()}
+        keep = {id(holders[call_id]) for block in message.content if (call_id := repeated_call_id(block)) in holders}
+        fitted = self.budget.fit(self.messages, self._reserved, keep)
+        if fitted is not self.messages:
+            # The budget replaced old results, a call answered by them has to run again
+            self.messages[:] = fitted
+            kept = {id(message) for message in self.messages}
+            self._answered = {key: value for key, value in self._answered.items() if id(value[1]) in kept}
+            self._drop_dangling_pointers()
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        response = self._turn([self._system] + self.messages)
+        self.messages.append(response)
+
+        request = self.client.requests[-1]
+        total, cached = input_tokens(request["usage"])
+        iteration = {
+            "seconds": request["seconds"],
+            "input_tokens": total,
+            "cached_tokens": cached,
+            "uncached_tokens": total - cached,
+            "output_tokens": request["usage"].get("completion_tokens") or 0,
+            "replayed": request["replayed"],
+        }
+        self.iterations.append(iteration)
+        metrics.observe("llm.request", iteration["seconds"])
+        metrics.count("llm.requests")
+        metrics.count("llm.replayed", iteration["replayed"])
+        for name in ("input_tokens", "cached_tokens", "output_tokens"):
+            metrics.count(f"llm.{name}", iteration[name])
+        return response
+
+
+    def _drop_dangling_pointers(self):
+        """
+        Replaces the pointers of older messages to results the budget has shrunk since with the
+        note of an evicted result, so the conversation does not claim the result is still there.
+        """
+        intact = {call_id for call_id, _ in self._answered.values()}
+        calls = {block.tool_call.tool_call_id: block.tool_call
+                 for message in self.messages for block in message.content if block.tool_call is not None}
+        for i, message in enumerate(self.messages):
+            blocks = []
+            for block in message.content:
+                target = repeated_call_id(block)
+                if target is not None and target not in intact:
+                    call = calls.get(block.tool_result.tool_call_id)
+                    text = EVICTED.format(tool=call.tool.__name__ if call else "the tool")
+                    block = ContentBlock(tool_result=ToolResult(tool_call_id=block.tool_result.tool_call_id, result=[ContentBlock(text=text)]))
+                blocks.append(block)
+            if any(new is not old for new, old in zip(blocks, message.content)):
+                replaced = ell.Message(role=message.role, content=blocks)
+                self.messages[i] = replaced
+                self._answered = {key: (call_id, replaced if holder is message else holder)
+                                  for key, (call_id, holder) in self._answered.items()}
+
+
+    def run(self, prompt: str, max_iterations: int = MAX_ITERATIONS, validator: TemplateValidator | None = None,
+            max_fixes: int = MAX_FIXES) -> str:
+        """
+        Sends the prompt and runs the requested tools until the model answers without tool calls.
+        With a validator (a TemplateValidator or anything with the same validate() and FIX_REQUEST)
+        the answer is checked and the problems are sent back to the model, at most max_fixes times.
+        Returns the text of the final answer.
+        """
+        metrics.count("agent.runs")
+        response = self.send(ell.user(prompt))
+        while True:
+            while max_iterations > 0 and (response is ToolCall or response.tool_calls):
+                tool_results = self.tools.run(response, {key: value[0] for key, value in self._answered.items()})
+                for call in response.tool_calls:
+                    self._answered.setdefault(call_key(call), (call.tool_call_id, tool_results))
+                response = self.send(tool_results)
+                max_iterations -= 1
+
+            if max_iterations <= 0:
+                metrics.count("agent.stuck")
+                raise Exception("Too many iterations, probably stuck in a loop.")
+            if validator is None:
+                return response.text
+
+            with metrics.timer("agent.validate"):
+                problems = validator.validate(response.text)
+            self.validations.append(len(problems))
+            if not problems:
+                return response.text
+            if len(self.validations) > max_fixes:
+                metrics.count("agent.invalid")
+                return response.text
+            metrics.count("agent.fixes")
+            response = self.send(ell.user(feedback(problems, validator.FIX_REQUEST)))
+
+
+    def summary(self) -> str:
+        total = sum(iteration["input_tokens"] for iteration in self.iterations)
+        cached = sum(iteration["cached_tokens"] for iteration in self.iterations)
+        share = f" ({100 * cached / total:.0f}%)" if total else ""
+        text = f"{len(self.iterations)} requests used {total} input tokens, {cached} of them from the prompt cache{share}"
+        if self.validations and self.validations[0]:
+            rounds = len(self.validations) - 1
+            text += f", {rounds} round{'s' if rounds != 1 else ''} fixing the template left {self.validations[-1]} of {self.validations[0]} problems"
+        return text
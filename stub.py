@@ -0,0 +1,168 @@
+import hashlib
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ell.configurator import register_provider
+from ell.provider import EllCallParams, Metadata, Provider
+from ell.types import ContentBlock, Message, ToolCall
+from ell.types._lstr import _lstr
+from tokencount import count_tokens
+
+"""
+An offline model backend. StubClient replays a fixed sequence of tool call turns followed by a final
+template, so the agent loops, batch mode and benchmarks can run without network access or API keys.
+Use it with Configuration(client=StubClient()) or --api stub.
+"""
+
+DEFAULT_SCRIPT = [
+    [
+        {"name": "get_cloudformation_schema", "params": {"type_name": "AWS::EC2::VPC"}},
+        {"name": "get_cloudformation_schema", "params": {"type_name": "AWS::EC2::Subnet"}},
+    ],
+    [
+        {"name": "get_cloudformation_property", "params": {"type_name": "route table", "property_path": ""}},
+        {"name": "get_cloudformation_property", "params": {"type_name": "nat gateway", "property_path": ""}},
+    ],
+]
+
+DEFAULT_TEMPLATE = """AWSTemplateFormatVersion: '2010-09-09'
+Description: Template generated by the stub model
+Resources:
+  Vpc:
+    Type: AWS::EC2::VPC
+    Properties:
+      CidrBlock: 10.0.0.0/16
+  Subnet:
+    Type: AWS::EC2::Subnet
+    Properties:
+      VpcId: !Ref Vpc
+      CidrBlock: 10.0.0.0/24
+"""
+
+
+def message_record(message: Message) -> dict:
+    """
+    A provider independent, JSON serializable form of a message.
+    """
+    content = []
+    for block in message.content:
+        if block.tool_call is not None:
+            content.append({"tool_call": {
+                "id": str(block.tool_call.tool_call_id),
+                "name": block.tool_call.tool.__name__,
+                "params": block.tool_call.params.model_dump(),
+            }})
+        elif block.tool_result is not None:
+            content.append({"tool_result": {"id": str(block.tool_result.tool_call_id), "text": block.tool_result.text_only}})
+        elif block.text is not None:
+            content.append({"text": str(block.text)})
+    return {"role": message.role, "content": content}
+
+
+def record_to_messages(record: dict, ell_call: EllCallParams, origin_id: Optional[str] = None) -> List[Message]:
+    """
+    Turns a response in the message_record form back into ell messages with the tools of the call.
+    """
+    blocks = []
+    for block in record["content"]:
+        if "text" in block:
+            blocks.append(ContentBlock(text=_lstr(block["text"], origin_trace=origin_id)))
+        elif "tool_call" in block:
+            call = block["tool_call"]
+            tool = ell_call.get_tool_by_name(call["name"])
+            if tool is None:
+                raise ValueError(f"Recorded tool {call['name']} is not available in this call.")
+            blocks.append(ContentBlock(tool_call=ToolCall(
+                tool=tool,
+                tool_call_id=_lstr(call["id"], origin_trace=origin_id),
+                params=call["params"],
+            )))
+    return [Message(role=record.get("role", "assistant"), content=blocks)]
+
+
+class StubClient:
+    """
+    Answers the n-th model call of a conversation with the n-th turn of the script and
+    with the final template once the script is exhausted.
+
+    Attributes:
+        script (list): Turns of tool calls, each a list of {"name", "params"}.
+        final (str): The text returned after the last turn.
+        latency (float): Seconds every call sleeps to emulate the model.
+        calls (int): Number of calls served.
+        prefixes (set): Hashes of the message prefixes seen so far. Like the prompt cache of a provider,
+            the tokens of the longest prefix sent before are reported as cached_tokens.
+    """
+
+    def __init__(self, script: list | None = None, final: str = DEFAULT_TEMPLATE, latency: float = 0.0):
+        self.script = DEFAULT_SCRIPT if script is None else script
+        self.final = final
+        self.latency = latency
+        self.calls = 0
+        self.prefixes = set()
+
+
+    def cached_tokens(self, messages: list[dict]) -> int:
+        digest = hashlib.sha256()
+        cached = 0
+        for i, message in enumerate(messages):
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            prefix = digest.hexdigest()
+            if prefix in self.prefixes:
+                cached = i + 1
+            self.prefixes.add(prefix)
+        return count_tokens(json.dumps(messages[:cached])) if cached else 0
+
+
+    def complete(self, model: str, messages: list[dict], tools: list[str], **api_params) -> dict:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        turn = sum(1 for message in messages if message["role"] == "assistant")
+        if turn < len(self.script) and tools:
+            content = [{"tool_call": {"id": f"stub_{turn}_{i}", "name": call["name"], "params": call["params"]}}
+                       for i, call in enumerate(self.script[turn]) if call["name"] in tools]
+        else:
+            content = [{"text": self.final}]
+        response = {"role": "assistant", "content": content}
+        return {
+            "message": response,
+            "usage": {
+                "prompt_tokens": count_tokens(json.dumps(messages)),
+                "prompt_tokens_details": {"cached_tokens": self.cached_tokens(messages)},
+                "completion_tokens": count_tokens(json.dumps(content)),
+            },
+        }
+
+
+class StubProvider(Provider):
+    dangerous_disable_validation = True
+
+    def provider_call_function(self, client: StubClient, api_call_params: Optional[Dict[str, Any]] = None) -> Callable[..., Any]:
+        return client.complete
+
+    def translate_to_provider(self, ell_call: EllCallParams) -> Dict[str, Any]:
+        return {
+            **ell_call.api_params,
+            "model": ell_call.model,
+            "messages": [message_record(message) for message in ell_call.messages],
+            "tools": [tool.__name__ for tool in ell_call.tools],
+        }
+
+    def translate_from_provider(
+        self,
+        provider_response: dict,
+        ell_call: EllCallParams,
+        provider_call_params: Dict[str, Any],
+        origin_id: Optional[str] = None,
+        logger: Optional[Callable[..., None]] = None,
+    ) -> Tuple[List[Message], Metadata]:
+        messages = record_to_messages(provider_response["message"], ell_call, origin_id)
+        if logger:
+            logger(messages[0].text)
+        usage = dict(provider_response.get("usage", {}))
+        usage["total_tokens"] = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        return messages, {"usage": usage}
+
+
+register_provider(StubProvider(), StubClient)
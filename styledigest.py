@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from codec import YAMLError, load_template
+from metrics import metrics
+from templatepatch import PatchError, TemplateText
+
+"""
+Reduces the sample templates to a style digest for the system prompt: the conventions of the samples
+(naming, parameters, tags, intrinsic functions, formatting) as comments and one resource of every type
+in its original text, instead of the full text of every sample resent with every request. Building a
+digest parses every sample so the digests are stored in DIGEST_DIR keyed by the hash of the samples.
+"""
+
+DIGEST_DIR = ".digests"
+# Part of the cache key, bump it when the digest changes so old digests are not used
+DIGEST_VERSION = 1
+
+SHORT_FORM = re.compile(r"!(Ref|Sub|GetAtt|Join|If|Select|Split|FindInMap|ImportValue|Equals|Not|And|Or|Condition|Base64|Cidr|GetAZs)\b")
+LONG_FORM = re.compile(r"[\"']?\b(Ref|Fn::[A-Za-z]+)[\"']?\s*:")
+PARAMETER_KEYS = ("Description", "Default", "AllowedValues", "AllowedPattern", "ConstraintDescription", "NoEcho")
+
+
+class Sample:
+    """
+    A parsed sample template.
+
+    Attributes:
+        name (str): The file name.
+        text (str): The content of the file.
+        template (dict): The parsed template.
+        spans (TemplateText): The entries of its sections, None for JSON and flow style templates.
+    """
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        try:
+            self.spans = TemplateText(text)
+            self.template = self.spans.template
+        except PatchError:
+            self.spans = None
+            self.template = load_template(text)
+        if not isinstance(self.template, dict):
+            raise YAMLError(f"{name} is not a template")
+
+
+    def section(self, section: str) -> dict:
+        value = self.template.get(section)
+        return value if isinstance(value, dict) else {}
+
+
+    def text_of(self, section: str, name: str) -> str:
+        """
+        The original text of an entry, rendered as JSON when the sample cannot be split into entries.
+        """
+        if self.spans is not None and name in self.spans.entries.get(section, {}):
+            return "".join(self.spans.text_of(self.spans.entries[section][name], 2))
+        rendered = json.dumps({name: self.section(section)[name]}, indent=2)
+        return "\n".join("  " + line for line in rendered[1:-1].strip("\n").splitlines()) + "\n"
+
+
+def case_style(name: str) -> str:
+    if re.fullmatch(r"[A-Z][A-Za-z0-9]*", name):
+        return "PascalCase"
+    if re.fullmatch(r"[a-z][a-z0-9]*", name):
+        return "lowercase"
+    if re.fullmatch(r"[a-z][A-Za-z0-9]*", name):
+        return "camelCase"
+    return "mixed"
+
+
+def examples(names, count: int = 4) -> str:
+    return ", ".join(list(dict.fromkeys(names))[:count])
+
+
+def render(value, short: bool) -> str:
+    """
+    A compact one line form of a value in the style of the samples.
+    """
+    if isinstance(value, dict) and len(value) == 1:
+        key, argument = next(iter(value.items()))
+        if key == "Ref" or key.startswith("Fn::"):
+            function = key.replace("Fn::", "")
+            if short:
+                if function == "GetAtt" and isinstance(argument, list):
+                    argument = ".".join(str(part) for part in argument)
+                text = argument if isinstance(argument, str) else json.dumps(argument)
+                return f"!{function} '{text}'" if function == "Sub" else f"!{function} {text}"
+            return json.dumps({key: argument})
+    text = json.dumps(value) if not isinstance(value, str) else value
+    return text if len(text) <= 60 else text[:57] + "..."
+
+
+def walk(value):
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            yield value
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def naming(items: list[tuple[str, str]]) -> str:
+    """
+    The naming pattern of (logical ID, resource type) pairs, the type is empty for parameters and outputs.
+    """
+    styles = Counter(case_style(name) for name, _ in items)
+    parts = [f"{styles.most_common(1)[0][0]} ({examples(name for name, _ in items)})"]
+    suffixed = sum(1 for name, type_name in items if type_name and name.lower().endswith(type_name.split("::")[-1].lower()))
+    if suffixed * 2 >= len(items):
+        parts.append("ending with the resource type")
+    numbered = [name for name, _ in items if re.search(r"[A-Za-z]\d+$", name)]
+    if numbered:
+        parts.append(f"numbered when repeated ({examples(numbered, 3)})")
+    prefixes = Counter(re.match(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", name).group(0) for name, _ in items if re.match(r"[A-Za-z]", name))
+    common = [prefix for prefix, count in prefixes.most_common(3) if count >= 3 and count * 4 >= len(items)]
+    if common:
+        parts.append(f"often starting with {', '.join(common)}")
+    return ", ".join(parts)
+
+
+def representatives(section: str, entries: list[tuple], kind) -> list[str]:
+    """
+    The text of one entry of every kind, the one with the most properties and then the shortest.
+    """
+    chosen = {}
+    for sample, name, value in entries:
+        key = kind(value)
+        properties = value.get("Properties")
+        size = len(properties) if isinstance(properties, dict) else len(value)
+        text = sample.text_of(section, name)
+        if key not in chosen or size > chosen[key][0] or (size == chosen[key][0] and len(text) < len(chosen[key][1])):
+            chosen[key] = (size, text)
+    return list(dict.fromkeys(text for _, text in chosen.values()))
+
+
+def build_digest(samples: list[Sample]) -> str:
+    """
+    The digest of the samples: the conventions as comments followed by representative entries.
+    """
+    short = sum(len(SHORT_FORM.findall(sample.text)) for sample in samples)
+    long = sum(len(LONG_FORM.findall(sample.text)) for sample in samples)
+    resources = [(sample, name, resource) for sample in samples for name, resource in sample.section("Resources").items()
+                 if isinstance(resource, dict) and isinstance(resource.get("Type"), str)]
+    lines = [f"# Style digest of the samples {', '.join(sample.name for sample in samples)}:",
+             "# their conventions and one resource of every type as written in the samples."]
+
+    # Formatting
+    split = [sample for sample in samples if sample.spans is not None]
+    formatting = ["YAML" if split else "JSON"]
+    if split:
+        columns = Counter(entry.column for sample in split for entry in sample.spans.entries.get("Resources", {}).values())
+        if columns:
+            formatting.append(f"{columns.most_common(1)[0][0]} space indentation")
+        single, double = (sum(len(re.findall(pattern, sample.text)) for sample in split) for pattern in (r":\s+'", r':\s+"'))
+        formatting.append("strings in 'single quotes'" if single > double else 'strings in "double quotes"' if double else "unquoted strings")
+        comments = sum(1 for sample in split for line in sample.spans.lines if line.strip().startswith("#"))
+        if comments:
+            formatting.append(f"comments ({comments} in {len(resources)} resources)")
+        if any(sample.spans.separated(sample.spans.entries.get("Resources", {})) for sample in split):
+            formatting.append("blank lines between resources")
+    lines.append(f"# Format: {', '.join(formatting)}")
+    lines.append(f"# Sections: {', '.join(dict.fromkeys(key for sample in samples for key in sample.template))}")
+
+    # Intrinsic functions
+    functions = Counter(key for sample in samples for node in walk(sample.template) for key in node
+                        if key == "Ref" or key.startswith("Fn::"))
+    if functions:
+        style = "short form (!Ref, !Sub...)" if short >= long else "long form (Ref:, Fn::Sub:...)"
+        used = ", ".join(f"{key.replace('Fn::', '')} {count}" for key, count in functions.most_common())
+        preferences = []
+        if functions["Fn::Sub"] > functions["Fn::Join"]:
+            preferences.append("Sub rather than Join")
+        elif functions["Fn::Join"] > functions["Fn::Sub"]:
+            preferences.append("Join rather than Sub")
+        dotted = sum(len(re.findall(r"!GetAtt\s+[\w-]+\.", sample.text)) for sample in samples)
+        if functions["Fn::GetAtt"]:
+            preferences.append("GetAtt Resource.Attribute" if dotted * 2 >= functions["Fn::GetAtt"] else "GetAtt [Resource, Attribute]")
+        lines.append(f"# Intrinsic functions: {style}, used {used}" + (f"; {', '.join(preferences)}" if preferences else ""))
+
+    # Naming
+    if resources:
+        lines.append(f"# Resource logical IDs: {naming([(name, resource['Type']) for _, name, resource in resources])}")
+    parameters = [(sample, name, parameter) for sample in samples for name, parameter in sample.section("Parameters").items()
+                  if isinstance(parameter, dict)]
+    if parameters:
+        keys = [f"{key} in {count} of {len(parameters)}" for key in PARAMETER_KEYS
+                if (count := sum(1 for _, _, parameter in parameters if key in parameter))]
+        types = Counter(str(parameter.get("Type")) for _, _, parameter in parameters)
+        lines.append(f"# Parameters: {naming([(name, '') for _, name, _ in parameters])}; types {', '.join(f'{t} {n}' for t, n in types.most_common())}"
+                     + (f"; {', '.join(keys)}" if keys else ""))
+
+    # Tags
+    tags = {}
+    tagged = 0
+    for _, _, resource in resources:
+        properties = resource.get("Properties")
+        value = properties.get("Tags") if isinstance(properties, dict) else None
+        if isinstance(value, list):
+            tagged += 1
+            for tag in value:
+                if isinstance(tag, dict) and isinstance(tag.get("Key"), str):
+                    tags.setdefault(tag["Key"], []).append(tag.get("Value"))
+        elif isinstance(value, dict):
+            tagged += 1
+            for key, tag_value in value.items():
+                tags.setdefault(str(key), []).append(tag_value)
+    if tags:
+        described = [f"{key} ({len(values)}x, e.g. {render(values[0], short >= long)})"
+                     for key, values in sorted(tags.items(), key=lambda item: -len(item[1]))]
+        lines.append(f"# Tags on {tagged} of {len(resources)} resources: {'; '.join(described)}")
+
+    # Outputs
+    outputs = [(sample, name, output) for sample in samples for name, output in sample.section("Outputs").items() if isinstance(output, dict)]
+    if outputs:
+        exports = [output["Export"].get("Name") for _, _, output in outputs if isinstance(output.get("Export"), dict)]
+        lines.append(f"# Outputs: {naming([(name, '') for _, name, _ in outputs])}"
+                     + (f"; {len(exports)} of {len(outputs)} exported, e.g. {render(exports[0], short >= long)}" if exports else ""))
+
+    # One parameter of every type, one resource of every type and an output with and without export
+    for section, entries, kind in (("Parameters", parameters, lambda value: str(value.get("Type"))),
+                                   ("Resources", resources, lambda value: value["Type"]),
+                                   ("Outputs", outputs, lambda value: "Export" in value)):
+        texts = representatives(section, entries, kind)
+        if texts:
+            lines.append(f"{section}:")
+            lines.extend(text.rstrip("\n") for text in texts)
+    return "\n".join(lines) + "\n"
+
+
+def digest_key(names: list[str], contents: list[bytes]) -> str:
+    """
+    The cache key of the digest: the file names are part of it because its header lists them.
+    """
+    digest = hashlib.sha256(f"digest-v{DIGEST_VERSION}".encode("utf-8"))
+    for name, content in zip(names, contents):
+        digest.update(hashlib.sha256(name.encode("utf-8")).digest())
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+def sample_digest(sample_files: list[str], cache_dir: str | None = DIGEST_DIR) -> str:
+    """
+    Returns the style digest of the sample files, from cache_dir when the same samples were digested before.
+    Raises YAMLError if a sample is not a template.
+    """
+    contents = []
+    for sample_file in sample_files:
+        with open(sample_file, "rb") as f:
+            contents.append(f.read())
+    names = [os.path.basename(name) for name in sample_files]
+    path = os.path.join(cache_dir, digest_key(names, contents) + ".yml") if cache_dir else None
+    if path and os.path.exists(path):
+        metrics.count("samples.digest_hits")
+        with open(path, "r") as f:
+            return f.read()
+
+    metrics.count("samples.digest_misses")
+    with metrics.timer("samples.digest"):
+        samples = [Sample(name, content.decode("utf-8")) for name, content in zip(names, contents)]
+        digest = build_digest(samples)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(digest)
+        os.replace(tmp_path, path)
+    return digest
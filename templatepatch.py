@@ -0,0 +1,383 @@
+import re
+import yaml
+from codec import CloudFormationLoader, YAMLError
+from validator import TemplateValidator, strip_fence
+
+"""
+Transforms large templates without sending them whole. The template text is split into the entries
+of its sections (a parameter, a resource, an output...) using the positions of the parsed YAML nodes.
+Only the resources the instructions are about and everything they reference go to the model, which
+answers with a patch in the same layout: the entries to add or replace and null for the ones to
+remove. The patch is applied to the original text line by line, so everything it does not touch,
+comments and formatting included, stays exactly as it was.
+
+    Resources:
+      Bucket:            # replaced or added
+        Type: AWS::S3::Bucket
+      OldQueue: null     # removed
+"""
+
+SECTIONS = ("Parameters", "Mappings", "Conditions", "Resources", "Outputs")
+SUB_VARIABLE = re.compile(r"\$\{([^!}][^}.]*)(?:\.[^}]*)?\}")
+
+
+class PatchError(ValueError):
+    pass
+
+
+class Entry:
+    """
+    An entry of a section and the lines it spans, including the comments right above it.
+
+    Attributes:
+        section (str): The section the entry is in.
+        name (str): Its key, the logical ID for resources.
+        start (int): Index of its first line.
+        stop (int): Index after its last line.
+        column (int): Indentation of the key.
+        removed (bool): Whether the value is null, in a patch that means the entry is removed.
+    """
+
+    def __init__(self, section: str, name: str, start: int, stop: int, column: int, removed: bool):
+        self.section = section
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.column = column
+        self.removed = removed
+
+
+def is_comment(line: str, column: int) -> bool:
+    """
+    Blank lines and comments that are not indented deeper than column, they belong to the next entry.
+    """
+    stripped = line.strip()
+    return not stripped or (stripped.startswith("#") and len(line) - len(line.lstrip()) <= column)
+
+
+def comments_above(lines: list[str], line: int, column: int) -> int:
+    """
+    Index of the first of the comments indented to column right above the line, the line itself if there are none.
+    """
+    while line > 0 and lines[line - 1].strip().startswith("#") and len(lines[line - 1]) - len(lines[line - 1].lstrip()) == column:
+        line -= 1
+    return line
+
+
+def entry_spans(lines: list[str], pairs: list, stop: int) -> list[tuple]:
+    """
+    Returns (key node, value node, start, stop) of the key/value node pairs of a block mapping ending before line stop.
+    """
+    starts = [comments_above(lines, key.start_mark.line, key.start_mark.column) for key, _ in pairs]
+    spans = []
+    for i, (key, value) in enumerate(pairs):
+        end = starts[i + 1] if i + 1 < len(pairs) else stop
+        while end > key.start_mark.line + 1 and is_comment(lines[end - 1], key.start_mark.column):
+            end -= 1
+        spans.append((key, value, starts[i], end))
+    return spans
+
+
+def is_null(node) -> bool:
+    return isinstance(node, yaml.ScalarNode) and node.tag == "tag:yaml.org,2002:null"
+
+
+class TemplateText:
+    """
+    The text of a block style YAML template with the spans of its sections and their entries.
+
+    Attributes:
+        lines (list): The lines of the text with their line endings.
+        template (dict): The parsed template.
+        sections (dict): Section -> (key line, stop) of the sections present.
+        entries (dict): Section -> name -> Entry.
+    """
+
+    def __init__(self, text: str):
+        text = str(text)
+        if text and not text.endswith("\n"):
+            text += "\n"
+        self.lines = text.splitlines(keepends=True)
+        # The node tree gives the positions, the template is constructed from the same parse
+        loader = CloudFormationLoader(text)
+        try:
+            root = loader.get_single_node()
+            self.template = loader.construct_document(root) if root is not None else None
+        except YAMLError as e:
+            raise PatchError(f"The text is not valid YAML: {' '.join(str(e).split())}")
+        finally:
+            loader.dispose()
+        if not isinstance(root, yaml.MappingNode) or root.flow_style:
+            raise PatchError("Only block style YAML templates can be patched.")
+
+        self.sections = {}
+        self.entries = {}
+        for key, value, start, stop in entry_spans(self.lines, root.value, len(self.lines)):
+            if key.value not in SECTIONS:
+                continue
+            self.sections[key.value] = (key.start_mark.line, stop)
+            if is_null(value):
+                self.entries[key.value] = {}
+                continue
+            if not isinstance(value, yaml.MappingNode) or value.flow_style:
+                raise PatchError(f"The {key.value} section has to be a block style mapping.")
+            self.entries[key.value] = {
+                child.value: Entry(key.value, child.value, child_start, child_stop, child.start_mark.column, is_null(child_value))
+                for child, child_value, child_start, child_stop in entry_spans(self.lines, value.value, stop)
+            }
+
+
+    def text_of(self, entry: Entry, column: int | None = None) -> list[str]:
+        """
+        The lines of an entry, reindented so that its key starts at column.
+        """
+        lines = self.lines[entry.start:entry.stop]
+        if column is None or column == entry.column:
+            return lines
+        indented = []
+        for line in lines:
+            if not line.strip():
+                indented.append(line)
+            else:
+                strip = min(entry.column, len(line) - len(line.lstrip(" ")))
+                indented.append(" " * column + line[strip:])
+        return indented
+
+
+    def excerpt(self, selection: dict) -> str:
+        """
+        The text of the selected entries (section -> names) under their section keys.
+        """
+        parts = []
+        for section in SECTIONS:
+            names = selection.get(section)
+            if not names:
+                continue
+            parts.append(f"{section}:\n")
+            for entry in self.entries[section].values():
+                if entry.name in names:
+                    parts.extend(self.text_of(entry))
+        return "".join(parts)
+
+
+    def apply(self, patch: "TemplateText") -> str:
+        """
+        Returns the text with the entries of the patch added, replaced or removed.
+        """
+        edits = []
+        for section in SECTIONS:
+            changes = patch.entries.get(section)
+            if not changes:
+                continue
+            entries = self.entries.get(section)
+            if entries is None:
+                added = [patch.text_of(change, 2) for change in changes.values() if not change.removed]
+                if added:
+                    edits.append(self.new_section(section, added))
+                continue
+            column = next(iter(entries.values())).column if entries else 2
+            separator = ["\n"] if self.separated(entries) else []
+            kept = [entry.stop for name, entry in entries.items() if not (name in changes and changes[name].removed)]
+            if entries and not kept and all(change.removed for change in changes.values()):
+                edits.append(self.removed_section(section))
+                continue
+            position = max(kept, default=self.sections[section][0] + 1)
+            last = next(reversed(entries.values()), None)
+            for name, change in changes.items():
+                entry = entries.get(name)
+                if entry is not None and change.removed:
+                    edits.append(self.without_blank_lines(entry.start, entry.stop, self.sections[section][0] + 1, entry is not last))
+                elif entry is not None:
+                    edits.append((entry.start, entry.stop, patch.text_of(change, column)))
+                elif not change.removed:
+                    edits.append((position, position, separator + patch.text_of(change, column)))
+
+        lines = []
+        cursor = 0
+        for start, stop, replacement in sorted(edits, key=lambda edit: edit[0]):
+            lines.extend(self.lines[cursor:start])
+            lines.extend(replacement)
+            cursor = max(cursor, stop)
+        lines.extend(self.lines[cursor:])
+        return "".join(lines)
+
+
+    def without_blank_lines(self, start: int, stop: int, first: int, following: bool) -> tuple:
+        """
+        The edit removing the lines from start to stop with the blank lines after them, or with the ones
+        before them (down to line first) when following is False, so that the separator of the next
+        section and its comments stay where they are.
+        """
+        if following:
+            while stop < len(self.lines) and not self.lines[stop].strip():
+                stop += 1
+        else:
+            while start > first and not self.lines[start - 1].strip():
+                start -= 1
+        return start, stop, []
+
+
+    def removed_section(self, section: str) -> tuple:
+        """
+        The edit removing a section whose entries are all removed, with the comments right above its key.
+        """
+        line, stop = self.sections[section]
+        start = comments_above(self.lines, line, 0)
+        last = stop >= len(self.lines) or not "".join(self.lines[stop:]).strip()
+        return self.without_blank_lines(start, stop, 0, not last)
+
+
+    def merged(self, patch: "TemplateText") -> dict:
+        """
+        The parsed template with the patch applied, the same as parsing the text returned by apply.
+        """
+        template = dict(self.template)
+        for section in SECTIONS:
+            changes = patch.entries.get(section)
+            if not changes:
+                continue
+            entries = dict(template.get(section) or {})
+            for name, change in changes.items():
+                if change.removed:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = patch.template[section][name]
+            if entries:
+                template[section] = entries
+            else:
+                template.pop(section, None)
+        return template
+
+
+    def separated(self, entries: dict) -> bool:
+        """
+        Whether the entries of a section are separated by blank lines.
+        """
+        starts = [entry.start for entry in entries.values()][1:]
+        return any(start > 0 and not self.lines[start - 1].strip() for start in starts)
+
+
+    def new_section(self, section: str, added: list[list[str]]) -> tuple:
+        """
+        The edit adding a missing section: Outputs at the end, the others before Resources.
+        """
+        lines = [f"{section}:\n"] + [line for entry in added for line in entry]
+        # Sections separated by blank lines get one too
+        blank = any(line > 0 and not self.lines[line - 1].strip() for line, _ in self.sections.values())
+        if section != "Outputs" and "Resources" in self.sections:
+            position = self.sections["Resources"][0]
+            while position > 0 and self.lines[position - 1].strip().startswith("#"):
+                position -= 1
+            return position, position, lines + (["\n"] if blank else [])
+        return len(self.lines), len(self.lines), (["\n"] if blank and self.lines[-1].strip() else []) + lines
+
+
+def references(value) -> set[str]:
+    """
+    The names a value refers to with Ref, GetAtt, Sub, FindInMap and conditions.
+    """
+    names = set()
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            if len(value) == 1:
+                key, argument = next(iter(value.items()))
+                if key in ("Ref", "Condition") and isinstance(argument, str):
+                    names.add(argument)
+                elif key == "Fn::GetAtt":
+                    target = argument.split(".")[0] if isinstance(argument, str) else argument[0] if argument else None
+                    if isinstance(target, str):
+                        names.add(target)
+                elif key == "Fn::Sub":
+                    text, variables = (argument, {}) if isinstance(argument, str) else (argument + [{}])[:2]
+                    if isinstance(text, str):
+                        names.update(name for name in SUB_VARIABLE.findall(text) if name not in variables)
+                elif key == "Fn::FindInMap" and isinstance(argument, list) and argument and isinstance(argument[0], str):
+                    names.add(argument[0])
+                elif key == "Fn::If" and isinstance(argument, list) and argument and isinstance(argument[0], str):
+                    names.add(argument[0])
+            stack.extend(value.values())
+    return names
+
+
+def type_phrases(type_name: str) -> list[str]:
+    """
+    How instructions refer to a resource type: AWS::EC2::LaunchTemplate -> launch template, launchtemplate.
+    """
+    resource = type_name.split("::")[-1]
+    words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z0-9]+", resource)
+    return list(dict.fromkeys([type_name.lower(), " ".join(words).lower(), resource.lower()]))
+
+
+def select(template: dict, instructions: str) -> dict:
+    """
+    The entries relevant to the instructions, section -> set of names: the resources, parameters and
+    outputs mentioned by name or resource type, everything they reference, transitively, and the
+    outputs of the selected resources. Empty when the instructions mention nothing of the template.
+    """
+    text = instructions.lower()
+
+    def mentioned(phrase: str) -> bool:
+        return re.search(rf"(?<![\w:]){re.escape(phrase)}s?(?![\w:])", text) is not None
+
+    sections = {section: template.get(section) if isinstance(template.get(section), dict) else {} for section in SECTIONS}
+    resources = sections["Resources"]
+    selection = {section: {name for name in entries if mentioned(name.lower())} for section, entries in sections.items()}
+    for name, resource in resources.items():
+        type_name = resource.get("Type") if isinstance(resource, dict) else None
+        if isinstance(type_name, str) and any(mentioned(phrase) for phrase in type_phrases(type_name)):
+            selection["Resources"].add(name)
+    if not any(selection.values()):
+        return {}
+
+    pending = [(section, name) for section, names in selection.items() for name in names]
+    while pending:
+        section, name = pending.pop()
+        value = sections[section].get(name)
+        targets = references(value)
+        if section == "Resources" and isinstance(value, dict):
+            depends_on = value.get("DependsOn", [])
+            targets.update(depends_on if isinstance(depends_on, list) else [depends_on])
+            if isinstance(value.get("Condition"), str):
+                targets.add(value["Condition"])
+        for target in targets:
+            for kind in ("Resources", "Parameters", "Conditions", "Mappings"):
+                if isinstance(target, str) and target in sections[kind] and target not in selection[kind]:
+                    selection[kind].add(target)
+                    pending.append((kind, target))
+    for name, output in sections["Outputs"].items():
+        if references(output) & selection["Resources"]:
+            selection["Outputs"].add(name)
+    return {section: names for section, names in selection.items() if names}
+
+
+class PatchValidator:
+    """
+    Checks the patches returned by the model: a patch has to parse and, with a TemplateValidator, the
+    patched template has to pass it. Only the problems of the patched entries are reported, the model
+    has not seen the rest of the template and cannot fix it.
+    """
+
+    FIX_REQUEST = "Fix them and respond with the corrected patch only:"
+
+    def __init__(self, source: TemplateText, validator: TemplateValidator | None):
+        self.source = source
+        self.validator = validator
+
+
+    def validate(self, text: str) -> list[str]:
+        try:
+            patch = TemplateText(strip_fence(text))
+        except PatchError as e:
+            return [str(e)]
+        if not any(patch.entries.values()):
+            return [f"The patch changes nothing, put the entries to add, replace or remove under their section keys ({', '.join(SECTIONS)})."]
+        if self.validator is None:
+            return []
+        prefixes = tuple(f"{name}{separator}" if section == "Resources" else f"{section}.{name}{separator}"
+                         for section, entries in patch.entries.items() for name in entries for separator in ".:[")
+        return [problem for problem in self.validator.validate_template(self.source.merged(patch))
+                if problem.startswith(prefixes) or problem.startswith("The template")]
@@ -0,0 +1,163 @@
+import unittest
+from codec import load_template
+from templatepatch import PatchError, TemplateText, references, select
+
+"""
+Tests of applying patches to the template text and of selecting the entries sent in the diff mode.
+
+    python -m unittest test_templatepatch
+"""
+
+TEMPLATE = """AWSTemplateFormatVersion: '2010-09-09'
+Parameters:
+  Environment:
+    Type: String
+
+Resources:
+  # The network
+  Vpc:
+    Type: AWS::EC2::VPC
+    Properties:
+      CidrBlock: 10.0.0.0/16  # keep this
+
+  Subnet:
+    Type: AWS::EC2::Subnet
+    Properties:
+      VpcId: !Ref Vpc
+
+  Bucket:
+    Type: AWS::S3::Bucket
+
+# Outputs below
+Outputs:
+  SubnetId:
+    Value: !Ref Subnet
+"""
+
+
+def apply(patch: str, text: str = TEMPLATE) -> str:
+    return TemplateText(text).apply(TemplateText(patch))
+
+
+class ApplyTest(unittest.TestCase):
+
+    def assert_parses_to_merged(self, patch: str, text: str = TEMPLATE):
+        source = TemplateText(text)
+        self.assertEqual(load_template(source.apply(TemplateText(patch))), source.merged(TemplateText(patch)))
+
+
+    def test_replace_keeps_the_rest_of_the_text(self):
+        patch = "Resources:\n  Bucket:\n    Type: AWS::S3::Bucket\n    Properties:\n      BucketName: logs\n"
+        result = apply(patch)
+        self.assertEqual(result, TEMPLATE.replace("    Type: AWS::S3::Bucket\n", "    Type: AWS::S3::Bucket\n    Properties:\n      BucketName: logs\n"))
+        self.assert_parses_to_merged(patch)
+
+
+    def test_add_follows_the_blank_line_style(self):
+        patch = "Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n"
+        result = apply(patch)
+        self.assertIn("  Bucket:\n    Type: AWS::S3::Bucket\n\n  Queue:\n    Type: AWS::SQS::Queue\n\n# Outputs below\n", result)
+        self.assert_parses_to_merged(patch)
+
+
+    def test_remove_an_entry_with_its_comments(self):
+        result = apply("Resources:\n  Vpc: null\n")
+        self.assertNotIn("# The network", result)
+        self.assertIn("Resources:\n  Subnet:\n", result)
+        self.assert_parses_to_merged("Resources:\n  Vpc: null\n")
+
+
+    def test_remove_the_last_entry_keeps_the_section_boundary(self):
+        result = apply("Resources:\n  Bucket: null\n")
+        self.assertIn("      VpcId: !Ref Vpc\n\n# Outputs below\nOutputs:\n", result)
+        self.assertNotIn("Bucket", result)
+        compact = "Resources:\n  A:\n    Type: AWS::SQS::Queue\n  B:\n    Type: AWS::SQS::Queue\n\n# Outputs below\nOutputs:\n  Q:\n    Value: !Ref A\n"
+        self.assertEqual(apply("Resources:\n  B: null\n", compact),
+                         "Resources:\n  A:\n    Type: AWS::SQS::Queue\n\n# Outputs below\nOutputs:\n  Q:\n    Value: !Ref A\n")
+
+
+    def test_remove_every_entry_drops_the_section(self):
+        result = apply("Outputs:\n  SubnetId: null\n")
+        self.assertTrue(result.endswith("  Bucket:\n    Type: AWS::S3::Bucket\n"))
+        self.assertNotIn("Outputs", result)
+        self.assert_parses_to_merged("Outputs:\n  SubnetId: null\n")
+
+
+    def test_remove_every_entry_of_a_middle_section(self):
+        result = apply("Parameters:\n  Environment: null\n")
+        self.assertTrue(result.startswith("AWSTemplateFormatVersion: '2010-09-09'\nResources:\n  # The network\n"))
+
+
+    def test_remove_and_add_keeps_the_section(self):
+        patch = "Outputs:\n  SubnetId: null\n  VpcId:\n    Value: !Ref Vpc\n"
+        result = apply(patch)
+        self.assertTrue(result.endswith("Outputs:\n  VpcId:\n    Value: !Ref Vpc\n"))
+        self.assert_parses_to_merged(patch)
+
+
+    def test_new_sections(self):
+        conditions = apply("Conditions:\n  IsProd: !Equals [!Ref Environment, prod]\n")
+        self.assertIn("    Type: String\n\nConditions:\n  IsProd: !Equals [!Ref Environment, prod]\n\nResources:\n", conditions)
+        text = TEMPLATE[:TEMPLATE.index("# Outputs below")]
+        outputs = apply("Outputs:\n  BucketName:\n    Value: !Ref Bucket\n", text)
+        self.assertTrue(outputs.endswith("    Type: AWS::S3::Bucket\n\nOutputs:\n  BucketName:\n    Value: !Ref Bucket\n"))
+
+
+    def test_reindent_to_the_template(self):
+        patch = "Resources:\n    Queue:\n        Type: AWS::SQS::Queue\n        Properties:\n            DelaySeconds: 5\n"
+        result = apply(patch)
+        self.assertIn("  Queue:\n      Type: AWS::SQS::Queue\n      Properties:\n          DelaySeconds: 5\n", result)
+        self.assertEqual(load_template(result)["Resources"]["Queue"]["Properties"], {"DelaySeconds": 5})
+
+
+    def test_comments_are_preserved(self):
+        patch = "Resources:\n  Subnet:\n    # Moved to the second range\n    Type: AWS::EC2::Subnet\n    Properties:\n      VpcId: !Ref Vpc\n      CidrBlock: 10.0.1.0/24\n"
+        result = apply(patch)
+        for comment in ("# The network\n", "  # keep this\n", "# Outputs below\n", "    # Moved to the second range\n"):
+            self.assertIn(comment, result)
+
+
+    def test_flow_style_is_rejected(self):
+        with self.assertRaises(PatchError):
+            TemplateText('{"Resources": {}}')
+        with self.assertRaises(PatchError):
+            TemplateText("Resources: [")
+
+
+class SelectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template = load_template(TEMPLATE)
+
+
+    def test_by_name_with_references_and_outputs(self):
+        selection = select(self.template, "Add a CIDR block to the Subnet")
+        self.assertEqual(selection, {"Resources": {"Subnet", "Vpc"}, "Outputs": {"SubnetId"}})
+
+
+    def test_by_type(self):
+        self.assertEqual(select(self.template, "Turn on versioning of the s3 buckets"), {"Resources": {"Bucket"}})
+
+
+    def test_nothing_mentioned(self):
+        self.assertEqual(select(self.template, "Add a queue"), {})
+
+
+class ReferencesTest(unittest.TestCase):
+
+    def test_intrinsic_functions(self):
+        value = {
+            "A": {"Ref": "Param"},
+            "B": {"Fn::GetAtt": ["Role", "Arn"]},
+            "C": {"Fn::GetAtt": "Queue.Arn"},
+            "D": {"Fn::Sub": ["${Bucket.Arn}/${Key}-${AWS::Region}", {"Key": "x"}]},
+            "E": {"Fn::FindInMap": ["RegionMap", {"Ref": "AWS::Region"}, "Ami"]},
+            "F": {"Fn::If": ["IsProd", {"Ref": "Topic"}, {"Ref": "AWS::NoValue"}]},
+            "G": [{"Condition": "HasName"}],
+        }
+        self.assertEqual(references(value), {"Param", "Role", "Queue", "Bucket", "RegionMap", "AWS::Region",
+                                             "IsProd", "Topic", "AWS::NoValue", "HasName"})
+
+
+if __name__ == "__main__":
+    unittest.main()
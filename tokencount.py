@@ -0,0 +1,40 @@
+"""
+Token counting for schemas and prompts. Uses tiktoken when it is installed, otherwise
+an approximation of four characters per token which is close enough for budgeting.
+"""
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+
+# Counts precomputed by update_database, registered when a schema is served
+_known = {}
+
+
+def remember(text: str, tokens: int):
+    """
+    Registers a precomputed count so that counting the same text again is free.
+    """
+    _known[(hash(text), len(text))] = tokens
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    known = _known.get((hash(text), len(text)))
+    if known is not None:
+        return known
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def is_exact() -> bool:
+    """
+    Whether the counts come from a real tokenizer or are approximated.
+    """
+    return _encoding is not None
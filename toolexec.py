@@ -0,0 +1,109 @@
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ell
+from ell.types import ContentBlock, ToolCall, ToolResult
+from metrics import metrics
+
+"""
+Runs the tool calls of one agent turn concurrently. When the model asks for several schemas at once
+each lookup (fuzzy match, disk read) runs on its own thread and identical calls are executed only once.
+"""
+
+REPEATED = "[Same result as the earlier call {tool_call_id}, which is still in the conversation above.]"
+REPEATED_PATTERN = re.compile(re.escape(REPEATED).replace(re.escape("{tool_call_id}"), "(.+)"))
+
+
+def call_key(call: ToolCall) -> str:
+    return call.tool.__name__ + json.dumps(call.params.model_dump(), sort_keys=True)
+
+
+def repeated_call_id(block: ContentBlock) -> str | None:
+    """
+    The id of the earlier call a REPEATED result points to, None for any other block.
+    """
+    if block.tool_result is None:
+        return None
+    match = REPEATED_PATTERN.fullmatch(block.tool_result.text_only)
+    return match.group(1) if match else None
+
+
+class ToolExecutor:
+    """
+    Executes the tool calls of a response and collects the results in the order of the calls.
+
+    Attributes:
+        max_workers (int): Maximum number of threads per turn.
+        turns (list): Statistics of every turn: number of calls, unique calls, wall time and
+            the time the previous one-by-one execution would have taken (sum of all call durations).
+            Calls repeating an earlier turn are counted in repeated and not executed.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.turns = []
+
+
+    def run(self, response: ell.Message, answered: dict | None = None) -> ell.Message:
+        """
+        Args:
+            response: The model response with the tool calls.
+            answered: Keys of calls answered earlier in the conversation mapped to the id of that call.
+                Such calls are not executed again, the result only points to the earlier one.
+        """
+        answered = answered or {}
+        calls = response.tool_calls
+        unique = {}
+        for call in calls:
+            if call_key(call) not in answered:
+                unique.setdefault(call_key(call), call)
+
+        start = time.perf_counter()
+        if len(unique) <= 1:
+            results = {key: _timed(call) for key, call in unique.items()}
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique))) as executor:
+                # The tools run with the context of the caller, e.g. the schema index of its job
+                futures = {key: executor.submit(contextvars.copy_context().run, _timed, call) for key, call in unique.items()}
+                results = {key: future.result() for key, future in futures.items()}
+        wall = time.perf_counter() - start
+
+        content = []
+        for call in calls:
+            key = call_key(call)
+            if key in results:
+                result = results[key][0]
+            else:
+                result = [ContentBlock(text=REPEATED.format(tool_call_id=answered[key]))]
+            content.append(ContentBlock(tool_result=ToolResult(tool_call_id=call.tool_call_id, result=result)))
+
+        metrics.count("tool.calls", len(calls))
+        metrics.count("tool.repeated", sum(1 for call in calls if call_key(call) in answered))
+        self.turns.append({
+            "calls": len(calls),
+            "unique": len(unique),
+            "repeated": sum(1 for call in calls if call_key(call) in answered),
+            "wall": wall,
+            "serial": sum(results[call_key(call)][1] for call in calls if call_key(call) in results),
+        })
+        return ell.Message(role="user", content=content)
+
+
+    def summary(self) -> str:
+        calls = sum(turn["calls"] for turn in self.turns)
+        wall = sum(turn["wall"] for turn in self.turns)
+        serial = sum(turn["serial"] for turn in self.turns)
+        return f"{calls} tool calls in {len(self.turns)} turns took {wall:.3f}s ({serial:.3f}s one by one)"
+
+
+def _timed(call: ToolCall) -> tuple[list[ContentBlock], float]:
+    """
+    Calls the tool and returns its result content with the duration of the call.
+    """
+    start = time.perf_counter()
+    block = call.call_and_collect_as_content_block()
+    duration = time.perf_counter() - start
+    metrics.observe(f"tool.{call.tool.__name__}", duration)
+    return block.tool_result.result, duration
@@ -1,49 +1,104 @@
-from typing import List
-import ell
-from ell.types import ToolCall
-from schemaindex import get_cloudformation_schema
+from schemaindex import get_cloudformation_schema, get_cloudformation_property
 from config import Configuration
+from session import AgentSession
+from toolexec import ToolExecutor
+from templatepatch import PatchError, PatchValidator, TemplateText, select
+from validator import strip_fence, template_validator
+from metrics import metrics
+
+# full sends the whole template and gets it back, diff sends the relevant part and gets a patch
+TRANSFORM_MODES = ("full", "diff")
 
 SYSTEM_PROMPT = """You are an AI assistant that modifies CloudFormation templates based on given instructions.
                 You are provided with a tool that you can call in order to ensure what can be done with each resource in CloudFormation.
-                Instead of hallucinating, you can verify that with the tool. Everything you generate should be a valid YAML document.
+                Instead of hallucinating, you can verify that with the tool.
+                To save space, prefer loading the summary of a resource's properties and then only the properties you need. Everything you generate should be a valid YAML document.
                 Use comments to communicate with the user instead of leaving plain text around YAML code. As the last message where you verified everything
                 with the tools RESPOND ONLY WITH THE YAML CODE WITHOUT MARKDOWN OR ANY OTHER TEXT. JUST THE YAML CODE AND COMMENTS INSIDE.
                 Focus especially on commenting the changes you performed on the template."""
 
+SYSTEM_PROMPT_PATCH = """You are an AI assistant that modifies CloudFormation templates based on given instructions.
+                The template is large so you only get the part of it the instructions are about: the relevant entries
+                and everything they reference, followed by the list of the other resources of the template.
+                You are provided with a tool that you can call in order to ensure what can be done with each resource in CloudFormation.
+                Instead of hallucinating, you can verify that with the tool.
+                To save space, prefer loading the summary of a resource's properties and then only the properties you need.
+                As the last message where you verified everything with the tools RESPOND ONLY WITH A PATCH IN YAML WITHOUT MARKDOWN
+                OR ANY OTHER TEXT. The patch has the sections of a template (Parameters, Mappings, Conditions, Resources, Outputs)
+                with the complete new definition of every entry you add or change and `Name: null` for every entry you remove.
+                Leave out the entries you do not change. Keep the indentation and the style of the template.
+                Focus especially on commenting the changes you performed on the template."""
+
 class TransformatorAgent:
     """
     This agent transforms a given CloudFormation template based on provided instructions.
     """
 
     def __init__(self, config: Configuration):
-        self.model = config.agent_model
-        self.client = config.client
-
-    def cfn_template_transformer(self, message_history: List[ell.Message]) -> List[ell.Message]:
-        @ell.complex(model=self.model, tools=[get_cloudformation_schema], temperature=0.4, client=self.client)
-        def _transform(messages: List[ell.Message]) -> List[ell.Message]:
-            return messages
-
-        return _transform([
-            ell.system(SYSTEM_PROMPT),
-        ] + message_history)
-
-    def transform_template(self, initial_prompt: str, source_template: str):
-        
-        conversation = [ ell.user(f"{source_template}\n\n---{initial_prompt}") ]
-        
-        response: ell.Message = self.cfn_template_transformer(conversation)
-        
-        max_iterations = 30
-        while max_iterations > 0 and (response is ToolCall or response.tool_calls):
-            tool_results = response.call_tools_and_collect_as_message()
-            # Include what the user wanted, what the assistant requsted to run and what the tool returned
-            conversation = conversation + [response, tool_results]
-            response = self.cfn_template_transformer(conversation)
-            max_iterations -= 1
-        
-        if max_iterations <= 0:
-            raise Exception("Too many iterations, probably stuck in a loop.")
-        
-        return response.text
+        self.config = config
+        self.session = None
+        self.budget = None
+        self.tools = ToolExecutor()
+        # The mode used by the last transformation and for the diff mode how much of the template was sent
+        self.mode = None
+        self.sent = None
+        # The sessions of the last transformation, a diff session whose patch could not be applied first
+        self.sessions = []
+        self.fallback = False
+
+
+    def transform_template(self, initial_prompt: str, source_template: str, mode: str = "full"):
+        """
+        Transforms the template. The diff mode falls back to the full mode when the template cannot be
+        split (JSON, flow style), the instructions do not name any of its resources or their types or
+        the model does not return a patch that can be applied.
+        """
+        if mode not in TRANSFORM_MODES:
+            raise ValueError(f"Invalid transform mode: {mode}")
+        self.sessions = []
+        self.fallback = False
+        if mode == "diff":
+            transformed = self.transform_patch(initial_prompt, source_template)
+            if transformed is not None:
+                return transformed
+        self.mode = "full"
+        self.session = AgentSession(self.config, SYSTEM_PROMPT, [get_cloudformation_schema, get_cloudformation_property], self.tools)
+        self.budget = self.session.budget
+        self.sessions.append(self.session)
+        return self.session.run(f"{source_template}\n\n---{initial_prompt}", validator=template_validator(self.config))
+
+
+    def transform_patch(self, initial_prompt: str, source_template: str) -> str | None:
+        """
+        Sends only the relevant entries and applies the patch the model returns. Returns None if the diff mode cannot be used.
+        """
+        try:
+            source = TemplateText(source_template)
+        except PatchError:
+            return None
+        selection = select(source.template, initial_prompt)
+        resources = source.entries.get("Resources", {})
+        selected = selection.get("Resources", set())
+        if not selection or (resources and len(selected) == len(resources)):
+            return None
+
+        excerpt = source.excerpt(selection)
+        others = "\n".join(f"  {name}: {source.template['Resources'][name].get('Type')}" for name in resources
+                           if name not in selected and isinstance(source.template['Resources'][name], dict))
+        prompt = excerpt + (f"\n---\nOther resources of the template, not shown above:\n{others}\n" if others else "")
+        self.mode = "diff"
+        self.sent = {"resources": len(selected), "total_resources": len(resources),
+                     "lines": excerpt.count("\n"), "total_lines": len(source.lines)}
+        self.session = AgentSession(self.config, SYSTEM_PROMPT_PATCH, [get_cloudformation_schema, get_cloudformation_property], self.tools)
+        self.budget = self.session.budget
+        self.sessions.append(self.session)
+        patch = self.session.run(f"{prompt}\n---{initial_prompt}", validator=PatchValidator(source, template_validator(self.config)))
+        try:
+            return source.apply(TemplateText(strip_fence(patch)))
+        except PatchError as e:
+            # The fixes the validator asked for did not help, the whole template gets a fresh session,
+            # the diff session stays in sessions so that its requests count in the statistics
+            self.fallback = True
+            print(f"The model did not return a valid patch ({e}), transforming the whole template")
+            metrics.count("transform.patch_fallbacks")
+            return None
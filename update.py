@@ -1,5 +1,14 @@
-import json, yaml, os, requests, zipfile, io
+import json, os, requests, zipfile, hashlib, shutil, secrets, tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from manifest import manifest_entry, write_manifest, load_manifest, fragments_file
+from fragments import property_fragments
+from codec import load_json, load_yaml, dump_yaml
+from packstore import PackStore, LAYOUTS, layout_of, pack_directory
+from metrics import metrics
+from tokencount import count_tokens
 
 def now() -> int:
     return int(datetime.now(timezone.utc).timestamp())
@@ -33,29 +42,62 @@ def last_update(create: bool = False) -> int:
         return 0
 
 
-def download_zip(region: str):
+def schema_url(region: str) -> str:
+    return f"https://schema.cloudformation.{region}.amazonaws.com/CloudformationSchema.zip"
+
+
+def download_zip(url: str, validators: dict | None = None):
     """
-    Downloads the zip from AWS with CloudFormation schemas for a given region.
-    Returns a zip file that you can browse.
+    Downloads the zip with CloudFormation schemas into a temporary file.
+
+    Args:
+        url: The URL of CloudformationSchema.zip.
+        validators: The source recorded in the manifest by the previous update. If it was downloaded
+            from the same URL, its ETag and Last-Modified make the request conditional.
+
+    Returns a tuple of a zip file that you can browse, or None if the server responded that
+    nothing changed (304), and the validators of this download.
     """
-    URL = f"https://schema.cloudformation.{region}.amazonaws.com/CloudformationSchema.zip"
-    response = requests.get(URL)
+    headers = {}
+    if validators and validators.get("url") == url:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    response = requests.get(url, headers=headers, stream=True)
+    if response.status_code == 304:
+        return None, validators
     if response.status_code != 200:
-        raise Exception(f"Failed to download zip from {URL}")
-    
-    content = response.content
-    zip_buffer = io.BytesIO(content)
-    return zipfile.ZipFile(zip_buffer)
+        raise Exception(f"Failed to download zip from {url}")
+
+    buffer = tempfile.TemporaryFile()
+    for chunk in response.iter_content(chunk_size=1024 * 1024):
+        buffer.write(chunk)
+    buffer.seek(0)
+    source = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return zipfile.ZipFile(buffer), source
 
 
 def load_file(zip: zipfile.ZipFile, name: str):
     """
     Loads and decodes a file from the zip - YAML or JSON.
     """
+    return decode_member(name, zip.read(name))
+
+
+def decode_member(name: str, data: bytes):
+    """
+    Decodes the raw content of a zip member - YAML or JSON.
+    """
     if name.endswith(".json"):
-        return json.loads(zip.read(name).decode("utf-8"))
+        return load_json(data)
     elif name.endswith(".yaml") or name.endswith(".yml"):
-        return yaml.safe_load(zip.read(name).decode("utf-8"))
+        return load_yaml(data.decode("utf-8"))
     else:
         return None
 
@@ -92,17 +134,50 @@ def cleanup_schema(schema: dict) -> dict:
     return sorted_content
 
 
-def update_schema_file(zip: zipfile.ZipFile, file: str):
+def render_schema(name: str, data: bytes) -> tuple[str, str | None, str | None, str | None, int | None]:
+    """
+    Transforms the raw content of a zip member into the YAML stored in the db directory.
+    This is the CPU heavy part of the update and it is run in worker processes, counting
+    the tokens of the YAML included.
+
+    Returns a tuple of the new file name, the YAML text, the typeName, the JSON with property
+    fragments and the token count of the text (all but the name are None if the member is not a schema).
+    """
+    content = decode_member(name, data)
+    if not content:
+        return name, None, None, None, None
+    content = cleanup_schema(content)
+    fragments = json.dumps(property_fragments(content), separators=(",", ":"))
+    content = inline_definitions(content)
+    text = dump_yaml(content)
+    return name.replace(".json", ".yml"), text, content.get('typeName'), fragments, count_tokens(text)
+
+
+def update_schema_file(zip: zipfile.ZipFile, file: str, db_path: str | None = None) -> dict | None:
     """
     Updates a single schema file and saves it to the db directory.
+    Returns the manifest entry of the written file.
     """
-    content = load_file(zip, file)
-    if content:
-        content = cleanup_schema(content)
-        content = inline_definitions(content)
-        new_filename = file.replace(".json", ".yml")
-        with open(os.path.join(os.getcwd(), "db", new_filename), "w") as f:
-            yaml.dump(content, f, default_flow_style=False, sort_keys=False, width=1000)
+    db_path = db_path or os.path.join(os.getcwd(), "db")
+    data = zip.read(file)
+    new_filename, text, type_name, fragments, tokens = render_schema(file, data)
+    if text is None:
+        return None
+    return write_schema_file(db_path, file, new_filename, text, type_name, fragments, data, tokens)
+
+
+def write_schema_file(db_path: str, member: str, new_filename: str, text: str, type_name: str | None, fragments: str, data: bytes,
+                      tokens: int | None = None) -> dict | None:
+    with open(os.path.join(db_path, new_filename), "w") as f:
+        f.write(text)
+    if type_name:
+        with open(os.path.join(db_path, fragments_file(new_filename)), "w") as f:
+            f.write(fragments)
+        entry = manifest_entry(db_path, new_filename, type_name, text.encode("utf-8"), tokens)
+        entry["source"] = {"member": member, "sha256": hashlib.sha256(data).hexdigest()}
+        entry["fragments"] = fragments_file(new_filename)
+        return entry
+    return None
 
 
 def inline_definitions(schema: dict) -> dict:
@@ -127,13 +202,250 @@ def inline_definitions(schema: dict) -> dict:
 
 
 AWS_REGION = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+# Seconds after the last update before the schemas are checked again
+MAX_AGE = 60 * 60 * 24
+# Zip members read ahead per worker process, bounds the memory of a full rebuild
+IN_FLIGHT_PER_WORKER = 4
+# The update may run in a background thread while the caller imports modules, forking a process
+# with other threads can deadlock the child on a lock one of them held, so workers start fresh
+WORKER_START = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def swap_directory(new_path: str, target_path: str):
+    """
+    Replaces target_path with new_path. The old directory is renamed away first and the new one
+    renamed into its place, so the target is never a mix of both, but between the two renames
+    it briefly does not exist.
+    """
+    old_path = target_path + ".old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(target_path):
+        os.rename(target_path, old_path)
+    os.rename(new_path, target_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def staging_directory(parent: str) -> str:
+    """
+    Creates an empty directory next to the database. Unlike tempfile.mkdtemp, which creates it with
+    mode 0700, it gets the permissions of the umask like the db directory it replaces.
+    """
+    while True:
+        path = os.path.join(parent, f".db-{secrets.token_hex(4)}")
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            continue
+
+
+def rebuild_database(zip: zipfile.ZipFile, db_path: str, staging_path: str, source: dict, workers: int | None = None,
+                     layout: str = "directory") -> tuple[int, int]:
+    """
+    Writes the schemas from the zip into staging_path. Members whose content hash matches the
+    previous update are copied from db_path, the others are transformed in a process pool.
+    Members are read from the zip as the pool takes them, at most IN_FLIGHT_PER_WORKER per
+    worker are held in memory at a time.
+
+    Returns the number of transformed and reused schemas.
+    """
+    manifest = load_manifest(db_path) or {}
+    previous = {e["source"]["member"]: e for e in manifest.get("entries", []) if "source" in e}
+
+    entries = []
+    transformed = 0
+    reused = 0
+    # (member, data, future) of the members being transformed, the future is None until the pool is started
+    pending = deque()
+    executor = None
+    window = (workers or os.cpu_count() or 1) * IN_FLIGHT_PER_WORKER
+
+    def finish(member: str, data: bytes, rendered: tuple):
+        new_filename, text, type_name, fragments, tokens = rendered
+        if text is not None:
+            entry = write_schema_file(staging_path, member, new_filename, text, type_name, fragments, data, tokens)
+            if entry:
+                entries.append(entry)
+
+    store = open_pack(db_path, manifest)
+    try:
+        for member in zip.namelist():
+            data = zip.read(member)
+            entry = previous.get(member)
+            if (entry and entry["source"]["sha256"] == hashlib.sha256(data).hexdigest()
+                    and reuse_files(db_path, store, staging_path, entry)):
+                entries.append(entry)
+                reused += 1
+                continue
+            transformed += 1
+            if workers == 1:
+                finish(member, data, render_schema(member, data))
+                continue
+            if executor is None and pending:
+                # A single changed schema is not worth starting the pool
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(WORKER_START))
+                first, first_data, _ = pending.popleft()
+                pending.append((first, first_data, executor.submit(render_schema, first, first_data)))
+            pending.append((member, data, executor.submit(render_schema, member, data) if executor else None))
+            while executor is not None and len(pending) > window:
+                member, data, future = pending.popleft()
+                finish(member, data, future.result())
+        while pending:
+            member, data, future = pending.popleft()
+            finish(member, data, future.result() if future else render_schema(member, data))
+    finally:
+        if store is not None:
+            store.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
-def update_database():
-    if now() - last_update() > 60 * 60 * 24:
-        print("Updating database...")
-        with download_zip(AWS_REGION) as zip:
-            for file in zip.namelist():
-                update_schema_file(zip, file)
+    finish_database(staging_path, entries, source, layout)
+    return transformed, reused
+
+
+def finish_database(staging_path: str, entries: list[dict], source: dict | None, layout: str):
+    """
+    Moves the files into a pack if the layout asks for it and writes the manifest.
+    """
+    pack = None
+    if layout != "directory":
+        names = [name for entry in entries for name in (entry["file"], fragments_file(entry["file"]))]
+        pack = pack_directory(staging_path, names, compress=layout == "compressed")
+    write_manifest(staging_path, entries, source, pack)
+
+
+def open_pack(db_path: str, manifest: dict) -> PackStore | None:
+    if not manifest.get("pack"):
+        return None
+    try:
+        return PackStore(os.path.join(db_path, manifest["pack"]["file"]))
+    except (OSError, ValueError):
+        return None
+
+
+def reuse_files(db_path: str, store: PackStore | None, staging_path: str, entry: dict) -> bool:
+    """
+    Places the schema file of a previous update and its fragments into staging_path, taken from
+    the pack when the previous update was packed. Returns False if any of them is missing.
+    """
+    names = [entry["file"], fragments_file(entry["file"])]
+    if store is not None:
+        if not all(name in store for name in names):
+            return False
+        for name in names:
+            with open(os.path.join(staging_path, name), "wb") as f:
+                f.write(store.read_bytes(name))
+        # The recorded mtime keeps the entry valid when the files stay loose
+        os.utime(os.path.join(staging_path, entry["file"]), ns=(entry["mtime"], entry["mtime"]))
+        return True
+    if not all(os.path.exists(os.path.join(db_path, name)) for name in names):
+        return False
+    for name in names:
+        link_or_copy(os.path.join(db_path, name), os.path.join(staging_path, name))
+    return True
+
+
+def convert_database(db_path: str, layout: str):
+    """
+    Rewrites the db directory in another layout without downloading the schemas again.
+    """
+    manifest = load_manifest(db_path)
+    staging_path = staging_directory(os.path.dirname(db_path))
+    try:
+        store = open_pack(db_path, manifest)
+        try:
+            entries = [entry for entry in manifest["entries"] if reuse_files(db_path, store, staging_path, entry)]
+        finally:
+            if store is not None:
+                store.close()
+        finish_database(staging_path, entries, manifest.get("source"), layout)
+        if os.path.exists(os.path.join(db_path, ".lastupdated")):
+            shutil.copy2(os.path.join(db_path, ".lastupdated"), staging_path)
+        swap_directory(staging_path, db_path)
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+
+
+def link_or_copy(source: str, destination: str):
+    """
+    Hard links the unchanged file into the new directory. Both keep the size and mtime recorded in the manifest.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def snapshot_database(db_path: str, parent: str) -> str:
+    """
+    Hard links the files of the database into a new directory under parent and returns its path.
+    An update never writes into the files of db, it swaps in a new directory, so the snapshot keeps
+    this version of the schemas until it is removed.
+    """
+    os.makedirs(parent, exist_ok=True)
+    snapshot_path = staging_directory(parent)
+    try:
+        for name in os.listdir(db_path):
+            link_or_copy(os.path.join(db_path, name), os.path.join(snapshot_path, name))
+    except BaseException:
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        raise
+    return snapshot_path
+
+
+def update_database(force: bool = False, url: str | None = None, workers: int | None = None, layout: str | None = None,
+                    max_age: float = MAX_AGE, log=print):
+    """
+    Args:
+        force: Update even if the last update was less than max_age seconds ago.
+        url: Where to download the schemas from, defaults to the zip for AWS_REGION.
+        workers: Number of processes transforming the schemas, defaults to the number of CPUs.
+        layout: How to store the schemas (see packstore.LAYOUTS): one file per schema, a single
+            pack or a pack with compressed schemas. Defaults to the layout of the current database.
+        max_age: Seconds after the last update before the schemas are checked again, a day by default.
+        log: Called with the progress messages, print by default.
+
+    Downloads the schemas only if they changed since the previous update, transforms the changed
+    ones into a staging directory and swaps it with the db directory once it is complete.
+    """
+    if layout is not None and layout not in LAYOUTS:
+        raise ValueError(f"Invalid layout: {layout}")
+    db_path = os.path.join(os.getcwd(), "db")
+    manifest = load_manifest(db_path)
+    current_layout = layout_of(manifest)
+    layout = layout or current_layout
+
+    if not force and now() - last_update() <= max_age:
+        log("Database is up to date.")
+        metrics.count("update.skipped")
+        if manifest and layout != current_layout:
+            with metrics.timer("update.convert"):
+                convert_database(db_path, layout)
+        return
+
+    log("Updating database...")
+    with metrics.timer("update.download"):
+        zip, source = download_zip(url or schema_url(AWS_REGION), manifest.get("source") if manifest else None)
+    if zip is None:
+        log("Schemas did not change since the last update.")
+        metrics.count("update.not_modified")
+        if layout != current_layout:
+            with metrics.timer("update.convert"):
+                convert_database(db_path, layout)
         last_update(create=True)
-    else:
-        print("Database is up to date.")
+        return
+
+    staging_path = staging_directory(os.getcwd())
+    try:
+        with zip, metrics.timer("update.rebuild"):
+            transformed, reused = rebuild_database(zip, db_path, staging_path, source, workers, layout)
+        with metrics.timer("update.swap"):
+            swap_directory(staging_path, db_path)
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+    last_update(create=True)
+    metrics.count("update.transformed", transformed)
+    metrics.count("update.reused", reused)
+    log(f"Updated {transformed} schemas, {reused} unchanged.")
@@ -0,0 +1,306 @@
+import difflib
+import schemaindex
+from codec import load_template, YAMLError
+from fragments import ref_name
+from lru import LRUCache
+
+"""
+Checks the templates returned by the agents against the schemas before they are accepted: resource
+types, unknown or misspelled properties, missing required properties, the basic shape of values
+(scalar, list or object) and the targets of Ref, GetAtt and DependsOn. The errors go back to the
+model as one message, which is cheaper than the model loading more schemas to check its own work.
+
+A template with a Transform is expanded by CloudFormation before it is deployed: the AWS::Serverless
+resources become other resources and the macros may add resources and parameters of their own. Only
+the resources CloudFormation knows are checked then and references are not.
+"""
+
+PSEUDO_PARAMETERS = {"AWS::AccountId", "AWS::NotificationARNs", "AWS::NoValue", "AWS::Partition",
+                     "AWS::Region", "AWS::StackId", "AWS::StackName", "AWS::URLSuffix"}
+
+SHAPE_NAMES = {"scalar": "a single value", "list": "a list", "object": "a mapping"}
+
+# At most this many errors are sent back to the model
+MAX_REPORTED = 25
+
+# Resource types whose property sets a validator keeps, a template rarely uses more than a few dozen
+VALIDATOR_TYPES = 256
+
+SERVERLESS_PREFIX = "AWS::Serverless::"
+SERVERLESS_TRANSFORM = "AWS::Serverless-2016-10-31"
+
+
+class PropertySet:
+    """
+    The properties of an object of a schema, computed once per schema node.
+
+    Attributes:
+        properties (dict): Name -> schema node of the property.
+        lower (dict): Lowercase name -> name, to tell a wrong case from a misspelling.
+        required (list): Names of the required properties.
+        strict (bool): Whether other properties are an error.
+    """
+
+    def __init__(self, node: dict, strict: bool):
+        self.properties = node.get('properties') or {}
+        self.lower = {name.lower(): name for name in self.properties}
+        self.required = [name for name in node.get('required', []) if name in self.properties]
+        self.strict = strict and not node.get('patternProperties')
+
+
+class TypeSchema:
+    """
+    The schema of a resource type as the validator uses it.
+
+    Attributes:
+        root (dict): The top level properties and the required ones.
+        definitions (dict): Name -> schema node of the definitions the properties refer to.
+        fragments (dict): The property fragments the schema was built from.
+        sets (dict): id of a schema node -> PropertySet, the nodes are kept alive by fragments.
+    """
+
+    def __init__(self, fragments: dict):
+        self.root = {'properties': fragments['properties'], 'required': fragments['required']}
+        self.definitions = fragments.get('definitions', {})
+        self.fragments = fragments
+        self.sets = {}
+
+
+    def property_set(self, node: dict, strict: bool) -> PropertySet:
+        properties = self.sets.get(id(node))
+        if properties is None:
+            properties = self.sets[id(node)] = PropertySet(node, strict)
+        return properties
+
+
+def is_intrinsic(value) -> bool:
+    """
+    A Ref, Condition or Fn:: function can stand in for any value.
+    """
+    if isinstance(value, dict) and len(value) == 1:
+        key = next(iter(value))
+        return key in ("Ref", "Condition") or key.startswith("Fn::")
+    return False
+
+
+def kind_of(node: dict) -> set[str]:
+    """
+    The shapes a schema node accepts: "scalar", "list" or "object", empty for anything.
+    """
+    types = node.get('type')
+    if types is None:
+        return {"object"} if 'properties' in node else set()
+    kinds = set()
+    for t in types if isinstance(types, list) else [types]:
+        kinds.add("list" if t == "array" else "object" if t == "object" else "scalar")
+    return kinds
+
+
+def strip_fence(text: str) -> str:
+    """
+    Removes the markdown code fence the models sometimes put around the template despite the instructions.
+    """
+    stripped = str(text).strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("\n", 1)[1] if "\n" in stripped else ""
+        if stripped.rstrip().endswith("```"):
+            stripped = stripped.rstrip()[:-3]
+    return stripped
+
+
+def shape_of(value) -> str:
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "list"
+    return "scalar"
+
+
+class TemplateValidator:
+    """
+    Validates templates against the schemas of a SchemaIndex. The property sets of each type and
+    nested object are built on first use from the precomputed property fragments and then reused
+    for the last VALIDATOR_TYPES types. The index keeps one validator for all the agents, see
+    SchemaIndex.validator.
+    """
+
+    FIX_REQUEST = "Fix them and respond with the whole corrected template only:"
+
+    def __init__(self, index, max_types: int = VALIDATOR_TYPES):
+        self.index = index
+        # Type name -> TypeSchema, unknown types are not cached
+        self._types = LRUCache(max_entries=max_types)
+
+
+    def schema_of(self, type_name: str) -> TypeSchema | None:
+        schema = self._types.get(type_name)
+        if schema is None:
+            yaml_file = self.index.type_name_dict.get(type_name.lower())
+            if yaml_file is None:
+                return None
+            schema = TypeSchema(self.index.fragments(yaml_file))
+            self._types.put(type_name, schema)
+        return schema
+
+
+    def validate(self, text: str) -> list[str]:
+        """
+        Returns the problems of the template, an empty list if there are none.
+        """
+        try:
+            template = load_template(strip_fence(text))
+        except YAMLError as e:
+            return [f"The template is not valid YAML: {' '.join(str(e).split())}"]
+        return self.validate_template(template)
+
+
+    def validate_template(self, template) -> list[str]:
+        """
+        Returns the problems of a parsed template.
+        """
+        if not isinstance(template, dict):
+            return ["The template is not a YAML mapping, respond only with the template."]
+        resources = template.get('Resources')
+        if not isinstance(resources, dict) or not resources:
+            return ["The template has no Resources section."]
+
+        errors = []
+        # The transforms add resources and parameters, e.g. the role of an AWS::Serverless::Function
+        transformed = template.get('Transform') is not None
+        names = set(resources) | set(template.get('Parameters') or {}) | PSEUDO_PARAMETERS
+        for logical_id, resource in resources.items():
+            if not isinstance(resource, dict):
+                errors.append(f"{logical_id}: a resource has to be a mapping with Type and Properties.")
+                continue
+            self.validate_resource(logical_id, resource, errors, transformed)
+            if transformed:
+                continue
+            depends_on = resource.get('DependsOn', [])
+            for target in depends_on if isinstance(depends_on, list) else [depends_on]:
+                if isinstance(target, str) and target not in resources:
+                    errors.append(f"{logical_id}.DependsOn: {target} is not a resource of the template.")
+        if not transformed:
+            self.validate_references(template, names, set(resources), errors)
+        return errors
+
+
+    def validate_resource(self, logical_id: str, resource: dict, errors: list, transformed: bool = False):
+        type_name = resource.get('Type')
+        if not isinstance(type_name, str):
+            errors.append(f"{logical_id}: Type is missing.")
+            return
+        if type_name.startswith("Custom::") or type_name == "AWS::CloudFormation::CustomResource" or type_name.endswith("::MODULE"):
+            return
+        if type_name.startswith(SERVERLESS_PREFIX):
+            if not transformed:
+                errors.append(f"{logical_id}: {type_name} needs Transform: {SERVERLESS_TRANSFORM} in the template.")
+            return
+        schema = self.schema_of(type_name)
+        if schema is None:
+            if transformed:
+                # A macro may turn it into resources CloudFormation knows
+                return
+            candidates = [key for key, score in self.index.search(type_name, 3) if score >= 60]
+            hint = f", did you mean {self.display_type(candidates[0])}?" if candidates else "."
+            errors.append(f"{logical_id}: unknown resource type {type_name}{hint}")
+            return
+        properties = resource.get('Properties', {})
+        if properties is None:
+            properties = {}
+        if is_intrinsic(properties):
+            return
+        if not isinstance(properties, dict):
+            errors.append(f"{logical_id}.Properties: expected a mapping.")
+            return
+        self.validate_object(f"{logical_id}.Properties", properties, schema.root, schema, errors, strict=True)
+
+
+    def display_type(self, key: str) -> str:
+        schema = self.schema_of(key)
+        return schema.fragments['typeName'] if schema else key
+
+
+    def validate_object(self, path: str, value: dict, node: dict, schema: TypeSchema, errors: list, strict: bool):
+        properties = schema.property_set(node, strict)
+        for name, child in value.items():
+            child_node = properties.properties.get(name)
+            if child_node is None:
+                if properties.strict and properties.properties:
+                    errors.append(f"{path}.{name}: {self.unknown(name, properties)}")
+                continue
+            self.validate_value(f"{path}.{name}", child, child_node, schema, errors)
+        for name in properties.required:
+            if name not in value:
+                errors.append(f"{path}: missing required property {name}.")
+
+
+    def unknown(self, name: str, properties: PropertySet) -> str:
+        correct = properties.lower.get(name.lower())
+        if correct:
+            return f"property names are case sensitive, use {correct}."
+        close = difflib.get_close_matches(name, properties.properties.keys(), n=1, cutoff=0.75)
+        if close:
+            return f"unknown property, did you mean {close[0]}?"
+        return "unknown property."
+
+
+    def validate_value(self, path: str, value, node: dict, schema: TypeSchema, errors: list, depth: int = 0):
+        if is_intrinsic(value) or depth > 20:
+            return
+        if (ref := ref_name(node)) is not None and ref in schema.definitions:
+            node = schema.definitions[ref]
+        kinds = kind_of(node)
+        shape = shape_of(value)
+        if kinds and shape not in kinds:
+            expected = " or ".join(SHAPE_NAMES[kind] for kind in sorted(kinds))
+            errors.append(f"{path}: expected {expected}, got {SHAPE_NAMES[shape]}.")
+            return
+        if shape == "object" and 'properties' in node:
+            self.validate_object(path, value, node, schema, errors, strict=node.get('additionalProperties') is False)
+        elif shape == "list" and isinstance(node.get('items'), dict):
+            for i, item in enumerate(value):
+                self.validate_value(f"{path}[{i}]", item, node['items'], schema, errors, depth + 1)
+
+
+    def validate_references(self, template: dict, names: set, resources: set, errors: list):
+        """
+        Checks that every Ref points to a parameter, resource or pseudo parameter and every GetAtt to a resource.
+        """
+        stack = [(section, template.get(section)) for section in ('Outputs', 'Conditions')]
+        stack += [(logical_id, resource) for logical_id, resource in template['Resources'].items()]
+        while stack:
+            path, value = stack.pop()
+            if isinstance(value, dict):
+                if len(value) == 1 and isinstance(value.get('Ref'), str) and value['Ref'] not in names:
+                    errors.append(f"{path}: Ref to {value['Ref']}, which is neither a parameter nor a resource.")
+                elif len(value) == 1 and isinstance(value.get('Fn::GetAtt'), list) and value['Fn::GetAtt'] \
+                        and isinstance(value['Fn::GetAtt'][0], str) and value['Fn::GetAtt'][0] not in resources:
+                    errors.append(f"{path}: GetAtt of {value['Fn::GetAtt'][0]}, which is not a resource.")
+                else:
+                    stack.extend((f"{path}.{key}", child) for key, child in value.items())
+            elif isinstance(value, list):
+                stack.extend((f"{path}[{i}]", child) for i, child in enumerate(value))
+
+
+def template_validator(config) -> TemplateValidator | None:
+    """
+    The validator of the schemas the lookups use (see schemaindex.current), None when validation is
+    turned off or no schemas are loaded.
+    """
+    index = schemaindex.active.get() or schemaindex.schemas
+    if not config.validate or index is None:
+        return None
+    return index.validator
+
+
+def feedback(errors: list[str], request: str = TemplateValidator.FIX_REQUEST) -> str | None:
+    """
+    The message sent back to the model, None when there are no errors.
+    """
+    if not errors:
+        return None
+    lines = [f"The template has {len(errors)} problem{'s' if len(errors) > 1 else ''} according to the CloudFormation schemas. {request}"]
+    lines += [f"- {error}" for error in errors[:MAX_REPORTED]]
+    if len(errors) > MAX_REPORTED:
+        lines.append(f"- ... and {len(errors) - MAX_REPORTED} more of the same kind.")
+    return "\n".join(lines)